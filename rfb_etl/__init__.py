@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+RFB ETL - Importação dos dados abertos de CNPJ da Receita Federal
+- Um único ponto de entrada: rfb-etl (ou python -m rfb_etl)
+- Módulos carregados sob demanda (--help não importa psycopg2/pyarrow)
+"""
+__version__ = "0.1.0"
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+RFB AGENDADOR - Detecta novas publicações mensais e importa sozinho
+- Consulta o índice dados_abertos_cnpj (RFB_URL_DADOS aponta p/ espelho local)
+- Novo diretório YYYY-MM só é ingerido com os 10 Estabelecimentos{N}.zip
+  publicados e com tamanhos estáveis entre duas consultas
+- Motor com pool de processos, maiores arquivos primeiro (--estrategia como no importar)
+- mensal/snapshot recarregam o mês inteiro a cada tentativa (a tabela do mês é recriada)
+- Lock de arquivo impede execuções sobrepostas
+- Status por publicação em rfb_agendador_estado.json
+
+Uso:
+  rfb-etl agendador [--uma-vez] [--intervalo MIN] [--workers N] [--estrategia upsert|direto|mensal|snapshot]
+"""
+import fcntl, json, os, re, time, urllib.request
+from datetime import datetime
+
+from .comum import URL_DADOS
+from .motor import importar
+
+ARQUIVOS_ESPERADOS = [f"Estabelecimentos{n}.zip" for n in range(10)]
+ARQUIVO_ESTADO = os.environ.get("RFB_AGENDADOR_ESTADO", "rfb_agendador_estado.json")
+ARQUIVO_LOCK = os.environ.get("RFB_AGENDADOR_LOCK", "rfb_agendador.lock")
+INTERVALO_MIN = 60
+WORKERS = 3
+ESTRATEGIA = "upsert"
+MAX_TENTATIVAS = 3
+
+
+def _abrir_url(url, metodo="GET"):
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'}, method=metodo)
+    return urllib.request.urlopen(req, timeout=60)
+
+
+def listar_meses():
+    """Diretórios YYYY-MM publicados no índice, do mais novo para o mais antigo"""
+    html = _abrir_url(f"{URL_DADOS}/").read().decode('utf-8', 'replace')
+    return sorted(set(re.findall(r'href="(\d{4}-\d{2})/?"', html)), reverse=True)
+
+
+def tamanhos_publicados(mes_ano):
+    """{arquivo: bytes} dos Estabelecimentos já publicados no mês (HEAD em cada ZIP listado)"""
+    html = _abrir_url(f"{URL_DADOS}/{mes_ano}/").read().decode('utf-8', 'replace')
+    listados = set(re.findall(r'href="([^"/]+\.zip)"', html))
+    tamanhos = {}
+    for nome in ARQUIVOS_ESPERADOS:
+        if nome in listados:
+            resposta = _abrir_url(f"{URL_DADOS}/{mes_ano}/{nome}", metodo="HEAD")
+            tamanhos[nome] = int(resposta.headers.get("Content-Length") or 0)
+            resposta.close()
+    return tamanhos
+
+
+def carregar_estado():
+    try:
+        with open(ARQUIVO_ESTADO, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"releases": {}}
+
+
+def salvar_estado(estado):
+    """Grava o estado de forma atômica (tmp + rename)"""
+    tmp = f"{ARQUIVO_ESTADO}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(estado, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, ARQUIVO_ESTADO)
+
+
+def adquirir_lock():
+    """Lock exclusivo não bloqueante; retorna o handle (mantenha aberto) ou None"""
+    handle = open(ARQUIVO_LOCK, 'w')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        handle.close()
+        return None
+    handle.write(str(os.getpid()))
+    handle.flush()
+    return handle
+
+
+def ingerir_mes(mes_ano, tamanhos, estado, workers=WORKERS, estrategia=ESTRATEGIA):
+    """Importa os 10 arquivos do mês no pool, maiores primeiro. Retorna True se todos deram certo"""
+    release = estado["releases"][mes_ano]
+    release.update(status="em_andamento", inicio=datetime.now().isoformat(timespec='seconds'),
+                   tentativas=release.get("tentativas", 0) + 1, estrategia=estrategia)
+    arquivos = release.setdefault("arquivos", {})
+    # Partição/snapshot do mês é recriada no início: os concluídos antes se perdem
+    if estrategia in ("mensal", "snapshot"):
+        arquivos.clear()
+    salvar_estado(estado)
+
+    # Arquivo maior = mais demorado; começar por ele encurta o tempo total do pool
+    pendentes = sorted(
+        (int(re.search(r"\d+", nome).group()) for nome in ARQUIVOS_ESPERADOS
+         if arquivos.get(nome, {}).get("status") != "concluido"),
+        key=lambda n: tamanhos.get(f"Estabelecimentos{n}.zip", 0), reverse=True,
+    )
+    print(f"\n🚀 Ingerindo {mes_ano}: arquivos {pendentes} | {workers} workers | {estrategia}")
+
+    def ao_concluir(arquivo_num, resultado, erro):
+        nome = f"Estabelecimentos{arquivo_num}.zip"
+        if erro is None:
+            arquivos[nome] = {"status": "concluido", **resultado}
+        else:
+            arquivos[nome] = {"status": "falhou", "erro": str(erro)[:300]}
+        salvar_estado(estado)
+
+    importar(mes_ano, pendentes, estrategia=estrategia, workers=workers, ao_concluir=ao_concluir)
+
+    sucesso = all(arquivos.get(nome, {}).get("status") == "concluido" for nome in ARQUIVOS_ESPERADOS)
+    release.update(status="concluido" if sucesso else "falhou",
+                   fim=datetime.now().isoformat(timespec='seconds'))
+    salvar_estado(estado)
+    return sucesso
+
+
+def verificar(estado, workers=WORKERS, estrategia=ESTRATEGIA):
+    """Uma rodada: procura o mês mais novo e ingere se estiver completo e estável"""
+    meses = listar_meses()
+    if not meses:
+        print("⚠️  Nenhum diretório YYYY-MM encontrado no índice")
+        return None
+
+    mes_ano = meses[0]
+    release = estado["releases"].setdefault(mes_ano, {"status": "detectado"})
+    if release["status"] == "concluido":
+        print(f"💤 {mes_ano} já importado ({release.get('fim')})")
+        return None
+    if release["status"] == "falhou" and release.get("tentativas", 0) >= MAX_TENTATIVAS:
+        print(f"⛔ {mes_ano} falhou {release['tentativas']}x, aguardando intervenção")
+        return None
+
+    tamanhos = tamanhos_publicados(mes_ano)
+    faltando = [nome for nome in ARQUIVOS_ESPERADOS if not tamanhos.get(nome)]
+    if faltando:
+        release.update(status="aguardando", tamanhos=tamanhos)
+        salvar_estado(estado)
+        print(f"⏳ {mes_ano}: faltam {len(faltando)} arquivos ({', '.join(faltando[:3])}...)")
+        return None
+
+    # Upload da RFB ainda pode estar em andamento: exige tamanhos iguais aos da última consulta
+    if release.get("tamanhos") != tamanhos and release["status"] != "falhou":
+        release.update(status="aguardando", tamanhos=tamanhos)
+        salvar_estado(estado)
+        print(f"⏳ {mes_ano}: conjunto completo, confirmando tamanhos na próxima consulta")
+        return None
+
+    release["tamanhos"] = tamanhos
+    return ingerir_mes(mes_ano, tamanhos, estado, workers, estrategia)
+
+
+def executar(uma_vez=False, intervalo=INTERVALO_MIN, workers=WORKERS, estrategia=ESTRATEGIA):
+    """Loop do daemon (ou uma única rodada); retorna código de saída"""
+    lock = adquirir_lock()
+    if lock is None:
+        print(f"🔒 Outra execução do agendador está ativa ({ARQUIVO_LOCK})")
+        return 1
+
+    print("\n🕒 RFB AGENDADOR")
+    print(f"🌐 {URL_DADOS} | ⏱️ a cada {intervalo:g}min | 👷 {workers} workers | 🧭 {estrategia}")
+
+    while True:
+        print(f"\n🔍 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} consultando índice...")
+        try:
+            verificar(carregar_estado(), workers, estrategia)
+        except Exception as e:
+            print(f"⚠️  Falha na consulta: {e}")
+        if uma_vez:
+            return 0
+        time.sleep(intervalo * 60)
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+RFB ETL CLI - rfb-etl <comando> [opções]
+- importar: motor único (estratégia, filtro, arquivos, destino, paralelismo)
+- perfis: perfis de CNAE materializados no servidor
+- agendador: daemon que detecta e importa novas publicações
+- colunar: inspeção do cache Arrow
+- indice: consulta/benchmark do índice local de CNPJs
+- fila: fila de trabalho no PostgreSQL p/ dividir a carga entre máquinas
+- mudancas: exporta o feed de mudanças gerado pelo UPSERT
+- juncao: Estabelecimentos × Empresas numa tabela larga (merge-join em disco)
+- servidor: benchmark da carga por COPY no servidor × cliente
+- memoria: verificação do teto de memória com arquivo sintético
+- snapshot: lista, publica e reverte os snapshots mensais (view estabelecimentos_atual)
+Os módulos pesados só são importados dentro de cada comando.
+"""
+import argparse, json
+
+
+def _arquivos(valor):
+    """'0-9' | '3' | '1,4,7'  →  [0, ..., 9] | [3] | [1, 4, 7]"""
+    arquivos = []
+    for parte in valor.split(','):
+        if '-' in parte:
+            inicio, fim = parte.split('-', 1)
+            arquivos.extend(range(int(inicio), int(fim) + 1))
+        elif parte.strip():
+            arquivos.append(int(parte))
+    return arquivos
+
+
+def _cnaes(valor):
+    """'padrao' = 14 CNAEs históricos; senão lista separada por vírgula"""
+    if valor == "padrao":
+        from .comum import CNAES_PERMITIDOS
+        return set(CNAES_PERMITIDOS)
+    return {c.strip() for c in valor.split(',') if c.strip()}
+
+
+def _alvos_governador(valor):
+    from .governador import alvos
+    try:
+        return alvos(valor)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _imprimir_json(resumo):
+    print(f'\n{json.dumps(resumo, ensure_ascii=False)}')
+
+
+def cmd_importar(args):
+    mes_ano = args.mes
+    if mes_ano is None:
+        from .agendador import listar_meses
+        mes_ano = listar_meses()[0]
+        print(f"📅 Mês mais recente publicado: {mes_ano}")
+
+    from .motor import importar
+    resumo = importar(
+        mes_ano, args.arquivos, estrategia=args.estrategia, destino=args.destino,
+        cnaes=args.cnaes, apenas_principal=args.apenas_principal, workers=args.workers,
+        csv_local=args.csv_local, cache_colunar=args.cache_colunar,
+        deduplicar=not args.sem_dedup, indice_dir=args.indice,
+        registrar_mudancas=args.mudancas, spool_dir=args.spool, spool_limite_mb=args.spool_limite_mb,
+        alvos_governador=args.governador, reconciliar=args.reconciliar,
+        servidor_dir=args.servidor, servidor_dir_banco=args.servidor_dir_banco, servidor_unzip=args.servidor_unzip,
+        memoria_mb=args.memoria_mb, perfil_memoria=args.perfil_memoria,
+        publicar_snapshot=not args.nao_publicar, substituir_snapshot=args.substituir_snapshot,
+    )
+    _imprimir_json(resumo)
+    return 0 if resumo["status"] == "success" else 1
+
+
+def cmd_perfis(args):
+    from .comum import conectar_db
+    from . import perfis
+
+    conn = conectar_db()
+    perfis.criar_esquema(conn)
+    if args.acao == "perfil":
+        import time
+        inicio = time.time()
+        afetados = perfis.materializar_perfil(conn, args.nome, args.cnaes, args.destino, args.apenas_principal)
+        linhas = "-" if afetados is None else f"{afetados:,}"
+        print(f"✅ Perfil {args.nome} ({len(args.cnaes)} CNAEs → {args.destino}): {linhas} linhas | {time.time() - inicio:.1f}s")
+    elif args.acao == "atualizar":
+        perfis.atualizar_perfis(conn)
+    else:
+        perfis.listar_perfis(conn)
+    conn.close()
+    return 0
+
+
+def cmd_agendador(args):
+    from .agendador import executar
+    return executar(uma_vez=args.uma_vez, intervalo=args.intervalo, workers=args.workers,
+                    estrategia=args.estrategia)
+
+
+def cmd_colunar(args):
+    from .colunar import info
+    for caminho in args.caminhos:
+        info(caminho)
+    return 0
+
+
+def cmd_indice(args):
+    from .indice import IndiceCNPJ, benchmark
+    with IndiceCNPJ(args.dir) as idx:
+        if args.acao == "buscar":
+            for cnpj in args.cnpjs:
+                registro = idx.buscar(cnpj)
+                print(json.dumps({"cnpj": cnpj, "registro": registro}, ensure_ascii=False))
+        else:
+            _imprimir_json(benchmark(idx, args.consultas))
+    return 0
+
+
+def cmd_fila(args):
+    from . import fila
+    if args.acao == "enfileirar":
+        fila.enfileirar(args.mes, args.arquivos, estrategia=args.estrategia, cnaes=args.cnaes,
+                        apenas_principal=args.apenas_principal, deduplicar=not args.sem_dedup,
+                        reiniciar=args.reiniciar, substituir_snapshot=args.substituir_snapshot)
+        return 0
+    if args.acao == "trabalhar":
+        return fila.executar(args.processos, args.lease, args.max_tentativas)
+    fila.status(args.mes)
+    return 0
+
+
+def cmd_mudancas(args):
+    from .comum import conectar_db
+    from . import mudancas
+
+    conn = conectar_db()
+    mudancas.criar_esquema(conn)
+    if args.acao == "exportar":
+        mudancas.exportar(conn, args.mes, args.desde_id, args.saida)
+    else:
+        mudancas.resumo(conn, args.mes)
+    conn.close()
+    return 0
+
+
+def cmd_juncao(args):
+    from .denormalizado import executar
+    resumo = executar(args.mes, args.arquivos, args.empresas, cnaes=args.cnaes,
+                      apenas_principal=args.apenas_principal, workers=args.workers,
+                      tabela=args.tabela, saida=args.saida, temp=args.temp)
+    _imprimir_json(resumo)
+    return 0
+
+
+def cmd_servidor(args):
+    from .servidor import benchmark
+    _imprimir_json(benchmark(args.mes, args.arquivos, args.dir, args.dir_banco, estrategia=args.estrategia,
+                             cnaes=args.cnaes, apenas_principal=args.apenas_principal))
+    return 0
+
+
+def cmd_snapshot(args):
+    from . import snapshot
+    from .comum import conectar_db
+    conn = conectar_db()
+    try:
+        if args.acao == "publicar":
+            snapshot.publicar(conn, args.tabela or snapshot.tabela_do_mes(conn, args.mes), args.manter)
+        elif args.acao == "reverter":
+            snapshot.reverter(conn)
+        snapshot.listar(conn)
+    finally:
+        conn.close()
+    return 0
+
+
+def cmd_memoria(args):
+    from .memoria import verificar
+    ok, resumo = verificar(args.tamanho_mb, args.memoria_mb, args.dir, args.banco)
+    _imprimir_json(resumo)
+    return 0 if ok else 1
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(
+        prog="rfb-etl", description="Importação dos Estabelecimentos (dados abertos CNPJ/RFB)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("importar", help="importa Estabelecimentos{N}.zip de um mês")
+    p.add_argument("--mes", help="YYYY-MM (padrão: mais recente publicado)")
+    p.add_argument("--estrategia", choices=("upsert", "direto", "mensal", "snapshot"), default="upsert",
+                   help="upsert: staging + UPSERT | direto: INSERT ON CONFLICT DO NOTHING | "
+                        "mensal: partição sem filtro + perfis no servidor | "
+                        "snapshot: tabela nova do mês publicada na view estabelecimentos_atual")
+    p.add_argument("--arquivos", type=_arquivos, default=list(range(10)),
+                   help="ex.: 0-9, 3 ou 1,4,7 (padrão: 0-9)")
+    p.add_argument("--cnaes", type=_cnaes, help="filtro no cliente: 'padrao' ou lista 4744099,4744005")
+    p.add_argument("--apenas-principal", action="store_true", help="filtro só no CNAE principal")
+    p.add_argument("--destino", choices=("postgres", "colunar", "nulo"), default="postgres")
+    p.add_argument("--workers", type=int, default=1, help="processos em paralelo (1 arquivo cada)")
+    p.add_argument("--csv-local", help="CSV já descompactado (use com um único arquivo)")
+    p.add_argument("--cache-colunar", help="diretório do cache Arrow (lê se existir, grava se não; ignorado com --csv-local)")
+    p.add_argument("--sem-dedup", action="store_true", help="não deduplicar CNPJs no cliente")
+    p.add_argument("--indice", help="diretório do índice local de CNPJs (reconstruído ao final)")
+    p.add_argument("--mudancas", action="store_true",
+                   help="grava novos/alterados em estabelecimentos_mudancas (só upsert)")
+    p.add_argument("--spool", help="diretório do spool em disco (leitura não espera o banco; retoma após queda)")
+    p.add_argument("--spool-limite-mb", type=float, help="tamanho máximo do spool (padrão: 2048)")
+    p.add_argument("--governador", nargs="?", const="padrao", type=_alvos_governador,
+                   help="ritmo pela saúde do banco; alvos opcionais: ativas=20,lock=2,lag=10,"
+                        "checkpoints=2,taxa_min=2000,taxa_max=200000,intervalo=5")
+    p.add_argument("--reconciliar", action="store_true",
+                   help="confere carga × banco por checksums por faixa de CNPJ e UF (upsert/mensal/snapshot)")
+    p.add_argument("--nao-publicar", action="store_true",
+                   help="snapshot fica pronto (indexado) sem trocar a view; publique com 'snapshot publicar'")
+    p.add_argument("--substituir-snapshot", action="store_true",
+                   help="apaga o snapshot pronto/revertido do mês em vez de recusar a carga")
+    p.add_argument("--servidor", metavar="DIR",
+                   help="banco lê o arquivo de DIR (COPY no servidor; importador na mesma máquina/pod)")
+    p.add_argument("--servidor-dir-banco", help="caminho do DIR visto pelo banco (padrão: o mesmo)")
+    p.add_argument("--servidor-unzip", action="store_true",
+                   help="COPY FROM PROGRAM 'unzip -p' (sem descompactar no Python)")
+    p.add_argument("--memoria-mb", type=float,
+                   help="teto de memória (dividido entre os --workers; padrão: $RFB_MEMORIA_MB ou sem teto)")
+    p.add_argument("--perfil-memoria", nargs="?", const=15, type=int, metavar="N",
+                   help="tracemalloc no laço de leitura/envio: top N locais de alocação por arquivo")
+    p.set_defaults(func=cmd_importar)
+
+    p = sub.add_parser("perfis", help="perfis de CNAE sobre estabelecimentos_mensal")
+    acoes = p.add_subparsers(dest="acao", required=True)
+    acoes.add_parser("listar")
+    acoes.add_parser("atualizar", help="rematerializa todos os perfis")
+    a = acoes.add_parser("perfil", help="cria/atualiza e materializa um perfil")
+    a.add_argument("nome")
+    a.add_argument("cnaes", type=_cnaes)
+    a.add_argument("--destino", choices=("view", "materializada", "estabelecimentos"), default="view")
+    a.add_argument("--apenas-principal", action="store_true")
+    p.set_defaults(func=cmd_perfis)
+
+    p = sub.add_parser("agendador", help="detecta novas publicações e importa")
+    p.add_argument("--uma-vez", action="store_true", help="uma rodada e sai")
+    p.add_argument("--intervalo", type=float, default=60, help="minutos entre consultas")
+    p.add_argument("--workers", type=int, default=3)
+    p.add_argument("--estrategia", choices=("upsert", "direto", "mensal", "snapshot"), default="upsert")
+    p.set_defaults(func=cmd_agendador)
+
+    p = sub.add_parser("colunar", help="inspeciona arquivos do cache Arrow")
+    p.add_argument("caminhos", nargs="+")
+    p.set_defaults(func=cmd_colunar)
+
+    p = sub.add_parser("indice", help="consulta o índice local de CNPJs (mmap)")
+    p.add_argument("--dir", default=None, help="diretório do índice (padrão: $RFB_INDICE ou indice_cnpj)")
+    acoes = p.add_subparsers(dest="acao", required=True)
+    a = acoes.add_parser("buscar")
+    a.add_argument("cnpjs", nargs="+")
+    a = acoes.add_parser("benchmark")
+    a.add_argument("--consultas", type=int, default=100_000)
+    p.set_defaults(func=cmd_indice)
+
+    p = sub.add_parser("fila", help="fila de trabalho compartilhada (FOR UPDATE SKIP LOCKED)")
+    acoes = p.add_subparsers(dest="acao", required=True)
+    a = acoes.add_parser("enfileirar", help="coloca os arquivos de um mês na fila")
+    a.add_argument("--mes", required=True, help="YYYY-MM")
+    a.add_argument("--estrategia", choices=("upsert", "direto", "mensal", "snapshot"), default="upsert")
+    a.add_argument("--arquivos", type=_arquivos, default=list(range(10)))
+    a.add_argument("--cnaes", type=_cnaes)
+    a.add_argument("--apenas-principal", action="store_true")
+    a.add_argument("--sem-dedup", action="store_true")
+    a.add_argument("--reiniciar", action="store_true", help="zera itens já existentes do mês")
+    a.add_argument("--substituir-snapshot", action="store_true",
+                   help="apaga o snapshot pronto/revertido do mês em vez de recusar a carga")
+    a = acoes.add_parser("trabalhar", help="processa itens até a fila esvaziar")
+    a.add_argument("--processos", type=int, default=1, help="workers neste host")
+    a.add_argument("--lease", type=int, default=300, help="segundos sem heartbeat até liberar o item")
+    a.add_argument("--max-tentativas", type=int, default=3)
+    a = acoes.add_parser("status")
+    a.add_argument("--mes")
+    p.set_defaults(func=cmd_fila)
+
+    p = sub.add_parser("mudancas", help="feed de mudanças (estabelecimentos_mudancas)")
+    acoes = p.add_subparsers(dest="acao", required=True)
+    a = acoes.add_parser("exportar", help="JSON lines em ordem de id")
+    a.add_argument("--mes")
+    a.add_argument("--desde-id", type=int, default=0, help="último id já consumido")
+    a.add_argument("--saida", help="arquivo .jsonl (padrão: stdout)")
+    a = acoes.add_parser("resumo")
+    a.add_argument("--mes")
+    p.set_defaults(func=cmd_mudancas)
+
+    p = sub.add_parser("juncao", help="Estabelecimentos × Empresas (razão social, capital, porte)")
+    p.add_argument("--mes", required=True, help="YYYY-MM")
+    p.add_argument("--arquivos", type=_arquivos, default=list(range(10)), help="Estabelecimentos (padrão: 0-9)")
+    p.add_argument("--empresas", type=_arquivos, default=list(range(10)), help="Empresas (padrão: 0-9)")
+    p.add_argument("--cnaes", type=_cnaes)
+    p.add_argument("--apenas-principal", action="store_true")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--tabela", default="estabelecimentos_empresas")
+    p.add_argument("--saida", help="grava CSV em vez da tabela")
+    p.add_argument("--temp", default="rfb_juncao_tmp", help="diretório das partições em disco")
+    p.set_defaults(func=cmd_juncao)
+
+    p = sub.add_parser("servidor", help="carga por COPY no servidor (importador ao lado do banco)")
+    acoes = p.add_subparsers(dest="acao", required=True)
+    a = acoes.add_parser("benchmark", help="mesmo CSV pelo cliente e pelo servidor")
+    a.add_argument("--mes", required=True, help="YYYY-MM")
+    a.add_argument("--dir", required=True, help="diretório que o banco também enxerga")
+    a.add_argument("--dir-banco", help="caminho do --dir visto pelo banco (padrão: o mesmo)")
+    a.add_argument("--arquivos", type=_arquivos, default=[0])
+    a.add_argument("--estrategia", choices=("upsert", "direto"), default="upsert")
+    a.add_argument("--cnaes", type=_cnaes)
+    a.add_argument("--apenas-principal", action="store_true")
+    p.set_defaults(func=cmd_servidor)
+
+    p = sub.add_parser("memoria", help="orçamento de memória da importação")
+    acoes = p.add_subparsers(dest="acao", required=True)
+    a = acoes.add_parser("verificar", help="importa um arquivo sintético com o teto e confere o pico de RSS")
+    a.add_argument("--tamanho-mb", type=float, default=1024, help="CSV descompactado (padrão: 1024)")
+    a.add_argument("--memoria-mb", type=float, default=256, help="teto a respeitar (padrão: 256)")
+    a.add_argument("--dir", help="onde gerar o arquivo (padrão: diretório temporário do sistema)")
+    a.add_argument("--banco", action="store_true",
+                   help="carrega num snapshot descartável de 2099-01 (sem publicar) em vez do destino nulo")
+    p.set_defaults(func=cmd_memoria)
+
+    p = sub.add_parser("snapshot", help="snapshots mensais blue/green (view estabelecimentos_atual)")
+    acoes = p.add_subparsers(dest="acao", required=True)
+    acoes.add_parser("listar")
+    a = acoes.add_parser("publicar", help="troca a view para um snapshot pronto (ou anterior)")
+    grupo = a.add_mutually_exclusive_group(required=True)
+    grupo.add_argument("--mes", help="YYYY-MM (snapshot mais recente do mês)")
+    grupo.add_argument("--tabela", help="nome exato da tabela")
+    a.add_argument("--manter", type=int, default=1, help="snapshots anteriores guardados p/ rollback")
+    acoes.add_parser("reverter", help="volta a view para o snapshot anterior")
+    p.set_defaults(func=cmd_snapshot)
+
+    return parser
+
+
+def main(argv=None):
+    args = criar_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        print(f"\n❌ ERRO GERAL: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
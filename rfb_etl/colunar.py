@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+RFB COLUNAR - Cache intermediário em Arrow IPC (Feather v2) por arquivo
+- CSV é lido/descompactado UMA vez; recargas e novos filtros leem o cache
+- Colunas de baixa cardinalidade em dicionário (uf, cnae, situação...)
+- Datas AAAAMMDD viram date32; o que o date32 não reproduz byte a byte ('', '0', '00000000',
+  20230231, 2020-01-01...) fica também em <coluna>_original (dicionário) e volta igual na releitura
+- Leitura via memory map (zero-cópia), sem passar pelo zip nem pelo csv
+- Gravação atômica: .tmp + rename, cache parcial nunca é reaproveitado
+
+Uso:
+  rfb-etl importar --mes 2024-01 --destino colunar --cache-colunar DIRETORIO
+  rfb-etl colunar CAMINHO.arrow [CAMINHO.arrow ...]
+"""
+import os, sys, time
+
+from . import memoria
+from .comum import COLUNAS_ESTABELECIMENTOS, abrir_csv, ler_linhas
+
+LOTE_LINHAS = 100_000
+
+COLUNAS_DICIONARIO = {
+    "identificador_matriz_filial", "situacao_cadastral", "motivo_situacao_cadastral",
+    "nome_cidade_exterior", "pais", "cnae_fiscal_principal", "tipo_logradouro",
+    "uf", "municipio", "ddd_1", "ddd_2", "ddd_fax", "situacao_especial",
+}
+COLUNAS_DATA = {"data_situacao_cadastral", "data_inicio_atividade", "data_situacao_especial"}
+SUFIXO_ORIGINAL = "_original"
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        import subprocess
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "pyarrow"])
+        import pyarrow
+    import pyarrow.compute
+    import pyarrow.ipc
+    return pyarrow
+
+
+def caminho_colunar(diretorio, mes_ano, arquivo_nome):
+    """<diretorio>/<mes_ano>/Estabelecimentos0.arrow"""
+    return os.path.join(diretorio, mes_ano, os.path.splitext(arquivo_nome)[0] + ".arrow")
+
+
+def esquema():
+    pa = _pyarrow()
+    campos = []
+    for coluna in COLUNAS_ESTABELECIMENTOS:
+        if coluna in COLUNAS_DICIONARIO:
+            tipo = pa.dictionary(pa.int32(), pa.string())
+        elif coluna in COLUNAS_DATA:
+            tipo = pa.date32()
+        else:
+            tipo = pa.string()
+        campos.append(pa.field(coluna, tipo))
+    for coluna in COLUNAS_ESTABELECIMENTOS:
+        if coluna in COLUNAS_DATA:
+            campos.append(pa.field(coluna + SUFIXO_ORIGINAL, pa.dictionary(pa.int32(), pa.string())))
+    return pa.schema(campos)
+
+
+class GravadorColunar:
+    """Acumula linhas (tuplas de 30 strings) e grava record batches no arquivo .arrow"""
+
+    def __init__(self, caminho):
+        self.pa = _pyarrow()
+        self.caminho = caminho
+        self.tmp = f"{caminho}.tmp"
+        self.esquema = esquema()
+        self.linhas = 0
+        self._lote = []
+        # Tuplas + arrays Arrow do batch em construção
+        self.lote_linhas = memoria.atual().linhas("colunar", memoria.CUSTO_LINHA * 2, LOTE_LINHAS)
+        # Dicionários crescem entre batches => só deltas são gravados
+        self._dicionarios = {c: {} for c in COLUNAS_ESTABELECIMENTOS if c in COLUNAS_DICIONARIO}
+        self._dicionarios.update({c + SUFIXO_ORIGINAL: {} for c in COLUNAS_DATA})
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        self._writer = self.pa.ipc.new_file(
+            self.tmp, self.esquema,
+            options=self.pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True),
+        )
+
+    def adicionar(self, row):
+        self._lote.append(row)
+        if len(self._lote) >= self.lote_linhas:
+            self._gravar_lote()
+
+    def fechar(self):
+        """Grava o resto e publica o arquivo (rename atômico)"""
+        self._gravar_lote()
+        self._writer.close()
+        os.replace(self.tmp, self.caminho)
+
+    def abortar(self):
+        try:
+            self._writer.close()
+        finally:
+            if os.path.exists(self.tmp):
+                os.remove(self.tmp)
+
+    def _gravar_lote(self):
+        if not self._lote:
+            return
+        pa, pc = self.pa, self.pa.compute
+        arrays, originais = [], []
+        for coluna, valores in zip(COLUNAS_ESTABELECIMENTOS, zip(*self._lote)):
+            if coluna in self._dicionarios:
+                arrays.append(self._dicionario(coluna, valores))
+            elif coluna in COLUNAS_DATA:
+                texto = pa.array(valores, pa.string())
+                datas = pc.strptime(texto, format="%Y%m%d", unit="s", error_is_null=True).cast(pa.date32())
+                arrays.append(datas)
+                # strptime normaliza (20230231 => 20230303) ou anula: guarda o texto quando não volta igual
+                volta = pc.fill_null(pc.strftime(datas, format="%Y%m%d"), "")
+                originais.append(self._dicionario(coluna + SUFIXO_ORIGINAL, [
+                    None if igual else v for v, igual in zip(valores, pc.equal(volta, texto).to_pylist())]))
+            else:
+                arrays.append(pa.array(valores, pa.string()))
+        arrays.extend(originais)
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.esquema))
+        self.linhas += len(self._lote)
+        self._lote = []
+
+    def _dicionario(self, coluna, valores):
+        """DictionaryArray com o dicionário acumulado da coluna (None = nulo)"""
+        pa = self.pa
+        dicionario = self._dicionarios[coluna]
+        indices = [None if v is None else dicionario.setdefault(v, len(dicionario)) for v in valores]
+        return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), pa.array(list(dicionario), pa.string()))
+
+
+def tabela_colunar(caminho):
+    """pyarrow.Table memory-mapped (zero-cópia) para filtros/análises vetorizadas"""
+    pa = _pyarrow()
+    return pa.ipc.open_file(pa.memory_map(caminho, 'r')).read_all()
+
+
+def ler_colunar(caminho):
+    """Gera as linhas (tuplas de 30 strings) no mesmo formato de rfb_comum.ler_linhas"""
+    pa = _pyarrow()
+    pc = pa.compute
+    leitor = pa.ipc.open_file(pa.memory_map(caminho, 'r'))
+    # Batch gravado sem teto pode ser maior que a cota: vira listas Python em fatias
+    passo = memoria.atual().linhas("colunar", memoria.CUSTO_LINHA, LOTE_LINHAS)
+    for i in range(leitor.num_record_batches):
+        batch = leitor.get_batch(i)
+        for inicio in range(0, batch.num_rows, passo):
+            fatia = batch.slice(inicio, passo)
+            colunas = []
+            for coluna in COLUNAS_ESTABELECIMENTOS:
+                array = fatia.column(coluna)
+                if coluna in COLUNAS_DATA:
+                    original = fatia.column(coluna + SUFIXO_ORIGINAL).cast(pa.string())
+                    array = pc.coalesce(original, pc.fill_null(pc.strftime(array, format="%Y%m%d"), ""))
+                colunas.append(array.to_pylist())
+            yield from zip(*colunas)
+
+
+def cache_valido(caminho):
+    """Cache gravado com o esquema atual (os antigos perdiam datas fora do padrão)"""
+    pa = _pyarrow()
+    return pa.ipc.open_file(pa.memory_map(caminho, 'r')).schema.equals(esquema())
+
+
+def linhas_com_cache(mes_ano, arquivo_nome, diretorio):
+    """
+    Linhas do arquivo + tamanho_mb do download. Se o cache existe, lê dele
+    (tamanho_mb = 0); senão baixa o ZIP da RFB e grava o cache enquanto as linhas passam.
+    O cache é chaveado por mês/arquivo: só a fonte oficial grava nele (CSV local não).
+    """
+    caminho = caminho_colunar(diretorio, mes_ano, arquivo_nome)
+    if os.path.exists(caminho):
+        if cache_valido(caminho):
+            print(f"      ⚡ Cache colunar: {caminho}")
+            return ler_colunar(caminho), 0
+        print(f"      ♻️  Cache colunar em formato antigo (datas sem o texto original), regravando: {caminho}")
+
+    csv_file, tamanho_mb = abrir_csv(mes_ano, arquivo_nome)
+
+    def gerar():
+        gravador = GravadorColunar(caminho)
+        try:
+            for row in ler_linhas(csv_file):
+                gravador.adicionar(row)
+                yield row
+        except BaseException:
+            gravador.abortar()
+            raise
+        finally:
+            csv_file.close()
+        gravador.fechar()
+        print(f"      💾 Cache colunar gravado: {caminho} ({os.path.getsize(caminho) / (1024 * 1024):.1f}MB)")
+
+    return gerar(), tamanho_mb
+
+
+def info(caminho):
+    """Resumo do arquivo .arrow: linhas, tamanho e tempo para mapear"""
+    inicio = time.time()
+    tabela = tabela_colunar(caminho)
+    print(f"📄 {caminho}: {tabela.num_rows:,} linhas | {os.path.getsize(caminho) / (1024 * 1024):.1f}MB "
+          f"| mapeado em {(time.time() - inicio) * 1000:.1f}ms")
+    print(tabela.schema)
+    return tabela.num_rows
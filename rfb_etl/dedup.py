@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+RFB DEDUP - Remove CNPJs duplicados ANTES de enviar ao banco
+- Chave: cnpj_basico + cnpj_ordem + cnpj_dv empacotada em inteiro de 64 bits
+- Matrizes (ordem 0001): bitmap de 10^8 bits indexado pelo cnpj_basico (12,5MB)
+- Filiais: array('Q') ordenado + buffer pequeno (busca binária)
+- Separa duplicatas do MESMO arquivo e de arquivos ANTERIORES
+- Um mês inteiro (~60M chaves) cabe em algumas dezenas de MB
+- Com limite_bytes (cota do orçamento de memória): filiais dos arquivos concluídos que
+  não cabem vão para um arquivo temporário mapeado (mmap, páginas que o kernel pode largar);
+  os bitmaps (2 × 12,5MB) ficam sempre na memória
+"""
+import heapq, mmap, tempfile
+from array import array
+from bisect import bisect_left
+
+TOTAL_BASICOS = 10 ** 8            # cnpj_basico tem 8 dígitos
+BITMAP_BYTES = TOTAL_BASICOS // 8
+TAMANHO_BUFFER = 200_000           # filiais pendentes antes de ordenar
+MAX_AMOSTRAS = 10                  # CNPJs duplicados guardados por arquivo
+BLOCO_DISCO = 1 << 16              # chaves por escrita no arquivo de filiais
+
+
+def _contem(ordenado, chave):
+    """Busca binária em array('Q') ordenado"""
+    i = bisect_left(ordenado, chave)
+    return i < len(ordenado) and ordenado[i] == chave
+
+
+def _mesclar(a, b):
+    """Mescla dois iteráveis ordenados em um novo array('Q') sem lista intermediária"""
+    return array('Q', heapq.merge(a, b))
+
+
+def _mesclar_em_disco(a, b, diretorio=None):
+    """Mescla dois iteráveis ordenados num arquivo temporário. Retorna (arquivo, mmap, memoryview 'Q')"""
+    arquivo = tempfile.TemporaryFile(prefix="rfb_dedup_", dir=diretorio)
+    bloco = array('Q')
+    for chave in heapq.merge(a, b):
+        bloco.append(chave)
+        if len(bloco) >= BLOCO_DISCO:
+            bloco.tofile(arquivo)
+            bloco = array('Q')
+    bloco.tofile(arquivo)
+    arquivo.flush()
+    if not arquivo.tell():
+        arquivo.close()
+        return None, None, array('Q')
+    mapa = mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+    return arquivo, mapa, memoryview(mapa).cast('Q')
+
+
+def _or_bitmap(destino, origem):
+    """destino |= origem (bitmaps do mesmo tamanho)"""
+    valor = int.from_bytes(destino, 'little') | int.from_bytes(origem, 'little')
+    destino[:] = valor.to_bytes(len(destino), 'little')
+
+
+class DeduplicadorCNPJ:
+    """
+    Filtro exato de duplicatas por cnpj_completo.
+
+    O dígito verificador é calculado a partir dos 12 primeiros dígitos, então
+    para as matrizes basta marcar o cnpj_basico no bitmap. Filiais (ordem
+    diferente de 0001) são minoria e ficam em arrays ordenados de 8 bytes.
+    """
+
+    def __init__(self, tamanho_buffer=TAMANHO_BUFFER, limite_bytes=None, diretorio=None):
+        self.tamanho_buffer = tamanho_buffer
+        self.limite_bytes = limite_bytes
+        self.diretorio = diretorio
+
+        # Arquivos já concluídos
+        self._matrizes = bytearray(BITMAP_BYTES)
+        self._filiais = array('Q')
+        self._disco = None            # (arquivo, mmap) quando _filiais está no disco
+
+        # Arquivo atual (só entra no global em finalizar_arquivo)
+        self._matrizes_arquivo = bytearray(BITMAP_BYTES)
+        self._filiais_arquivo = array('Q')
+        self._pendentes = set()
+
+        self.arquivo = None
+        self.unicos = 0
+        self.invalidos = 0
+        self.por_arquivo = {}
+
+    def iniciar_arquivo(self, arquivo):
+        """Começa um novo arquivo, descartando chaves de um arquivo não finalizado"""
+        if self.arquivo is not None:
+            self._limpar_arquivo()
+        self.arquivo = arquivo
+        self.por_arquivo[arquivo] = {"mesmo_arquivo": 0, "outros_arquivos": 0, "amostras": []}
+
+    def finalizar_arquivo(self):
+        """Incorpora as chaves do arquivo atual ao conjunto global"""
+        _or_bitmap(self._matrizes, self._matrizes_arquivo)
+        self._ordenar_pendentes()
+        novas = self._filiais_arquivo.itemsize * (len(self._filiais) + len(self._filiais_arquivo))
+        # Durante a mescla o array antigo e o novo coexistem: conta os dois
+        if self._disco is not None or (self.limite_bytes is not None
+                                       and self.memoria_bytes() + novas > self.limite_bytes):
+            self._descarregar()
+        else:
+            self._filiais = _mesclar(self._filiais, self._filiais_arquivo)
+        self._limpar_arquivo()
+        self.arquivo = None
+
+    def duplicado(self, cnpj_basico, cnpj_ordem, cnpj_dv):
+        """Retorna True se o CNPJ já apareceu (e conta a origem); senão registra e retorna False"""
+        # RFB sempre envia os campos com zeros à esquerda (8 + 4 + 2 dígitos)
+        if len(cnpj_basico) != 8 or len(cnpj_ordem) != 4 or len(cnpj_dv) != 2:
+            self.invalidos += 1
+            return False
+        digitos = cnpj_basico + cnpj_ordem + cnpj_dv
+        if not digitos.isdigit():
+            self.invalidos += 1
+            return False
+        chave = int(digitos)
+
+        basico, resto = divmod(chave, 1000000)
+        ordem = resto // 100
+
+        if ordem == 1:
+            byte, bit = basico >> 3, 1 << (basico & 7)
+            if self._matrizes_arquivo[byte] & bit:
+                return self._contar("mesmo_arquivo", cnpj_basico, cnpj_ordem, cnpj_dv)
+            if self._matrizes[byte] & bit:
+                return self._contar("outros_arquivos", cnpj_basico, cnpj_ordem, cnpj_dv)
+            self._matrizes_arquivo[byte] |= bit
+        else:
+            if chave in self._pendentes or _contem(self._filiais_arquivo, chave):
+                return self._contar("mesmo_arquivo", cnpj_basico, cnpj_ordem, cnpj_dv)
+            if _contem(self._filiais, chave):
+                return self._contar("outros_arquivos", cnpj_basico, cnpj_ordem, cnpj_dv)
+            self._pendentes.add(chave)
+            if len(self._pendentes) >= self.tamanho_buffer:
+                self._ordenar_pendentes()
+
+        self.unicos += 1
+        return False
+
+    @property
+    def total_duplicados(self):
+        return sum(d["mesmo_arquivo"] + d["outros_arquivos"] for d in self.por_arquivo.values())
+
+    def memoria_bytes(self):
+        """Memória aproximada das estruturas (sem contar o overhead do set pendente)"""
+        filiais = len(self._filiais_arquivo) + (0 if self._disco is not None else len(self._filiais))
+        return len(self._matrizes) + len(self._matrizes_arquivo) + 8 * filiais + 8 * len(self._pendentes)
+
+    def disco_bytes(self):
+        """Filiais dos arquivos concluídos descarregadas no arquivo temporário"""
+        return 8 * len(self._filiais) if self._disco is not None else 0
+
+    def fechar(self):
+        """Solta o arquivo temporário das filiais (se houver)"""
+        self._trocar_disco(None, array('Q'))
+
+    def relatorio(self):
+        """Resumo serializável em JSON"""
+        return {
+            "unicos": self.unicos,
+            "duplicados": self.total_duplicados,
+            "invalidos": self.invalidos,
+            "memoria_mb": round(self.memoria_bytes() / (1024 * 1024), 1),
+            "disco_mb": round(self.disco_bytes() / (1024 * 1024), 1),
+            "por_arquivo": {str(k): v for k, v in self.por_arquivo.items()},
+        }
+
+    def _contar(self, origem, cnpj_basico, cnpj_ordem, cnpj_dv):
+        stats = self.por_arquivo.setdefault(
+            self.arquivo, {"mesmo_arquivo": 0, "outros_arquivos": 0, "amostras": []})
+        stats[origem] += 1
+        if len(stats["amostras"]) < MAX_AMOSTRAS:
+            stats["amostras"].append(f"{cnpj_basico}{cnpj_ordem}{cnpj_dv} ({origem})")
+        return True
+
+    def _ordenar_pendentes(self):
+        if self._pendentes:
+            self._filiais_arquivo = _mesclar(self._filiais_arquivo, sorted(self._pendentes))
+            self._pendentes = set()
+
+    def _descarregar(self):
+        """Filiais concluídas + as do arquivo atual mescladas direto no disco"""
+        arquivo, mapa, filiais = _mesclar_em_disco(self._filiais, self._filiais_arquivo, self.diretorio)
+        self._trocar_disco(None if arquivo is None else (arquivo, mapa), filiais)
+
+    def _trocar_disco(self, disco, filiais):
+        antigo, self._disco = self._disco, disco
+        if antigo is not None:
+            self._filiais.release()   # mmap só fecha sem views exportadas
+            antigo[1].close()
+            antigo[0].close()
+        self._filiais = filiais
+
+    def _limpar_arquivo(self):
+        self._matrizes_arquivo = bytearray(BITMAP_BYTES)
+        self._filiais_arquivo = array('Q')
+        self._pendentes = set()
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+RFB DENORMALIZADO - Estabelecimentos + Empresas (razão social, capital, porte) numa tabela larga
+- Empresas{N}.zip e Estabelecimentos{N}.zip espalhados em disco por faixa de cnpj_basico
+  (ordenacao.ParticionadorExterno; Estabelecimentos passa pelo processar_arquivo de sempre:
+  filtro CNAE, dedup, pool de processos)
+- merge-join em uma passada: as duas sequências saem ordenadas por cnpj_basico
+  (runs ordenados de cada partição lidos em blocos pelo heapq.merge, dentro da cota "particoes")
+- LEFT JOIN: estabelecimento sem empresa sai com os campos da empresa vazios
+- destino: tabela nova + índices + troca atômica, ou CSV (--saida)
+
+Uso:
+  rfb-etl juncao --mes 2024-01 [--arquivos 0-9] [--empresas 0-9] [--cnaes padrao] [--workers 3]
+                 [--tabela estabelecimentos_empresas | --saida denormalizado.csv] [--temp DIR]
+"""
+import csv, os, shutil, time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from psycopg2 import sql
+
+from .comum import COLUNAS_ESTABELECIMENTOS, abrir_csv, conectar_db, copiar_lote, ler_linhas
+from . import memoria
+from .ordenacao import LIMITE_BUFFER, ParticionadorExterno, ler_ordenado
+
+COLUNAS_EMPRESAS = (
+    "cnpj_basico", "razao_social", "natureza_juridica", "qualificacao_responsavel",
+    "capital_social", "porte_empresa", "ente_federativo_responsavel",
+)
+# Colunas da empresa que entram na tabela larga (posições em COLUNAS_EMPRESAS)
+COLUNAS_JUNTADAS = ("razao_social", "natureza_juridica", "capital_social", "porte_empresa")
+_POSICOES = tuple(COLUNAS_EMPRESAS.index(c) for c in COLUNAS_JUNTADAS)
+SEM_EMPRESA = ("",) * len(COLUNAS_JUNTADAS)
+
+COLUNAS_SAIDA = COLUNAS_ESTABELECIMENTOS + COLUNAS_JUNTADAS
+TABELA_PADRAO = "estabelecimentos_empresas"
+TEMP_PADRAO = os.environ.get("RFB_TEMP_JUNCAO", "rfb_juncao_tmp")
+TOTAL_PARTICOES = 1000          # 3 primeiros dígitos do cnpj_basico
+LOTE = 50000
+CUSTO_EMPRESA = 400             # bytes de (chave, 4 campos da empresa) no buffer da partição
+
+
+def _particao(basico):
+    return basico // 10 ** 5
+
+
+def _chave(basico):
+    return int(basico) if len(basico) == 8 and basico.isdigit() else None
+
+
+class DestinoParticionado:
+    """Destino do motor: espalha as linhas aceitas por cnpj_basico (um prefixo por arquivo)"""
+
+    def __init__(self, diretorio, arquivo_num):
+        self.registros = 0
+        self.invalidos = 0
+        limite = memoria.atual().linhas("particoes", memoria.CUSTO_LINHA, LIMITE_BUFFER)
+        self._particionador = ParticionadorExterno(diretorio, _particao, prefixo=f"x{arquivo_num}",
+                                                   limite_buffer=limite)
+
+    def escrever(self, lote):
+        for row in lote:
+            chave = _chave(row[0])
+            if chave is None:
+                self.invalidos += 1
+                continue
+            self._particionador.adicionar(chave, row)
+        self.registros += len(lote)
+
+    def concluir(self):
+        self._particionador.fechar()
+        return {"invalidos": self.invalidos} if self.invalidos else {}
+
+    def abortar(self):
+        pass
+
+
+def particionar_empresas(mes_ano, arquivo_num, diretorio):
+    """Empresas{N}.zip → partições (cnpj_basico, colunas juntadas). Retorna linhas gravadas"""
+    arquivo_nome = f"Empresas{arquivo_num}.zip"
+    inicio = time.time()
+    print(f"\n🏢 {arquivo_nome}")
+    csv_file, _ = abrir_csv(mes_ano, arquivo_nome)
+    limite = memoria.atual().linhas("particoes", CUSTO_EMPRESA, LIMITE_BUFFER)
+    particionador = ParticionadorExterno(diretorio, _particao, prefixo=f"e{arquivo_num}", limite_buffer=limite)
+    total = 0
+    with csv_file:
+        for row in ler_linhas(csv_file, len(COLUNAS_EMPRESAS)):
+            chave = _chave(row[0])
+            if chave is not None:
+                particionador.adicionar(chave, tuple(row[i] for i in _POSICOES))
+                total += 1
+    particionador.fechar()
+    print(f"      ✅ {arquivo_nome}: {total:,} empresas | {time.time() - inicio:.0f}s")
+    return total
+
+
+def juntar(dir_estabelecimentos, dir_empresas):
+    """Merge-join das duas sequências ordenadas por cnpj_basico (LEFT JOIN)"""
+    empresas = ler_ordenado(dir_empresas, TOTAL_PARTICOES, CUSTO_EMPRESA)
+    empresa = next(empresas, None)
+    for chave, row in ler_ordenado(dir_estabelecimentos, TOTAL_PARTICOES):
+        while empresa is not None and empresa[0] < chave:
+            empresa = next(empresas, None)
+        if empresa is not None and empresa[0] == chave:
+            yield tuple(row) + tuple(empresa[1]), True
+        else:
+            yield tuple(row) + SEM_EMPRESA, False
+
+
+class SaidaCSV:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._tmp = f"{caminho}.tmp"
+        self._arquivo = open(self._tmp, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._arquivo)
+        self._writer.writerow(COLUNAS_SAIDA)
+
+    def escrever(self, lote):
+        self._writer.writerows(lote)
+
+    def concluir(self):
+        self._arquivo.close()
+        os.replace(self._tmp, self.caminho)
+        return self.caminho
+
+    def abortar(self):
+        self._arquivo.close()
+        os.remove(self._tmp)
+
+
+class SaidaTabela:
+    """Carrega <tabela>_novo sem índices, indexa no final e troca pela atual numa transação"""
+
+    def __init__(self, tabela):
+        self.tabela = tabela
+        self.novo = f"{tabela}_novo"
+        self.conn = conectar_db()
+        self.cursor = self.conn.cursor()
+        self.cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(self.novo)))
+        self.cursor.execute(sql.SQL("CREATE TABLE {} ({})").format(
+            sql.Identifier(self.novo),
+            sql.SQL(', ').join(sql.SQL("{} text").format(sql.Identifier(c)) for c in COLUNAS_SAIDA)))
+        self.conn.commit()
+
+    def escrever(self, lote):
+        copiar_lote(self.cursor, sql.Identifier(self.novo).as_string(self.cursor), lote, COLUNAS_SAIDA)
+        self.conn.commit()
+
+    def concluir(self):
+        novo, tabela = sql.Identifier(self.novo), sql.Identifier(self.tabela)
+        indices = (("cnpj_idx", "cnpj_basico, cnpj_ordem, cnpj_dv"), ("cnae_idx", "cnae_fiscal_principal"),
+                   ("uf_municipio_idx", "uf, municipio"))
+        print("\n🔎 Criando índices da tabela larga...")
+        for sufixo, colunas in indices:
+            self.cursor.execute(sql.SQL("CREATE INDEX {} ON {} ({})").format(
+                sql.Identifier(f"{self.novo}_{sufixo}"), novo,
+                sql.SQL(', ').join(map(sql.Identifier, colunas.split(', ')))))
+        self.cursor.execute(sql.SQL("ANALYZE {}").format(novo))
+        self.conn.commit()
+
+        # Troca: quem consulta vê a tabela antiga até o commit e a nova depois
+        self.cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(tabela))
+        self.cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(novo, tabela))
+        for sufixo, _ in indices:
+            self.cursor.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                sql.Identifier(f"{self.novo}_{sufixo}"), sql.Identifier(f"{self.tabela}_{sufixo}")))
+        self.conn.commit()
+        self.cursor.close()
+        self.conn.close()
+        return self.tabela
+
+    def abortar(self):
+        self.conn.rollback()
+        self.cursor.close()
+        self.conn.close()
+
+
+def executar(mes_ano, arquivos, empresas=range(10), cnaes=None, apenas_principal=False, workers=1,
+             tabela=TABELA_PADRAO, saida=None, temp=TEMP_PADRAO):
+    """Particiona Empresas e Estabelecimentos, junta e grava. Retorna o resumo"""
+    from .motor import importar
+
+    inicio = time.time()
+    dir_empresas = os.path.join(temp, mes_ano, "empresas")
+    dir_estabelecimentos = os.path.join(temp, mes_ano, "estabelecimentos")
+    shutil.rmtree(os.path.join(temp, mes_ano), ignore_errors=True)
+
+    print("\n" + "="*70)
+    print(f"🔗 RFB JUNÇÃO - Estabelecimentos × Empresas ({mes_ano})")
+    print(f"⏰ Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("="*70)
+
+    empresas = list(empresas)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            total_empresas = sum(pool.map(particionar_empresas, [mes_ano] * len(empresas), empresas,
+                                          [dir_empresas] * len(empresas)))
+    else:
+        total_empresas = sum(particionar_empresas(mes_ano, n, dir_empresas) for n in empresas)
+
+    resumo_estab = importar(mes_ano, arquivos, destino="juncao", cnaes=cnaes,
+                            apenas_principal=apenas_principal, workers=workers,
+                            juncao_dir=dir_estabelecimentos)
+    if resumo_estab["erros"]:
+        shutil.rmtree(os.path.join(temp, mes_ano), ignore_errors=True)
+        raise RuntimeError(f"Estabelecimentos com erro: {resumo_estab['erros']}; junção não gravada")
+
+    print(f"\n🔗 Merge-join por cnpj_basico → {saida or tabela}")
+    destino = SaidaCSV(saida) if saida else SaidaTabela(tabela)
+    linhas = com_empresa = 0
+    lote = []
+    try:
+        for row, achou in juntar(dir_estabelecimentos, dir_empresas):
+            lote.append(row)
+            linhas += 1
+            com_empresa += achou
+            if len(lote) >= LOTE:
+                destino.escrever(lote)
+                lote = []
+                if linhas % (LOTE * 10) == 0:
+                    print(f"      📊 {linhas:,} linhas juntadas")
+        if lote:
+            destino.escrever(lote)
+        publicado = destino.concluir()
+    except BaseException:
+        destino.abortar()
+        raise
+    finally:
+        shutil.rmtree(os.path.join(temp, mes_ano), ignore_errors=True)
+
+    tempo = max(int(time.time() - inicio), 1)
+    print("\n" + "="*70)
+    print(f"✅ {publicado}: {linhas:,} estabelecimentos | {com_empresa:,} com empresa | "
+          f"{linhas - com_empresa:,} sem empresa")
+    print(f"🏢 Empresas lidas: {total_empresas:,} | ⏱️  {tempo//60}min {tempo%60}s")
+    print("="*70)
+    return {"mes_ano": mes_ano, "destino": publicado, "linhas": linhas, "com_empresa": com_empresa,
+            "empresas": total_empresas, "tempo_total_segundos": tempo}
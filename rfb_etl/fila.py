@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+RFB FILA - Fila de trabalho no próprio PostgreSQL (várias máquinas, sem coordenador)
+- enfileirar: registra a carga do mês (opções do motor) e um item por arquivo
+- trabalhar: cada worker reivindica um arquivo com FOR UPDATE SKIP LOCKED,
+  mantém um heartbeat enquanto processa e marca concluido/pendente/falhou
+- lease expirado (worker morto) => o arquivo volta para a fila e outro pega;
+  o worker antigo confere o lease na transação dos dados e desfaz a carga se o perdeu
+- upsert/direto: staging TEMP por sessão, o arquivo inteiro numa transação (sem commit por lote)
+- até MAX_TENTATIVAS por arquivo; maiores arquivos primeiro
+- o último worker a concluir finaliza a carga (partição + perfis na estratégia mensal;
+  índices + publicação da view na estratégia snapshot)
+- unidade = arquivo inteiro: o ZIP da RFB é um stream deflate, não dá para
+  começar a ler no meio por faixa de bytes
+
+Uso:
+  rfb-etl fila enfileirar --mes 2024-01 [--estrategia upsert] [--arquivos 0-9] [--cnaes padrao]
+  rfb-etl fila trabalhar [--processos N] [--lease SEG]      (em quantas máquinas quiser)
+  rfb-etl fila status [--mes 2024-01]
+"""
+import json, os, socket, threading, time
+from datetime import datetime
+from multiprocessing import Process
+
+from .comum import conectar_db
+from .motor import montar_opcoes, processar_arquivo
+from . import perfis, snapshot
+
+LEASE_SEG = 300          # sem heartbeat por esse tempo => arquivo volta para a fila
+MAX_TENTATIVAS = 3
+ESPERA_SEG = 15          # sem item livre mas com outros em execução
+
+SQL_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS rfb_fila_cargas (
+  mes_ano text PRIMARY KEY,
+  opcoes jsonb NOT NULL,
+  criada_em timestamptz NOT NULL DEFAULT NOW(),
+  finalizada_em timestamptz
+);
+
+CREATE TABLE IF NOT EXISTS rfb_fila_trabalho (
+  mes_ano text NOT NULL REFERENCES rfb_fila_cargas ON DELETE CASCADE,
+  arquivo int NOT NULL,
+  tamanho_bytes bigint NOT NULL DEFAULT 0,
+  estado text NOT NULL DEFAULT 'pendente',
+  tentativas int NOT NULL DEFAULT 0,
+  worker text,
+  heartbeat timestamptz,
+  iniciado_em timestamptz,
+  concluido_em timestamptz,
+  erro text,
+  resultado jsonb,
+  PRIMARY KEY (mes_ano, arquivo)
+);
+
+CREATE INDEX IF NOT EXISTS rfb_fila_trabalho_estado_idx ON rfb_fila_trabalho (estado);
+"""
+
+# Subselect trava só a linha escolhida; SKIP LOCKED => workers não esperam uns pelos outros
+SQL_REIVINDICAR = """
+UPDATE rfb_fila_trabalho t SET
+  estado = 'executando', worker = %(worker)s, heartbeat = NOW(), iniciado_em = NOW(),
+  tentativas = t.tentativas + 1,
+  erro = CASE WHEN t.estado = 'executando' THEN 'lease expirado (' || t.worker || ')' ELSE t.erro END
+FROM (
+  SELECT mes_ano, arquivo FROM rfb_fila_trabalho
+  WHERE tentativas < %(max_tentativas)s
+    AND (estado = 'pendente'
+         OR (estado = 'executando' AND heartbeat < NOW() - make_interval(secs => %(lease)s)))
+  ORDER BY tamanho_bytes DESC, mes_ano, arquivo
+  LIMIT 1
+  FOR UPDATE SKIP LOCKED
+) alvo
+WHERE t.mes_ano = alvo.mes_ano AND t.arquivo = alvo.arquivo
+RETURNING t.mes_ano, t.arquivo, t.tentativas,
+  (SELECT opcoes FROM rfb_fila_cargas c WHERE c.mes_ano = t.mes_ano)
+"""
+
+
+def criar_esquema(conn):
+    cursor = conn.cursor()
+    cursor.execute(SQL_ESQUEMA)
+    conn.commit()
+    cursor.close()
+
+
+def identificar_worker():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enfileirar(mes_ano, arquivos, estrategia="upsert", cnaes=None, apenas_principal=False,
+               deduplicar=True, reiniciar=False, substituir_snapshot=False):
+    """Cria a carga do mês na fila. reiniciar=True zera os itens (e a partição mensal / o snapshot)"""
+    montar_opcoes(estrategia, cnaes=cnaes, apenas_principal=apenas_principal)
+    opcoes = {"estrategia": estrategia, "cnaes": sorted(cnaes) if cnaes else None,
+              "apenas_principal": apenas_principal, "deduplicar": deduplicar}
+    try:
+        from .agendador import tamanhos_publicados
+        tamanhos = tamanhos_publicados(mes_ano)
+    except Exception as e:
+        print(f"⚠️  Tamanhos indisponíveis ({e}); ordem pelo número do arquivo")
+        tamanhos = {}
+
+    conn = conectar_db()
+    criar_esquema(conn)
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO rfb_fila_cargas (mes_ano, opcoes) VALUES (%s, %s)
+        ON CONFLICT (mes_ano) DO UPDATE SET opcoes = EXCLUDED.opcoes, finalizada_em = NULL
+        WHERE %s
+        RETURNING mes_ano
+    """, (mes_ano, json.dumps(opcoes), reiniciar))
+    nova = cursor.fetchone() is not None
+    if not nova:
+        print(f"ℹ️  Carga {mes_ano} já estava na fila (use --reiniciar para recomeçar)")
+    elif estrategia in ("mensal", "snapshot"):
+        # Partição/tabela criada antes dos itens ficarem visíveis: nenhum worker pega arquivo sem ela
+        conn_destino = conectar_db()
+        if estrategia == "mensal":
+            perfis.preparar_particao(conn_destino, mes_ano)
+        else:
+            opcoes["snapshot"] = snapshot.preparar(conn_destino, mes_ano, substituir_snapshot)
+            cursor.execute("UPDATE rfb_fila_cargas SET opcoes = %s WHERE mes_ano = %s",
+                           (json.dumps(opcoes), mes_ano))
+        conn_destino.close()
+
+    for n in arquivos:
+        cursor.execute("""
+            INSERT INTO rfb_fila_trabalho (mes_ano, arquivo, tamanho_bytes) VALUES (%s, %s, %s)
+            ON CONFLICT (mes_ano, arquivo) DO UPDATE SET
+              estado = 'pendente', tentativas = 0, worker = NULL, heartbeat = NULL,
+              erro = NULL, resultado = NULL, concluido_em = NULL
+            WHERE %s
+        """, (mes_ano, n, tamanhos.get(f"Estabelecimentos{n}.zip", 0), reiniciar))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"📥 {mes_ano}: {len(arquivos)} arquivos na fila ({estrategia})")
+
+
+class Heartbeat(threading.Thread):
+    """Renova o lease do item em conexão própria; avisa se outro worker assumiu"""
+
+    def __init__(self, mes_ano, arquivo, worker, intervalo):
+        super().__init__(daemon=True)
+        self.chave = (mes_ano, arquivo, worker)
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+
+    def run(self):
+        conn = None
+        while not self._parar.wait(self.intervalo):
+            try:
+                if conn is None or conn.closed:
+                    conn = conectar_db()
+                    conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE rfb_fila_trabalho SET heartbeat = NOW()
+                    WHERE mes_ano = %s AND arquivo = %s AND worker = %s AND estado = 'executando'
+                """, self.chave)
+                renovado = cursor.rowcount
+                cursor.close()
+                if not renovado:
+                    # O DestinoPostgres confere de novo no commit e desfaz a carga
+                    print(f"      ⚠️  Lease do arquivo {self.chave[1]} perdido para outro worker")
+                    break
+            except Exception as e:
+                print(f"      ⚠️  Falha no heartbeat: {e}")
+        if conn is not None:
+            conn.close()
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+def _concluir(conn, mes_ano, arquivo, worker, resultado):
+    """Marca o item concluído. False se outro worker já tinha assumido o item"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE rfb_fila_trabalho SET estado = 'concluido', concluido_em = NOW(),
+          resultado = %s, erro = NULL
+        WHERE mes_ano = %s AND arquivo = %s AND worker = %s
+    """, (json.dumps(resultado), mes_ano, arquivo, worker))
+    concluido = cursor.rowcount == 1
+    conn.commit()
+    cursor.close()
+    return concluido
+
+
+def _falhar(conn, mes_ano, arquivo, worker, erro, max_tentativas):
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE rfb_fila_trabalho SET
+          estado = CASE WHEN tentativas >= %s THEN 'falhou' ELSE 'pendente' END,
+          erro = %s, worker = NULL, heartbeat = NULL
+        WHERE mes_ano = %s AND arquivo = %s AND worker = %s
+        RETURNING estado
+    """, (max_tentativas, str(erro)[:300], mes_ano, arquivo, worker))
+    linha = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    return linha[0] if linha else None
+
+
+def _expirar_esgotados(conn, lease, max_tentativas):
+    """Lease vencido sem tentativas sobrando: ninguém mais vai pegar => falhou"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE rfb_fila_trabalho SET estado = 'falhou', erro = 'lease expirado (' || worker || ')'
+        WHERE estado = 'executando' AND tentativas >= %s
+          AND heartbeat < NOW() - make_interval(secs => %s)
+    """, (max_tentativas, lease))
+    conn.commit()
+    cursor.close()
+
+
+def finalizar_cargas(conn):
+    """Marca (uma única vez) as cargas com todos os itens concluídos e roda o pós-carga"""
+    cursor = conn.cursor()
+    # O UPDATE serializa workers concorrentes: só um vê finalizada_em IS NULL
+    cursor.execute("""
+        UPDATE rfb_fila_cargas c SET finalizada_em = NOW()
+        WHERE finalizada_em IS NULL
+          AND NOT EXISTS (SELECT 1 FROM rfb_fila_trabalho t
+                          WHERE t.mes_ano = c.mes_ano AND t.estado <> 'concluido')
+        RETURNING mes_ano, opcoes
+    """)
+    cargas = cursor.fetchall()
+    conn.commit()
+    cursor.close()
+
+    for mes_ano, opcoes in cargas:
+        print(f"\n🏁 Carga {mes_ano} concluída na fila")
+        if opcoes["estrategia"] not in ("mensal", "snapshot"):
+            continue
+        try:
+            if opcoes["estrategia"] == "snapshot":
+                snapshot.finalizar(conn, opcoes["snapshot"])
+                snapshot.publicar(conn, opcoes["snapshot"])
+                continue
+            perfis.anexar_particao(conn, mes_ano)
+            print("\n🎯 Atualizando perfis de CNAE...")
+            perfis.atualizar_perfis(conn)
+        except Exception:
+            conn.rollback()
+            cursor = conn.cursor()
+            cursor.execute("UPDATE rfb_fila_cargas SET finalizada_em = NULL WHERE mes_ano = %s", (mes_ano,))
+            conn.commit()
+            cursor.close()
+            raise
+
+
+def _restantes(conn, max_tentativas):
+    """(pendentes reivindicáveis, em execução) em todas as cargas abertas"""
+    cursor = conn.cursor()
+    # Pendente sem tentativas sobrando (para este worker) não conta: ninguém aqui vai pegá-lo
+    cursor.execute("""
+        SELECT count(*) FILTER (WHERE estado = 'pendente' AND tentativas < %s),
+               count(*) FILTER (WHERE estado = 'executando')
+        FROM rfb_fila_trabalho
+    """, (max_tentativas,))
+    restantes = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    return restantes
+
+
+def trabalhar(lease=LEASE_SEG, max_tentativas=MAX_TENTATIVAS, worker=None):
+    """Processa itens até a fila esvaziar. Retorna quantos arquivos este worker concluiu"""
+    worker = worker or identificar_worker()
+    conn = conectar_db()
+    criar_esquema(conn)
+    concluidos = 0
+    print(f"\n👷 Worker {worker} | lease {lease}s | até {max_tentativas} tentativas")
+
+    while True:
+        _expirar_esgotados(conn, lease, max_tentativas)
+        cursor = conn.cursor()
+        cursor.execute(SQL_REIVINDICAR, {"worker": worker, "lease": lease, "max_tentativas": max_tentativas})
+        item = cursor.fetchone()
+        conn.commit()
+        cursor.close()
+
+        if item is None:
+            finalizar_cargas(conn)
+            pendentes, executando = _restantes(conn, max_tentativas)
+            if not pendentes and not executando:
+                break
+            # Itens de outros workers ainda podem voltar para a fila (lease vencido)
+            time.sleep(ESPERA_SEG)
+            continue
+
+        mes_ano, arquivo, tentativa, carga = item
+        print(f"\n🎫 {worker} pegou {mes_ano} arquivo {arquivo} (tentativa {tentativa}) "
+              f"às {datetime.now().strftime('%H:%M:%S')}")
+        opcoes = montar_opcoes(
+            carga["estrategia"], cnaes=set(carga["cnaes"]) if carga["cnaes"] else None,
+            apenas_principal=carga["apenas_principal"], deduplicar=carga["deduplicar"],
+            staging_propria=True, snapshot_tabela=carga.get("snapshot"), lease=(mes_ano, arquivo, worker),
+        )
+        heartbeat = Heartbeat(mes_ano, arquivo, worker, max(lease / 3, 1))
+        heartbeat.start()
+        try:
+            resultado = processar_arquivo(mes_ano, arquivo, opcoes)
+        except Exception as e:
+            heartbeat.parar()
+            estado = _falhar(conn, mes_ano, arquivo, worker, e, max_tentativas)
+            print(f"\n❌ ERRO no arquivo {arquivo}: {e} => {estado or 'lease perdido'}")
+            continue
+        heartbeat.parar()
+        if not _concluir(conn, mes_ano, arquivo, worker, resultado):
+            print(f"\n⚠️  Arquivo {arquivo}: item assumido por outro worker, não contado")
+            continue
+        concluidos += 1
+
+    conn.close()
+    print(f"\n✅ Worker {worker}: {concluidos} arquivos concluídos, fila vazia")
+    return concluidos
+
+
+def executar(processos=1, lease=LEASE_SEG, max_tentativas=MAX_TENTATIVAS):
+    """N workers locais (processos separados, como se fossem máquinas diferentes)"""
+    if processos <= 1:
+        trabalhar(lease, max_tentativas)
+        return 0
+    filhos = [Process(target=trabalhar, args=(lease, max_tentativas)) for _ in range(processos)]
+    for filho in filhos:
+        filho.start()
+    for filho in filhos:
+        filho.join()
+    return 0 if all(filho.exitcode == 0 for filho in filhos) else 1
+
+
+def status(mes_ano=None):
+    """Resumo por carga e estado de cada arquivo"""
+    conn = conectar_db()
+    criar_esquema(conn)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.mes_ano, c.opcoes->>'estrategia', c.finalizada_em, t.arquivo, t.estado,
+               t.tentativas, t.worker, t.heartbeat, t.erro, t.resultado->>'registros'
+        FROM rfb_fila_cargas c JOIN rfb_fila_trabalho t USING (mes_ano)
+        WHERE %(mes)s::text IS NULL OR c.mes_ano = %(mes)s
+        ORDER BY c.mes_ano DESC, t.arquivo
+    """, {"mes": mes_ano})
+    atual = None
+    for mes, estrategia, finalizada, arquivo, estado, tentativas, worker, heartbeat, erro, registros in cursor.fetchall():
+        if mes != atual:
+            atual = mes
+            fim = finalizada.strftime('%Y-%m-%d %H:%M:%S') if finalizada else "em aberto"
+            print(f"\n📅 {mes} ({estrategia}) | {fim}")
+        detalhe = f"{int(registros):,} registros" if registros else (worker or "")
+        if erro:
+            detalhe += f" | {erro[:80]}"
+        print(f"  Arquivo {arquivo}: {estado:<10} | {tentativas} tentativa(s) | {detalhe}")
+    cursor.close()
+    conn.close()
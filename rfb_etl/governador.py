@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+RFB GOVERNADOR - Ritmo da carga guiado pela saúde do banco
+- thread amostra a cada N segundos (conexão própria, autocommit):
+  * conexões ativas de OUTRAS aplicações (pg_stat_activity, sem rfb_etl*)
+  * sessões esperando lock (pg_stat_activity.wait_event_type = 'Lock')
+  * atraso de réplica (pg_stat_replication.replay_lag)
+  * checkpoints pedidos por minuto (pg_stat_checkpointer / pg_stat_bgwriter)
+- AIMD: algum sinal acima do alvo => taxa e conexões caem pela metade;
+  tudo dentro do alvo => taxa sobe um passo fixo (conexões a cada 3 amostras boas)
+- taxa: token bucket em linhas/s por conexão, antes de cada COPY
+- conexões: vagas = pg_try_advisory_xact_lock(classe, vaga) na transação do COPY/merge
+  (xact lock funciona no Transaction Pooler; some no commit/rollback)
+  * upsert/direto fora da fila: commit por lote => a vaga é devolvida a cada lote
+  * mensal/snapshot e itens da fila: o arquivo é uma transação só => a vaga fica presa
+    até o commit do arquivo; aí ela limita arquivos simultâneos, e a taxa segue por lote
+- merge (UPSERT único) só começa com o banco dentro do alvo
+- log de ritmo: uma linha 🚦 a cada ajuste
+
+Uso:
+  rfb-etl importar --governador                      (alvos padrão)
+  rfb-etl importar --governador ativas=10,lag=5,taxa_max=50000
+"""
+import threading, time
+from datetime import datetime
+
+from .comum import conectar_db
+
+ALVOS_PADRAO = {
+    "ativas": 20,           # conexões ativas de outras aplicações
+    "lock": 2,              # sessões esperando lock
+    "lag": 10.0,            # segundos de atraso de réplica
+    "checkpoints": 2.0,     # checkpoints pedidos por minuto (pressão de WAL)
+    "taxa_min": 2000,       # linhas/s por conexão
+    "taxa_max": 200000,
+    "intervalo": 5.0,       # segundos entre amostras
+}
+SINAIS = ("ativas", "lock", "lag", "checkpoints")
+CLASSE_VAGA = 0x52464231    # 'RFB1' (primeira chave do advisory lock)
+ESPERA_SAUDE_MAX_SEG = 900
+
+_governador = None
+
+
+def alvos(valor):
+    """'ativas=10,lag=5' → {'ativas': 10.0, 'lag': 5.0} (chaves de ALVOS_PADRAO)"""
+    resultado = {}
+    for parte in (valor or "").split(','):
+        if not parte.strip() or parte.strip() == "padrao":
+            continue
+        chave, _, numero = parte.partition('=')
+        chave = chave.strip()
+        if chave not in ALVOS_PADRAO:
+            raise ValueError(f"Alvo desconhecido: {chave!r} (use {', '.join(ALVOS_PADRAO)})")
+        resultado[chave] = float(numero)
+    return resultado
+
+
+def obter(alvos_governador, conexoes_max):
+    """Um governador por processo (o pool cria o seu na primeira vez)"""
+    global _governador
+    if _governador is None:
+        _governador = Governador(alvos_governador, conexoes_max)
+    return _governador
+
+
+def encerrar():
+    """Para o governador deste processo (se houver); o próximo obter() cria outro"""
+    global _governador
+    if _governador is not None:
+        _governador.parar()
+        _governador = None
+
+
+class Governador:
+    def __init__(self, alvos_governador=None, conexoes_max=1):
+        self.alvos = {**ALVOS_PADRAO, **(alvos_governador or {})}
+        self.conexoes_max = max(int(conexoes_max), 1)
+        self.conexoes = self.conexoes_max
+        # Começa em 1/4 da taxa máxima e sobe se o banco aguentar
+        self.taxa = max(self.alvos["taxa_max"] / 4, self.alvos["taxa_min"])
+        self.passo = (self.alvos["taxa_max"] - self.alvos["taxa_min"]) / 20
+        self.saudavel = True
+        self.sinais = {}
+        self.reducoes = 0
+        self._boas_seguidas = 0
+        self._tokens = 0.0
+        self._ultimo = time.monotonic()
+        self._checkpoints_anterior = None
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._amostrar_sempre, name="governador", daemon=True)
+        self._thread.start()
+
+    # --- sinais -------------------------------------------------------------
+
+    def _consultar(self, cursor, consulta):
+        try:
+            cursor.execute(consulta)
+            return cursor.fetchone()
+        except Exception:
+            return None   # sem permissão / view inexistente nesta versão
+
+    def amostrar(self, cursor):
+        sinais = {}
+        linha = self._consultar(cursor, """
+            SELECT count(*) FILTER (WHERE state = 'active'
+                                     AND coalesce(application_name, '') NOT LIKE 'rfb_etl%'),
+                   count(*) FILTER (WHERE wait_event_type = 'Lock')
+            FROM pg_stat_activity
+            WHERE backend_type = 'client backend' AND pid <> pg_backend_pid()
+        """)
+        if linha:
+            sinais["ativas"], sinais["lock"] = linha
+        linha = self._consultar(cursor, """
+            SELECT coalesce(max(extract(epoch FROM replay_lag)), 0)::float FROM pg_stat_replication
+        """)
+        if linha:
+            sinais["lag"] = linha[0]
+
+        # PG 17 moveu os contadores de checkpoint para pg_stat_checkpointer
+        linha = (self._consultar(cursor, "SELECT num_requested FROM pg_stat_checkpointer")
+                 or self._consultar(cursor, "SELECT checkpoints_req FROM pg_stat_bgwriter"))
+        if linha:
+            agora = time.monotonic()
+            if self._checkpoints_anterior is not None:
+                valor, quando = self._checkpoints_anterior
+                sinais["checkpoints"] = (linha[0] - valor) * 60 / max(agora - quando, 1e-3)
+            self._checkpoints_anterior = (linha[0], agora)
+        return sinais
+
+    def ajustar(self, sinais):
+        """AIMD sobre taxa e conexões; imprime a linha de ritmo quando algo muda"""
+        acima = [s for s in SINAIS if sinais.get(s) is not None and sinais[s] > self.alvos[s]]
+        with self._lock:
+            antes = (round(self.taxa), self.conexoes)
+            self.sinais, self.saudavel = sinais, not acima
+            if acima:
+                self.taxa = max(self.taxa / 2, self.alvos["taxa_min"])
+                self.conexoes = max(self.conexoes // 2, 1)
+                self._boas_seguidas = 0
+                self.reducoes += 1
+            else:
+                self.taxa = min(self.taxa + self.passo, self.alvos["taxa_max"])
+                self._boas_seguidas += 1
+                if self._boas_seguidas % 3 == 0:
+                    self.conexoes = min(self.conexoes + 1, self.conexoes_max)
+            depois = (round(self.taxa), self.conexoes)
+
+        if depois != antes:
+            leitura = " ".join(
+                f"{s}={sinais[s]:.1f}" if isinstance(sinais.get(s), float) else f"{s}={sinais.get(s, '-')}"
+                for s in SINAIS)
+            seta = f"↓ ({', '.join(acima)} acima do alvo)" if acima else "↑"
+            print(f"      🚦 {datetime.now().strftime('%H:%M:%S')} {leitura} → {seta} "
+                  f"taxa {depois[0]:,} linhas/s | {depois[1]} conexões")
+
+    def _amostrar_sempre(self):
+        conn = None
+        while not self._parar.is_set():
+            try:
+                if conn is None or conn.closed:
+                    conn = conectar_db(aplicacao="rfb_etl_governador")
+                    conn.autocommit = True
+                cursor = conn.cursor()
+                self.ajustar(self.amostrar(cursor))
+                cursor.close()
+            except Exception as e:
+                print(f"      ⚠️  Governador sem amostra: {str(e)[:60]}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+            self._parar.wait(self.alvos["intervalo"])
+        if conn is not None:
+            conn.close()
+
+    # --- freios usados pelo destino -----------------------------------------
+
+    def ritmar(self, linhas):
+        """Token bucket: dorme o necessário para 'linhas' caberem na taxa. Retorna a espera"""
+        with self._lock:
+            agora = time.monotonic()
+            self._tokens = min(self._tokens + (agora - self._ultimo) * self.taxa, self.taxa)
+            self._ultimo = agora
+            self._tokens -= linhas
+            espera = -self._tokens / self.taxa if self._tokens < 0 else 0
+        if espera:
+            time.sleep(espera)
+        return espera
+
+    def reservar_vaga(self, cursor):
+        """Pega uma das 'conexoes' vagas na transação corrente (solta no commit). Retorna a espera"""
+        inicio = time.monotonic()
+        while True:
+            for vaga in range(self.conexoes):
+                cursor.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", (CLASSE_VAGA, vaga))
+                if cursor.fetchone()[0]:
+                    return time.monotonic() - inicio
+            time.sleep(0.5)
+
+    def aguardar_saude(self):
+        """Segura operações que não dá para ritmar (merge) até os sinais voltarem ao alvo"""
+        inicio = time.monotonic()
+        avisou = False
+        while not self.saudavel and time.monotonic() - inicio < ESPERA_SAUDE_MAX_SEG:
+            if not avisou:
+                print("      ⏳ Banco acima do alvo, merge aguardando...")
+                avisou = True
+            time.sleep(1)
+        return time.monotonic() - inicio
+
+    def parar(self):
+        """Encerra a thread de amostragem (e a conexão dela)"""
+        self._parar.set()
+        self._thread.join()
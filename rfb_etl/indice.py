@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+RFB INDICE - Índice local de consulta por CNPJ (somente leitura, mmap)
+- Montado durante a importação (--indice DIR), sem consulta ao banco
+- chaves.bin: cnpj_completo em uint64 ordenado | offsets.bin: início de cada registro
+- registros.bin: 30 campos separados por \\x1f (utf-8)
+- Busca binária direto no mmap: poucos microssegundos por consulta
+- Cada construção grava uma versão nova <DIR>/<MES_ANO>.v<N> (N = última + 1);
+  publicação atômica trocando só os symlinks <DIR>/atual e <DIR>/<MES_ANO> (os.replace)
+- Versões antigas do mês são apagadas depois da troca (ficam as MANTER_VERSOES mais novas);
+  leitores já abertos seguem no mmap da versão que resolveram
+
+Uso:
+  rfb-etl importar --mes 2024-01 --indice /dados/indice_cnpj
+  rfb-etl indice buscar 12345678000190 [--dir /dados/indice_cnpj]
+  rfb-etl indice benchmark [--consultas 100000]
+"""
+import json, mmap, os, random, re, shutil, sys, time
+from array import array
+from bisect import bisect_left
+
+from .comum import COLUNAS_ESTABELECIMENTOS
+from . import memoria
+from .ordenacao import LIMITE_BUFFER, ParticionadorExterno, ler_ordenado, limpar
+
+DIRETORIO_PADRAO = os.environ.get("RFB_INDICE", "indice_cnpj")
+TOTAL_PARTICOES = 1000          # 3 primeiros dígitos do cnpj_basico
+SEPARADOR = "\x1f"
+CUSTO_REGISTRO = 600            # bytes de (chave, registro utf-8) no buffer da partição
+MANTER_VERSOES = 2              # versões do mês no disco (a publicada + a anterior)
+
+
+def _particao(chave):
+    return chave // 10 ** 11
+
+
+def _diretorio_spill(diretorio, mes_ano):
+    return os.path.join(diretorio, f".spill-{mes_ano}")
+
+
+def chave_cnpj(cnpj):
+    """'12.345.678/0001-90' | '12345678000190' → 12345678000190 (None se inválido)"""
+    digitos = "".join(c for c in str(cnpj) if c.isdigit())
+    return int(digitos) if len(digitos) == 14 else None
+
+
+class ColetorIndice:
+    """Recebe as linhas de UM arquivo (pode rodar em processo do pool) e espalha em disco"""
+
+    def __init__(self, diretorio, mes_ano, arquivo_num):
+        limite = memoria.atual().linhas("particoes", CUSTO_REGISTRO, LIMITE_BUFFER)
+        self._particionador = ParticionadorExterno(
+            _diretorio_spill(diretorio, mes_ano), _particao, prefixo=str(arquivo_num), limite_buffer=limite)
+
+    def adicionar(self, row):
+        digitos = row[0] + row[1] + row[2]
+        if len(digitos) == 14 and digitos.isdigit():
+            self._particionador.adicionar(int(digitos), SEPARADOR.join(row).encode('utf-8'))
+
+    def fechar(self):
+        self._particionador.fechar()
+
+
+def _trocar_link(diretorio, nome, alvo):
+    """Symlink <diretorio>/<nome> → alvo, trocado com rename (nunca some nem fica pendurado)"""
+    link_tmp = os.path.join(diretorio, f".{nome}-{os.getpid()}")
+    if os.path.lexists(link_tmp):
+        os.remove(link_tmp)
+    os.symlink(alvo, link_tmp)
+    destino = os.path.join(diretorio, nome)
+    if os.path.isdir(destino) and not os.path.islink(destino):
+        # Layout antigo (diretório do mês sem versão): vira uma versão comum antes da troca
+        os.rename(destino, os.path.join(diretorio, f"{nome}.v{0:06d}"))
+    os.replace(link_tmp, destino)
+
+
+def _versoes(diretorio, mes_ano):
+    """Versões publicadas do mês, da mais antiga para a mais nova"""
+    padrao = re.compile(re.escape(mes_ano) + r"\.v\d{6}")
+    return sorted(nome for nome in os.listdir(diretorio)
+                  if padrao.fullmatch(nome) and os.path.isdir(os.path.join(diretorio, nome)))
+
+
+def preparar(diretorio, mes_ano):
+    """Descarta restos de uma construção anterior interrompida"""
+    spill = _diretorio_spill(diretorio, mes_ano)
+    if os.path.isdir(spill):
+        shutil.rmtree(spill)
+
+
+def construir(diretorio, mes_ano):
+    """Ordena o que os coletores gravaram, escreve os arquivos do índice e publica 'atual'"""
+    inicio = time.time()
+    spill = _diretorio_spill(diretorio, mes_ano)
+    os.makedirs(diretorio, exist_ok=True)
+    versoes = _versoes(diretorio, mes_ano)
+    versao = f"{mes_ano}.v{int(versoes[-1][-6:]) + 1 if versoes else 1:06d}"
+    tmp = os.path.join(diretorio, f".{versao}.tmp-{os.getpid()}")
+    os.makedirs(tmp)
+
+    total = duplicados = 0
+    anterior = -1
+    chaves, offsets = array('Q'), array('Q', [0])
+    with open(os.path.join(tmp, "registros.bin"), 'wb') as f_registros, \
+            open(os.path.join(tmp, "chaves.bin"), 'wb') as f_chaves, \
+            open(os.path.join(tmp, "offsets.bin"), 'wb') as f_offsets:
+        posicao = 0
+        for chave, registro in ler_ordenado(spill, TOTAL_PARTICOES):
+            if chave == anterior:
+                duplicados += 1
+                continue
+            anterior = chave
+            f_registros.write(registro)
+            posicao += len(registro)
+            chaves.append(chave)
+            offsets.append(posicao)
+            total += 1
+            if len(chaves) >= 1_000_000:
+                chaves.tofile(f_chaves)
+                offsets.tofile(f_offsets)
+                chaves, offsets = array('Q'), array('Q')
+        chaves.tofile(f_chaves)
+        offsets.tofile(f_offsets)
+    with open(os.path.join(tmp, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump({"mes_ano": mes_ano, "total": total, "byteorder": sys.byteorder,
+                   "colunas": COLUNAS_ESTABELECIMENTOS}, f, ensure_ascii=False)
+
+    # Publicação: versão nova ao lado das antigas; só os symlinks mudam (cada um num rename)
+    final = os.path.join(diretorio, versao)
+    os.rename(tmp, final)
+    _trocar_link(diretorio, "atual", versao)
+    _trocar_link(diretorio, mes_ano, versao)
+    for antiga in _versoes(diretorio, mes_ano)[:-MANTER_VERSOES]:
+        shutil.rmtree(os.path.join(diretorio, antiga))
+    limpar(spill)
+
+    tempo = time.time() - inicio
+    print(f"\n🗂️  Índice {final}: {total:,} CNPJs | {duplicados:,} duplicados ignorados | {tempo:.1f}s")
+    return {"diretorio": final, "total": total, "duplicados": duplicados, "tempo_segundos": round(tempo, 1)}
+
+
+class IndiceCNPJ:
+    """Consulta por CNPJ em um índice publicado (diretório do mês ou a base com 'atual')"""
+
+    def __init__(self, caminho=None):
+        caminho = caminho or DIRETORIO_PADRAO
+        if os.path.exists(os.path.join(caminho, "atual")):
+            caminho = os.path.join(caminho, "atual")
+        # Resolve o symlink uma vez: uma publicação no meio não mistura arquivos de versões diferentes
+        caminho = os.path.realpath(caminho)
+        with open(os.path.join(caminho, "meta.json"), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta["byteorder"] != sys.byteorder:
+            raise ValueError(f"Índice gravado em {self.meta['byteorder']}-endian")
+
+        self._recursos = []
+        self._chaves = self._mapear(caminho, "chaves.bin").cast('Q')
+        self._offsets = self._mapear(caminho, "offsets.bin").cast('Q')
+        self._registros = self._mapear(caminho, "registros.bin")
+
+    def _mapear(self, caminho, nome):
+        f = open(os.path.join(caminho, nome), 'rb')
+        self._recursos.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._recursos.append(mapa)
+        return memoryview(mapa)
+
+    def __len__(self):
+        return len(self._chaves)
+
+    def posicao(self, cnpj):
+        """Índice do CNPJ no array de chaves (ou None)"""
+        chave = cnpj if isinstance(cnpj, int) else chave_cnpj(cnpj)
+        if chave is None:
+            return None
+        i = bisect_left(self._chaves, chave)
+        if i < len(self._chaves) and self._chaves[i] == chave:
+            return i
+        return None
+
+    def buscar(self, cnpj):
+        """Registro do CNPJ como dict (colunas de Estabelecimentos) ou None"""
+        i = self.posicao(cnpj)
+        if i is None:
+            return None
+        bruto = self._registros[self._offsets[i]:self._offsets[i + 1]]
+        return dict(zip(self.meta["colunas"], bytes(bruto).decode('utf-8').split(SEPARADOR)))
+
+    def fechar(self):
+        # memoryviews precisam ser liberadas antes de fechar o mmap
+        for vista in (self._chaves, self._offsets, self._registros):
+            vista.release()
+        for recurso in reversed(self._recursos):
+            recurso.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+def benchmark(indice, consultas=100_000):
+    """Mede consultas aleatórias (metade existentes, metade ausentes)"""
+    total = len(indice)
+    if not total:
+        print("⚠️  Índice vazio")
+        return {}
+    existentes = [indice._chaves[random.randrange(total)] for _ in range(consultas // 2)]
+    ausentes = [random.randrange(10 ** 13, 10 ** 14) for _ in range(consultas - len(existentes))]
+    amostra = existentes + ausentes
+    random.shuffle(amostra)
+
+    inicio = time.perf_counter()
+    for chave in amostra:
+        indice.posicao(chave)
+    tempo_posicao = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    achados = sum(1 for chave in existentes if indice.buscar(chave) is not None)
+    tempo_buscar = time.perf_counter() - inicio
+
+    resultado = {
+        "cnpjs": total,
+        "consultas": len(amostra),
+        "us_por_posicao": round(tempo_posicao / len(amostra) * 1e6, 2),
+        "us_por_busca_com_registro": round(tempo_buscar / max(len(existentes), 1) * 1e6, 2),
+        "achados": achados,
+    }
+    print(f"⚡ {total:,} CNPJs | {resultado['us_por_posicao']}µs/consulta (chave) | "
+          f"{resultado['us_por_busca_com_registro']}µs/consulta (registro completo)")
+    return resultado
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+RFB MEMORIA - Orçamento de memória da importação (containers pequenos sem OOM)
+- teto por processo: --memoria-mb / RFB_MEMORIA_MB (com --workers, teto/workers)
+  menos FOLGA_MB do interpretador e bibliotecas; sem teto = comportamento antigo
+- cada estágio tem uma cota (COTAS) e se limita a ela:
+  * download: ZIP vai para arquivo temporário em blocos (nunca inteiro na memória)
+  * lote: tamanho do lote de COPY calculado pelo custo medido das primeiras linhas
+  * dedup: buffer de filiais pendentes limitado; filiais concluídas além da cota vão
+    para um arquivo mapeado (mmap); bitmaps fixos (25MB) contabilizados
+  * particoes (índice / junção) e colunar: descarregam no disco ao atingir a cota
+  * spool: segmento lido para o COPY reserva bytes; sem vaga, espera (backpressure)
+- custo estimado por objetos Python (sys.getsizeof), não RSS
+- perfil (--perfil-memoria [N]): tracemalloc no laço leitura/envio, top N locais de alocação
+- verificar: arquivo sintético (padrão 1GB) importado em outro processo com o teto;
+  sai com erro se o pico de RSS (VmHWM de /proc/<pid>/status do processo) passar do teto
+  * padrão: destino nulo (nada vai ao banco)
+  * --banco: snapshot de 2099-01 sem publicar (mede também o CSV do COPY e o psycopg2);
+    a tabela e o registro em rfb_snapshots são apagados no final
+
+Uso:
+  rfb-etl importar --mes 2024-01 --memoria-mb 512 [--perfil-memoria 20]
+  rfb-etl memoria verificar [--tamanho-mb 1024] [--memoria-mb 256] [--dir /tmp] [--banco]
+"""
+import os, shutil, subprocess, sys, tempfile, threading, time, tracemalloc, zipfile
+from contextlib import contextmanager
+
+MB = 1024 * 1024
+LIMITE_MB = float(os.environ.get("RFB_MEMORIA_MB") or 0) or None
+FOLGA_MB = 48                   # interpretador, psycopg2, módulos carregados
+MINIMO_ESTRUTURAS_MB = 16
+COTAS = {"lote": 0.35, "dedup": 0.20, "particoes": 0.20, "colunar": 0.15, "spool": 0.10}
+AMOSTRA_LINHAS = 1000           # primeiro lote (mede o custo por linha)
+CUSTO_LINHA = 1600              # bytes de uma tupla de 30 strings (quando não há amostra)
+MES_SINTETICO = "2099-01"
+INTERVALO_PICO = 0.05           # segundos entre leituras do VmHWM do processo verificado
+
+_orcamento = None
+
+
+def custo_linhas(linhas):
+    """Bytes ocupados pelas tuplas e suas strings (strings compartilhadas contam uma vez)"""
+    vistos = set()
+    total = 0
+    for row in linhas:
+        total += sys.getsizeof(row)
+        for campo in row:
+            if id(campo) not in vistos:
+                vistos.add(id(campo))
+                total += sys.getsizeof(campo)
+    return total
+
+
+def obter(limite_mb=None, divisor=1):
+    """Orçamento do processo (recriado se o teto mudar)"""
+    global _orcamento
+    limite_mb = limite_mb or LIMITE_MB
+    limite_mb = limite_mb / max(int(divisor), 1) if limite_mb else None
+    if _orcamento is None or _orcamento.limite_mb != limite_mb:
+        _orcamento = OrcamentoMemoria(limite_mb)
+    return _orcamento
+
+
+def atual():
+    """Orçamento já criado pelo motor (ou um sem teto) para estágios mais internos"""
+    return _orcamento if _orcamento is not None else obter()
+
+
+class OrcamentoMemoria:
+    def __init__(self, limite_mb=None):
+        self.limite_mb = limite_mb
+        self.limite = int(limite_mb * MB) if limite_mb else None
+        self.estruturas = (max(self.limite - FOLGA_MB * MB, MINIMO_ESTRUTURAS_MB * MB)
+                           if self.limite else None)
+        self._usado = {}
+        self._pico = {}
+        self._avisados = set()
+        self._cond = threading.Condition()
+
+    def cota(self, estagio):
+        """Bytes que o estágio pode usar (None = sem teto)"""
+        return None if self.estruturas is None else int(self.estruturas * COTAS[estagio])
+
+    def linhas(self, estagio, custo_linha, padrao):
+        """Quantos itens de custo_linha bytes cabem na cota (nunca mais que o padrão)"""
+        cota = self.cota(estagio)
+        if cota is None:
+            return padrao
+        return max(min(padrao, int(cota // max(custo_linha, 1))), 1)
+
+    def reservar(self, estagio, tamanho):
+        """Bloqueia até caber na cota; sozinho o estágio sempre passa (evita travar)"""
+        cota = self.cota(estagio)
+        with self._cond:
+            usado = self._usado.get(estagio, 0)
+            if cota is not None and usado and usado + tamanho > cota:
+                self._cond.wait_for(lambda: not self._usado.get(estagio, 0)
+                                    or self._usado[estagio] + tamanho <= cota)
+            self._usado[estagio] = self._usado.get(estagio, 0) + tamanho
+            self._pico[estagio] = max(self._pico.get(estagio, 0), self._usado[estagio])
+
+    def liberar(self, estagio, tamanho):
+        with self._cond:
+            self._usado[estagio] -= tamanho
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserva(self, estagio, tamanho):
+        self.reservar(estagio, tamanho)
+        try:
+            yield
+        finally:
+            self.liberar(estagio, tamanho)
+
+    def registrar(self, estagio, tamanho):
+        """Uso de uma estrutura que não encolhe (só contabiliza e avisa)"""
+        with self._cond:
+            self._pico[estagio] = max(self._pico.get(estagio, 0), tamanho)
+        cota = self.cota(estagio)
+        if cota is not None and tamanho > cota and estagio not in self._avisados:
+            self._avisados.add(estagio)
+            print(f"      ⚠️  Memória: {estagio} usa {tamanho / MB:.0f}MB (cota {cota / MB:.0f}MB)")
+
+    def relatorio(self):
+        return {
+            "limite_mb": self.limite_mb,
+            "cotas_mb": {e: round(self.cota(e) / MB, 1) for e in COTAS} if self.limite else None,
+            "pico_mb": {e: round(v / MB, 1) for e, v in self._pico.items()},
+        }
+
+
+class PerfilMemoria:
+    """tracemalloc durante um arquivo: guarda o snapshot do maior uso visto em marcar()"""
+
+    def __init__(self, top=15):
+        self.top = top
+        self._maior = 0
+        self._snapshot = None
+        tracemalloc.start()
+
+    def marcar(self):
+        atual_bytes, _ = tracemalloc.get_traced_memory()
+        if atual_bytes > self._maior * 1.1:
+            self._maior = atual_bytes
+            self._snapshot = tracemalloc.take_snapshot()
+
+    def relatorio(self):
+        _, pico = tracemalloc.get_traced_memory()
+        snapshot = self._snapshot or tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        locais = []
+        print(f"      🔬 tracemalloc: pico {pico / MB:.1f}MB | maior marca {self._maior / MB:.1f}MB")
+        for estatistica in snapshot.statistics('lineno')[:self.top]:
+            quadro = estatistica.traceback[0]
+            local = f"{quadro.filename}:{quadro.lineno}"
+            locais.append({"local": local, "mb": round(estatistica.size / MB, 2), "blocos": estatistica.count})
+            print(f"         {estatistica.size / MB:8.2f}MB {estatistica.count:>9,} blocos  {local}")
+        return {"pico_mb": round(pico / MB, 1), "top": locais}
+
+
+# --- verificação com arquivo sintético --------------------------------------
+
+def gerar_sintetico(caminho_zip, tamanho_mb):
+    """ZIP com um CSV no layout da RFB de ~tamanho_mb MB descompactado (1 filial a cada 10)"""
+    alvo = int(tamanho_mb * MB)
+    escritos = basico = 0
+    with zipfile.ZipFile(caminho_zip, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as z, \
+            z.open("K3241.K03200Y0.D99999.ESTABELE", 'w', force_zip64=True) as f:
+        while escritos < alvo:
+            partes = []
+            for _ in range(10000):
+                basico += 1
+                ordem = 2 if basico % 10 == 0 else 1
+                partes.append(
+                    f'"{basico:08d}";"{ordem:04d}";"{basico % 97:02d}";"{ordem}";"FANTASIA {basico}";"02";'
+                    f'"20200101";"00";"";"";"20100101";"4744099";"4744005,4679699";"RUA";'
+                    f'"LOGRADOURO SINTETICO {basico % 5000}";"{basico % 2000}";"SALA {basico % 30}";"CENTRO";'
+                    f'"{basico % 100000000:08d}";"SP";"7107";"11";"3{basico % 10000000:07d}";"";"";"";"";'
+                    f'"contato{basico}@exemplo.com.br";"";""\r\n')
+            bloco = "".join(partes).encode('latin-1')
+            f.write(bloco)
+            escritos += len(bloco)
+    return basico
+
+
+def _descartar_snapshots_sinteticos():
+    """Apaga as tabelas de snapshot do mês sintético e seus registros (nunca publicadas)"""
+    from psycopg2 import sql
+    from .comum import conectar_db
+    from . import snapshot
+    conn = conectar_db()
+    try:
+        snapshot.criar_esquema(conn)
+        cursor = conn.cursor()
+        cursor.execute("SELECT tabela FROM rfb_snapshots WHERE mes_ano = %s AND estado <> 'publicado'",
+                       (MES_SINTETICO,))
+        for tabela, in cursor.fetchall():
+            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(tabela)))
+            cursor.execute("DELETE FROM rfb_snapshots WHERE tabela = %s", (tabela,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _pico_processo(pid):
+    """VmHWM do processo em MB (None se já saiu)"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for linha in status:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1]) / 1024   # KB
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def _executar_medindo(comando, env, saida, intervalo=INTERVALO_PICO):
+    """Roda o comando e devolve (código de saída, pico de RSS em MB) só deste processo"""
+    with open(saida, 'w') as arquivo:
+        processo = subprocess.Popen(comando, env=env, stdout=arquivo, stderr=subprocess.STDOUT)
+    # ru_maxrss não serve: RUSAGE_CHILDREN é o maior de todos os filhos e o do filho herda, no exec,
+    # o RSS deste processo. VmHWM é da memória do processo depois do exec (só cresce: basta amostrar)
+    pico = 0.0
+    while processo.poll() is None:
+        pico = max(pico, _pico_processo(processo.pid) or 0.0)
+        time.sleep(intervalo)
+    return processo.returncode, pico
+
+
+def verificar(tamanho_mb=1024, limite_mb=256, diretorio=None, banco=False):
+    """
+    Importa o arquivo sintético em outro processo com o teto. Retorna (ok, resumo)
+    Sem banco: destino nulo. Com banco: só numa tabela de snapshot de 2099-01, nunca publicada
+    nem na tabela estabelecimentos (os CNPJs sintéticos colidiriam com CNPJs reais).
+    """
+    base = tempfile.mkdtemp(prefix="rfb_memoria_", dir=diretorio)
+    try:
+        os.makedirs(os.path.join(base, MES_SINTETICO))
+        print(f"🧪 Gerando arquivo sintético de {tamanho_mb:,.0f}MB em {base}...")
+        inicio = time.time()
+        linhas = gerar_sintetico(os.path.join(base, MES_SINTETICO, "Estabelecimentos0.zip"), tamanho_mb)
+        print(f"   {linhas:,} linhas em {time.time() - inicio:.0f}s")
+
+        env = {**os.environ, "RFB_URL_DADOS": f"file://{base}", "TMPDIR": base}
+        destino = ["--estrategia", "snapshot", "--nao-publicar"] if banco else ["--destino", "nulo"]
+        comando = [sys.executable, "-m", "rfb_etl", "importar", "--mes", MES_SINTETICO, "--arquivos", "0",
+                   *destino, "--memoria-mb", str(limite_mb)]
+        print(f"🚀 {' '.join(comando[1:])}")
+        if banco:
+            _descartar_snapshots_sinteticos()
+        inicio = time.time()
+        try:
+            codigo, pico_mb = _executar_medindo(comando, env, os.path.join(base, "saida.log"))
+        finally:
+            if banco:
+                _descartar_snapshots_sinteticos()
+        tempo = time.time() - inicio
+        if codigo != 0:
+            with open(os.path.join(base, "saida.log")) as arquivo:
+                print(arquivo.read()[-3000:])
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+    ok = codigo == 0 and pico_mb <= limite_mb
+    resumo = {"ok": ok, "linhas": linhas, "tamanho_mb": tamanho_mb, "limite_mb": limite_mb, "banco": banco,
+              "pico_rss_mb": round(pico_mb, 1), "tempo_segundos": round(tempo, 1), "codigo_saida": codigo}
+    print(f"{'✅' if ok else '❌'} Pico de RSS: {pico_mb:.0f}MB de {limite_mb:.0f}MB | {tempo:.0f}s")
+    return ok, resumo
@@ -0,0 +1,632 @@
+# -*- coding: utf-8 -*-
+"""
+RFB MOTOR - Pipeline único de importação de Estabelecimentos
+- leitura (ZIP da RFB, CSV local ou cache colunar) → filtro CNAE → dedup → destino
+- destinos: postgres | colunar (só grava o cache) | nulo (só lê, p/ medir)
+  | juncao (partições por cnpj_basico p/ o merge-join com Empresas, ver denormalizado.py)
+- estratégias no postgres (COPY em lotes, bem mais rápido que execute_values):
+  * upsert: staging + UPSERT das 30 colunas     (antigo import_rfb_completo)
+  * direto: staging + INSERT ON CONFLICT DO NOTHING (antigo import_rfb_insert_direto)
+  * mensal: COPY na partição de estabelecimentos_mensal (perfis de CNAE no servidor)
+  * snapshot: COPY numa tabela nova do mês, índices em bulk e troca atômica da view (ver snapshot.py)
+- arquivos em sequência (dedup entre arquivos) ou em pool de processos (--workers)
+- opcional: índice local de consulta por CNPJ montado com as mesmas linhas (--indice)
+- opcional: feed de mudanças gravado pelo próprio UPSERT (--mudancas)
+- opcional: spool em disco entre leitura e banco, com retomada (--spool, ver spool.py)
+- opcional: ritmo guiado pela saúde do banco (--governador, ver governador.py)
+- opcional: conferência carga × banco por checksums agregados (--reconciliar, ver reconciliacao.py)
+- opcional: COPY lido pelo próprio servidor quando o importador roda ao lado do banco (--servidor, ver servidor.py)
+- orçamento de memória por processo e perfil com tracemalloc (--memoria-mb, --perfil-memoria, ver memoria.py)
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from .comum import (BATCH_SIZE, COLUNAS_ESTABELECIMENTOS, conectar_db, copiar_csv, codificar_lote,
+                    linhas_estabelecimentos, sql_upsert_estabelecimentos)
+from .dedup import TAMANHO_BUFFER, DeduplicadorCNPJ
+
+from psycopg2 import sql
+
+ESTRATEGIAS = ("upsert", "direto", "mensal", "snapshot")
+DESTINOS = ("postgres", "colunar", "nulo", "juncao")
+LOTE_COPY = BATCH_SIZE * 5
+CUSTO_PENDENTE = 100    # bytes de uma filial no set de pendentes do dedup (int + entrada do set)
+
+
+def filtro_cnae(cnaes, apenas_principal=False):
+    """Predicado sobre a linha: CNAE principal (coluna 11) OU algum secundário (coluna 12)"""
+    if not cnaes:
+        return None
+    cnaes = frozenset(cnaes)
+
+    def aceita(row):
+        if row[11] in cnaes:
+            return True
+        if apenas_principal or not row[12]:
+            return False
+        return any(c.strip() in cnaes for c in row[12].split(','))
+
+    return aceita
+
+
+class DestinoNulo:
+    """Só conta as linhas (mede a leitura ou apenas grava o cache colunar)"""
+
+    def __init__(self):
+        self.registros = 0
+
+    def escrever(self, lote):
+        self.registros += len(lote)
+
+    def concluir(self):
+        return {}
+
+    def abortar(self):
+        pass
+
+
+class DestinoPostgres:
+    """COPY dos lotes na staging (ou na partição mensal / tabela do snapshot) e merge no final do arquivo"""
+
+    def __init__(self, estrategia, mes_ano, arquivo_num, staging_propria=False, registrar_mudancas=False,
+                 truncar=True, governador=None, tabela_snapshot=None, lease=None):
+        self.estrategia = estrategia
+        self.mes_ano = mes_ano
+        self.arquivo_num = arquivo_num
+        self.registrar_mudancas = registrar_mudancas
+        self.governador = governador
+        self.lease = lease   # (mes_ano, arquivo, worker) do item da fila
+        self.espera = 0.0
+        self._com_vaga = False
+        self.registros = 0
+        self.conn = conectar_db()
+        self.cursor = self.conn.cursor()
+
+        if estrategia == "mensal":
+            from . import perfis
+            # Um arquivo = uma transação: falha no meio não deixa linhas soltas na partição
+            self.tabela = sql.Identifier(perfis.nome_particao(mes_ano))
+            self.commit_por_lote = False
+        elif estrategia == "snapshot":
+            # Idem: ninguém lê a tabela até a publicação, e sem índices o COPY vai direto
+            self.tabela = sql.Identifier(tabela_snapshot)
+            self.commit_por_lote = False
+        elif lease is not None:
+            # Fila: staging TEMP da sessão, gravada e mesclada numa transação só, com o lease conferido
+            # no fim. Worker que perdeu o lease não suja a staging de quem assumiu o item
+            self.tabela = sql.Identifier("estabelecimentos_staging_fila")
+            self.commit_por_lote = False
+            self.cursor.execute(sql.SQL(
+                "CREATE TEMP TABLE {} (LIKE estabelecimentos_staging) ON COMMIT DROP").format(self.tabela))
+        else:
+            # Em paralelo cada arquivo usa sua própria staging (mês + arquivo: cargas simultâneas não se cruzam)
+            nome = "estabelecimentos_staging"
+            if staging_propria:
+                nome = f"estabelecimentos_staging_{mes_ano.replace('-', '_')}_{arquivo_num}"
+            self.tabela = sql.Identifier(nome)
+            self.commit_por_lote = True
+            if staging_propria:
+                self.cursor.execute(sql.SQL(
+                    "CREATE TABLE IF NOT EXISTS {} (LIKE estabelecimentos_staging)").format(self.tabela))
+            # Retomada do spool: staging já tem os segmentos aplicados antes da queda
+            if truncar:
+                self.cursor.execute(sql.SQL("TRUNCATE {}").format(self.tabela))
+            self.conn.commit()
+
+    def escrever(self, lote):
+        self.escrever_csv(codificar_lote(lote), len(lote))
+        if self.commit_por_lote:
+            self.commit()
+
+    def escrever_csv(self, dados, linhas):
+        """COPY de um lote já codificado (sem commit)"""
+        if self.governador is not None:
+            self.espera += self.governador.ritmar(linhas)
+            self._reservar_vaga()
+        copiar_csv(self.cursor, self.tabela.as_string(self.cursor), dados)
+        self.registros += linhas
+
+    def commit(self):
+        self.conn.commit()
+        self._com_vaga = False
+
+    def _reservar_vaga(self):
+        # A vaga é um xact lock: vale até o próximo commit (sem commit por lote, o arquivo inteiro)
+        if not self._com_vaga:
+            self.espera += self.governador.reservar_vaga(self.cursor)
+            self._com_vaga = True
+
+    def concluir(self):
+        colunas = sql.SQL(', ').join(map(sql.Identifier, COLUNAS_ESTABELECIMENTOS))
+        select = sql.SQL("SELECT {} FROM {}").format(colunas, self.tabela)
+        stats = {}
+        com_merge = self.estrategia in ("upsert", "direto")
+        if self.governador is not None and com_merge:
+            self.espera += self.governador.aguardar_saude()
+            self._reservar_vaga()
+
+        if self.estrategia == "upsert" and self.registrar_mudancas:
+            from . import mudancas
+            print("      💾 UPSERT staging → estabelecimentos (+ feed de mudanças)...")
+            # ids do feed em ordem de commit: um merge com feed por vez até o commit
+            mudancas.travar_feed(self.cursor)
+            self.cursor.execute(mudancas.sql_upsert_com_mudancas(self.tabela, self.mes_ano, self.arquivo_num))
+            stats["afetados"], stats["mudancas"] = self.cursor.fetchone()
+        elif self.estrategia == "upsert":
+            print("      💾 UPSERT staging → estabelecimentos...")
+            self.cursor.execute(sql_upsert_estabelecimentos(select))
+            stats["afetados"] = self.cursor.rowcount
+        elif self.estrategia == "direto":
+            self.cursor.execute(sql.SQL(
+                "INSERT INTO estabelecimentos ({}) {} ON CONFLICT (cnpj_completo) DO NOTHING"
+            ).format(colunas, select))
+            stats["inseridos"] = self.cursor.rowcount
+            stats["ignorados"] = self.registros - self.cursor.rowcount
+
+        if com_merge:
+            self.cursor.execute(sql.SQL("TRUNCATE {}").format(self.tabela))
+        if self.lease is not None:
+            self._confirmar_lease()
+        self.commit()
+        self._fechar()
+        if self.governador is not None:
+            stats["espera_governador_seg"] = round(self.espera, 1)
+        return stats
+
+    def _confirmar_lease(self):
+        """Na mesma transação dos dados: item ainda é deste worker (trava a linha até o commit)"""
+        self.cursor.execute("""
+            UPDATE rfb_fila_trabalho SET heartbeat = NOW()
+            WHERE mes_ano = %s AND arquivo = %s AND worker = %s AND estado = 'executando'
+        """, self.lease)
+        if not self.cursor.rowcount:
+            raise RuntimeError(f"Lease do arquivo {self.arquivo_num} perdido para outro worker; carga desfeita")
+
+    def abortar(self):
+        try:
+            self.conn.rollback()
+        finally:
+            self._fechar()
+
+    def _fechar(self):
+        self.cursor.close()
+        self.conn.close()
+
+
+def abrir_destino(opcoes, mes_ano, arquivo_num, spool=None, retomar=False):
+    if opcoes["destino"] == "juncao":
+        from .denormalizado import DestinoParticionado
+        return DestinoParticionado(opcoes["juncao"], arquivo_num)
+    if opcoes["destino"] != "postgres":
+        return DestinoNulo()
+
+    def abrir_postgres(truncar=True):
+        ritmo = None
+        if opcoes["governador"] is not None:
+            from . import governador
+            ritmo = governador.obter(opcoes["governador"], opcoes["workers"])
+        return DestinoPostgres(opcoes["estrategia"], mes_ano, arquivo_num,
+                               staging_propria=opcoes["staging_propria"],
+                               registrar_mudancas=opcoes["mudancas"], truncar=truncar, governador=ritmo,
+                               tabela_snapshot=opcoes["snapshot"], lease=opcoes["lease"])
+
+    if spool is not None:
+        from .spool import DestinoSpool
+        return DestinoSpool(spool, mes_ano, arquivo_num, abrir_postgres, retomar)
+    return abrir_postgres()
+
+
+def montar_opcoes(estrategia="upsert", destino="postgres", cnaes=None, apenas_principal=False,
+                  workers=1, csv_local=None, cache_colunar=None, deduplicar=True, indice_dir=None,
+                  registrar_mudancas=False, spool_dir=None, spool_limite_mb=None, alvos_governador=None,
+                  juncao_dir=None, reconciliar=False, servidor_dir=None, servidor_dir_banco=None,
+                  servidor_unzip=False, memoria_mb=None, perfil_memoria=None, staging_propria=None,
+                  snapshot_tabela=None, lease=None):
+    """Valida e junta as opções que viajam até processar_arquivo (também em outro processo)"""
+    if estrategia not in ESTRATEGIAS:
+        raise ValueError(f"Estratégia inválida: {estrategia!r} (use {', '.join(ESTRATEGIAS)})")
+    if destino not in DESTINOS:
+        raise ValueError(f"Destino inválido: {destino!r} (use {', '.join(DESTINOS)})")
+    if destino == "colunar" and not cache_colunar:
+        raise ValueError("Destino colunar exige --cache-colunar DIRETORIO")
+    if destino == "colunar" and csv_local:
+        raise ValueError("Cache colunar só é gravado a partir do ZIP da RFB (sem --csv-local)")
+    if destino == "juncao" and not juncao_dir:
+        raise ValueError("Destino juncao exige o diretório das partições")
+    if estrategia == "mensal" and cnaes:
+        # A partição guarda o mês inteiro: os perfis de CNAE filtram no servidor
+        raise ValueError("Estratégia mensal não aceita filtro de CNAE (use os perfis: rfb-etl perfis perfil ...)")
+    if registrar_mudancas and (estrategia != "upsert" or destino != "postgres"):
+        raise ValueError("Feed de mudanças só existe na estratégia upsert com destino postgres")
+    if spool_dir and (estrategia in ("mensal", "snapshot") or destino != "postgres"):
+        raise ValueError("Spool só existe nas estratégias com staging (upsert/direto) e destino postgres")
+    if reconciliar and (estrategia == "direto" or destino != "postgres"):
+        raise ValueError("Reconciliação só existe nas estratégias upsert/mensal/snapshot com destino postgres")
+    if reconciliar and estrategia == "upsert" and (workers > 1 or not deduplicar):
+        # Duplicata entre arquivos entraria duas vezes no agregado e uma só no banco
+        raise ValueError("Reconciliação do upsert exige dedup entre arquivos (--workers 1, sem --sem-dedup)")
+    if servidor_dir and (destino != "postgres" or spool_dir or indice_dir or reconciliar or cache_colunar):
+        raise ValueError("Carga pelo servidor não passa as linhas pelo Python: "
+                         "sem spool, índice, reconciliação ou cache colunar (destino postgres)")
+    return {
+        "estrategia": estrategia, "destino": destino, "cnaes": cnaes,
+        "apenas_principal": apenas_principal, "workers": workers, "csv_local": csv_local,
+        "cache_colunar": cache_colunar, "deduplicar": deduplicar, "indice": indice_dir,
+        "mudancas": registrar_mudancas, "spool": spool_dir, "spool_limite_mb": spool_limite_mb,
+        "governador": alvos_governador,   # None = sem governador; {} = alvos padrão
+        "juncao": juncao_dir,
+        "reconciliar": reconciliar,
+        "servidor": servidor_dir, "servidor_banco": servidor_dir_banco, "servidor_unzip": servidor_unzip,
+        "memoria_mb": memoria_mb, "perfil_memoria": perfil_memoria,   # perfil: top N locais (None = sem)
+        "snapshot": snapshot_tabela,   # tabela em construção (importar/fila preenchem)
+        "lease": lease,                # (mes_ano, arquivo, worker) quando o arquivo veio da fila
+        # Arquivos simultâneos (pool ou fila) não podem dividir a mesma staging
+        "staging_propria": workers > 1 if staging_propria is None else staging_propria,
+    }
+
+
+def processar_arquivo(mes_ano, arquivo_num, opcoes, deduplicador=None):
+    """Lê, filtra, deduplica e envia um arquivo ao destino. Retorna o resumo do arquivo"""
+    if opcoes["servidor"]:
+        from . import servidor
+        return servidor.processar_arquivo(mes_ano, arquivo_num, opcoes)
+    arquivo_nome = f"Estabelecimentos{arquivo_num}.zip"
+    inicio = time.time()
+    print("\n" + "="*70)
+    print(f"📦 Arquivo: {arquivo_nome} (#{arquivo_num})")
+    print(f"⏰ Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("="*70)
+
+    spool = None
+    if opcoes["spool"]:
+        from .spool import LIMITE_MB, Spool
+        spool = Spool(opcoes["spool"], mes_ano, arquivo_num, opcoes["spool_limite_mb"] or LIMITE_MB)
+        # Leitura já completa numa execução anterior: só drena o resto (sem baixar de novo)
+        if spool.completo and not opcoes["indice"] and not opcoes["reconciliar"]:
+            return _retomar_spool(spool, opcoes, mes_ano, arquivo_num, inicio)
+        spool.reiniciar()
+
+    from . import memoria
+    orcamento = memoria.obter(opcoes["memoria_mb"], opcoes["workers"])
+    perfil = memoria.PerfilMemoria(opcoes["perfil_memoria"]) if opcoes["perfil_memoria"] else None
+    linhas, tamanho_mb = linhas_estabelecimentos(
+        mes_ano, arquivo_nome, opcoes["csv_local"], opcoes["cache_colunar"])
+    aceita = filtro_cnae(opcoes["cnaes"], opcoes["apenas_principal"])
+    if deduplicador is None and opcoes["deduplicar"]:
+        deduplicador = DeduplicadorCNPJ(orcamento.linhas("dedup", CUSTO_PENDENTE, TAMANHO_BUFFER),
+                                        orcamento.cota("dedup"))
+    if deduplicador is not None:
+        deduplicador.iniciar_arquivo(arquivo_num)
+
+    coletor = agregador = None
+    if opcoes["indice"]:
+        from . import indice
+        coletor = indice.ColetorIndice(opcoes["indice"], mes_ano, arquivo_num)
+    if opcoes["reconciliar"]:
+        from . import reconciliacao
+        agregador = reconciliacao.Agregador()
+    destino = abrir_destino(opcoes, mes_ano, arquivo_num, spool)
+    lote = []
+    lidos = descartados = duplicados = lotes = 0
+    # Com teto de memória o 1º lote é pequeno: mede o custo por linha e dimensiona os seguintes
+    limite_lote = LOTE_COPY if orcamento.limite is None else memoria.AMOSTRA_LINHAS
+    custo_linha = None
+
+    def enviar(lote):
+        nonlocal custo_linha, limite_lote
+        if custo_linha is None:
+            # tuplas + CSV codificado para o COPY (~metade do tamanho das tuplas)
+            amostra = lote[:memoria.AMOSTRA_LINHAS]
+            custo_linha = memoria.custo_linhas(amostra) / len(amostra) * 1.5
+            limite_lote = orcamento.linhas("lote", custo_linha, LOTE_COPY)
+        with orcamento.reserva("lote", int(len(lote) * custo_linha)):
+            if perfil is not None:
+                perfil.marcar()
+            destino.escrever(lote)
+
+    try:
+        for row in linhas:
+            lidos += 1
+            if aceita is not None and not aceita(row):
+                descartados += 1
+                continue
+            # Duplicatas derrubariam o UPSERT ("cannot affect row a second time")
+            if deduplicador is not None and deduplicador.duplicado(row[0], row[1], row[2]):
+                duplicados += 1
+                continue
+            if coletor is not None:
+                coletor.adicionar(row)
+            if agregador is not None:
+                agregador.adicionar(row)
+            lote.append(row)
+            if len(lote) >= limite_lote:
+                enviar(lote)
+                lote = []
+                lotes += 1
+                if lotes % 5 == 0:
+                    print(f"      📊 Enviados: {destino.registros:,} | Descartados: {descartados:,} | Duplicados: {duplicados:,}")
+        if lote:
+            enviar(lote)
+        if spool is not None:
+            spool.finalizar_gravacao({"lidos": lidos, "registros": destino.registros, "descartados": descartados,
+                                      "duplicados": duplicados, "tamanho_mb": tamanho_mb})
+        stats = destino.concluir()
+        if coletor is not None:
+            coletor.fechar()
+    except BaseException:
+        destino.abortar()
+        raise
+
+    if deduplicador is not None:
+        deduplicador.finalizar_arquivo()
+        orcamento.registrar("dedup", deduplicador.memoria_bytes())
+
+    tempo = max(int(time.time() - inicio), 1)
+    print(f"      ✅ {destino.registros:,} registros | 🗑️ {descartados:,} descartados | ♻️ {duplicados:,} duplicados")
+    print(f"      ⏱️  {tempo//60}min {tempo%60}s | ⚡ {lidos/tempo:.0f} linhas/segundo")
+    if orcamento.limite is not None and custo_linha is not None:
+        picos = " | ".join(f"{e} {v}MB" for e, v in orcamento.relatorio()["pico_mb"].items())
+        print(f"      🧠 Teto {orcamento.limite_mb:.0f}MB: lotes de {limite_lote:,} linhas (~{custo_linha:.0f}B/linha) | pico {picos}")
+
+    resultado = {
+        "arquivo": arquivo_num,
+        "lidos": lidos,
+        "registros": destino.registros,
+        "descartados": descartados,
+        "duplicados": duplicados,
+        **stats,
+        "tempo": tempo,
+        "tamanho_mb": round(tamanho_mb, 2),
+    }
+    if agregador is not None:
+        resultado["agregados"] = agregador.exportar()   # importar tira do resumo depois de juntar
+    if orcamento.limite is not None:
+        resultado["memoria"] = orcamento.relatorio()
+    if perfil is not None:
+        resultado["perfil_memoria"] = perfil.relatorio()
+    return resultado
+
+
+def _retomar_spool(spool, opcoes, mes_ano, arquivo_num, inicio):
+    """Drena os segmentos que sobraram de uma execução interrompida e faz o merge"""
+    leitura = spool.manifesto["leitura"]
+    print(f"      ♻️  Retomando do spool: {len(spool.segmentos())} segmentos pendentes "
+          f"(leitura de {leitura['lidos']:,} linhas já feita)")
+    destino = abrir_destino(opcoes, mes_ano, arquivo_num, spool, retomar=True)
+    try:
+        stats = destino.concluir()
+    except BaseException:
+        destino.abortar()
+        raise
+
+    tempo = max(int(time.time() - inicio), 1)
+    print(f"      ✅ {leitura['registros']:,} registros (retomado) | ⏱️  {tempo//60}min {tempo%60}s")
+    return {
+        "arquivo": arquivo_num,
+        "lidos": leitura["lidos"],
+        "registros": leitura["registros"],
+        "descartados": leitura["descartados"],
+        "duplicados": leitura["duplicados"],
+        **stats,
+        "tempo": tempo,
+        "tamanho_mb": round(leitura["tamanho_mb"], 2),
+        "retomado": True,
+    }
+
+
+def importar(mes_ano, arquivos, estrategia="upsert", destino="postgres", cnaes=None,
+             apenas_principal=False, workers=1, csv_local=None, cache_colunar=None,
+             deduplicar=True, indice_dir=None, registrar_mudancas=False, spool_dir=None,
+             spool_limite_mb=None, alvos_governador=None, juncao_dir=None, reconciliar=False,
+             servidor_dir=None, servidor_dir_banco=None, servidor_unzip=False, memoria_mb=None,
+             perfil_memoria=None, publicar_snapshot=True, substituir_snapshot=False, ao_concluir=None):
+    """
+    Importa os arquivos na ordem dada (a ordem é a prioridade no pool).
+    ao_concluir(arquivo_num, resultado, erro) é chamado a cada arquivo.
+    publicar_snapshot=False deixa o snapshot pronto para 'snapshot publicar' depois.
+    substituir_snapshot=True apaga um snapshot pronto/revertido do mês em vez de recusar.
+    """
+    opcoes = montar_opcoes(estrategia, destino, cnaes, apenas_principal, workers,
+                           csv_local, cache_colunar, deduplicar, indice_dir, registrar_mudancas,
+                           spool_dir, spool_limite_mb, alvos_governador, juncao_dir, reconciliar,
+                           servidor_dir, servidor_dir_banco, servidor_unzip, memoria_mb, perfil_memoria)
+    no_postgres = destino == "postgres"
+    inicio_total = time.time()
+
+    print("\n" + "="*70)
+    print(f"🚀 RFB ETL - {estrategia.upper()} → {destino}")
+    print("="*70)
+    print(f"📅 Mês/Ano: {mes_ano} | 📦 Arquivos: {list(arquivos)} | 👷 Workers: {workers}")
+    if cnaes:
+        print(f"🎯 Filtro: {len(cnaes)} CNAEs ({'principal' if apenas_principal else 'principal OU secundário'})")
+    print(f"⏰ Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("="*70)
+
+    if reconciliar:
+        from . import reconciliacao
+        conn = conectar_db()
+        reconciliacao.conferir_requisitos(conn, estrategia)
+        conn.close()
+
+    if no_postgres and estrategia == "mensal":
+        from . import perfis
+        conn = conectar_db()
+        perfis.preparar_particao(conn, mes_ano)
+        conn.close()
+
+    if no_postgres and estrategia == "snapshot":
+        from . import snapshot
+        conn = conectar_db()
+        try:
+            opcoes["snapshot"] = snapshot.preparar(conn, mes_ano, substituir_snapshot)
+        finally:
+            conn.close()
+
+    if registrar_mudancas:
+        from . import mudancas
+        conn = conectar_db()
+        mudancas.criar_esquema(conn)
+        conn.close()
+
+    if indice_dir:
+        from . import indice
+        indice.preparar(indice_dir, mes_ano)
+
+    # Relógio do banco: o upsert marca updated_at = NOW() das linhas que tocar
+    inicio_banco = None
+    if reconciliar:
+        conn = conectar_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT statement_timestamp()")
+        inicio_banco = cursor.fetchone()[0]
+        conn.close()
+
+    resultados = []
+    erros = {}
+
+    def registrar(arquivo_num, resultado, erro):
+        if erro is None:
+            resultados.append(resultado)
+        else:
+            erros[arquivo_num] = str(erro)[:300]
+            print(f"\n❌ ERRO no arquivo {arquivo_num}: {erro}")
+        if ao_concluir is not None:
+            ao_concluir(arquivo_num, resultado, erro)
+
+    # Em sequência um único deduplicador pega duplicatas entre arquivos;
+    # no pool cada processo deduplica o próprio arquivo
+    deduplicador = None
+    if deduplicar and workers <= 1 and not servidor_dir:
+        from . import memoria
+        orcamento = memoria.obter(memoria_mb, workers)
+        deduplicador = DeduplicadorCNPJ(orcamento.linhas("dedup", CUSTO_PENDENTE, TAMANHO_BUFFER),
+                                        orcamento.cota("dedup"))
+    try:
+        if workers <= 1:
+            for arquivo_num in arquivos:
+                try:
+                    registrar(arquivo_num, processar_arquivo(mes_ano, arquivo_num, opcoes, deduplicador), None)
+                except Exception as e:
+                    import traceback
+                    traceback.print_exc()
+                    registrar(arquivo_num, None, e)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futuros = {pool.submit(processar_arquivo, mes_ano, n, opcoes): n for n in arquivos}
+                for futuro in as_completed(futuros):
+                    try:
+                        registrar(futuros[futuro], futuro.result(), None)
+                    except Exception as e:
+                        registrar(futuros[futuro], None, e)
+    finally:
+        # Em sequência o governador roda neste processo: para a thread de amostragem e a conexão
+        # (no pool cada processo tem o seu, que termina com o processo)
+        if alvos_governador is not None:
+            from . import governador
+            governador.encerrar()
+
+    # Partição só é anexada com o mês inteiro; com falha fica solta e os perfis não mudam
+    if no_postgres and estrategia == "mensal" and resultados and not erros:
+        from . import perfis
+        conn = conectar_db()
+        perfis.anexar_particao(conn, mes_ano)
+        print("\n🎯 Atualizando perfis de CNAE...")
+        perfis.atualizar_perfis(conn)
+        conn.close()
+    elif no_postgres and estrategia == "mensal":
+        print(f"\n⚠️  Partição de {mes_ano} NÃO anexada (arquivos com erro); fica solta até o mês ser recarregado")
+
+    resumo_reconciliacao = None
+    if reconciliar:
+        from . import reconciliacao
+        agregador = reconciliacao.Agregador()
+        for r in resultados:
+            agregador.juntar(r.pop("agregados"))
+        if resultados and not erros:
+            conn = conectar_db()
+            resumo_reconciliacao = reconciliacao.verificar(conn, agregador, estrategia, mes_ano, inicio_banco,
+                                                           opcoes["snapshot"])
+            conn.close()
+        else:
+            print("\n⚠️  Reconciliação NÃO feita (arquivos com erro)")
+
+    # Snapshot só vai para a view com o mês inteiro (e conferido); senão leitores seguem no anterior
+    resumo_snapshot = None
+    if opcoes["snapshot"]:
+        from . import snapshot
+        tabela = opcoes["snapshot"]
+        resumo_snapshot = {"tabela": tabela, "publicado": False}
+        conferido = resumo_reconciliacao is None or resumo_reconciliacao["ok"]
+        if resultados and not erros and conferido:
+            conn = conectar_db()
+            resumo_snapshot["linhas"] = snapshot.finalizar(conn, tabela)
+            if publicar_snapshot:
+                snapshot.publicar(conn, tabela)
+                resumo_snapshot["publicado"] = True
+            conn.close()
+        else:
+            print(f"\n⚠️  Snapshot {tabela} NÃO publicado (arquivos com erro ou divergência); "
+                  f"{snapshot.VISAO} continua no anterior")
+
+    # Índice só é publicado com o mês inteiro; com falha o anterior continua valendo
+    resumo_indice = None
+    if indice_dir and resultados and not erros:
+        from . import indice
+        resumo_indice = indice.construir(indice_dir, mes_ano)
+    elif indice_dir:
+        print("\n⚠️  Índice local NÃO reconstruído (arquivos com erro); versão anterior mantida")
+
+    tempo_total = max(int(time.time() - inicio_total), 1)
+    total_registros = sum(r["registros"] for r in resultados)
+    total_lidos = sum(r["lidos"] for r in resultados)
+
+    print("\n\n" + "="*70)
+    print("🎉 PROCESSO COMPLETO FINALIZADO!")
+    print("="*70)
+    print(f"📦 Arquivos processados: {len(resultados)}/{len(arquivos)}")
+    print(f"📊 Total de registros: {total_registros:,} (de {total_lidos:,} linhas lidas)")
+    print(f"⏱️  Tempo total: {tempo_total//60}min {tempo_total%60}s")
+    print(f"⚡ Performance média: {total_lidos/tempo_total:.0f} linhas/segundo")
+    print("="*70)
+
+    print("\n📋 DETALHAMENTO POR ARQUIVO:")
+    print("-"*70)
+    for r in sorted(resultados, key=lambda r: r["arquivo"]):
+        print(f"  Arquivo {r['arquivo']}: {r['registros']:,} registros | {r['descartados']:,} descartados | "
+              f"{r['duplicados']:,} duplicados | {r['tempo']//60}min {r['tempo']%60}s | {r['tamanho_mb']}MB")
+    print("="*70)
+
+    resumo = {
+        "status": "success" if not erros else "partial",
+        "mes_ano": mes_ano,
+        "estrategia": estrategia,
+        "destino": destino,
+        "total_arquivos": len(resultados),
+        "total_registros": total_registros,
+        "total_lidos": total_lidos,
+        "tempo_total_segundos": tempo_total,
+        "resultados": sorted(resultados, key=lambda r: r["arquivo"]),
+        "erros": erros,
+    }
+    if resumo_indice is not None:
+        resumo["indice"] = resumo_indice
+    if resumo_snapshot is not None:
+        resumo["snapshot"] = resumo_snapshot
+    if resumo_reconciliacao is not None:
+        resumo["reconciliacao"] = resumo_reconciliacao
+        if not resumo_reconciliacao["ok"]:
+            resumo["status"] = "mismatch"
+    if registrar_mudancas:
+        resumo["mudancas"] = sum(r.get("mudancas", 0) for r in resultados)
+        print(f"\n🔔 Feed de mudanças: {resumo['mudancas']:,} CNPJs novos/alterados em estabelecimentos_mudancas")
+    if deduplicador is not None:
+        resumo["deduplicacao"] = deduplicador.relatorio()
+        deduplicador.fechar()
+        dedup = resumo["deduplicacao"]
+        disco = f" + {dedup['disco_mb']}MB no disco" if dedup["disco_mb"] else ""
+        print(f"\n♻️  DEDUPLICAÇÃO: {dedup['duplicados']:,} duplicados | {dedup['invalidos']:,} chaves inválidas | {dedup['memoria_mb']}MB{disco}")
+        for arquivo, d in dedup["por_arquivo"].items():
+            if d["mesmo_arquivo"] or d["outros_arquivos"]:
+                print(f"  Arquivo {arquivo}: {d['mesmo_arquivo']:,} no mesmo arquivo | {d['outros_arquivos']:,} de arquivos anteriores")
+    return resumo
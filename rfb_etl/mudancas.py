@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+RFB MUDANCAS - Feed de mudanças gerado no próprio UPSERT (sem diff da tabela inteira)
+- importar --mudancas: o merge staging → estabelecimentos vira um único comando
+  * CTE "antes" lê as colunas monitoradas das linhas que a staging vai tocar
+  * UPSERT ... RETURNING devolve os valores novos
+  * só entra no feed quem é novo ou mudou alguma coluna monitorada (IS DISTINCT FROM)
+- estabelecimentos_mudancas: cnpj, tipo (novo/alterado), colunas alteradas,
+  antes/depois em jsonb, mes_ano e arquivo da carga
+- exportar: JSON lines em ordem de id (o consumidor guarda o último id lido)
+- merges com feed são serializados por um advisory xact lock (workers em paralelo ou outras
+  máquinas): ids só são gerados depois do commit anterior, então id > último nunca pula
+  uma mudança confirmada mais tarde
+
+Uso:
+  rfb-etl importar --mes 2024-01 --mudancas
+  rfb-etl mudancas exportar --mes 2024-01 [--desde-id N] [--saida mudancas.jsonl]
+  rfb-etl mudancas resumo [--mes 2024-01]
+"""
+import json, sys
+
+from psycopg2 import sql
+
+from .comum import COLUNAS_ESTABELECIMENTOS, sql_upsert_estabelecimentos
+
+TRAVA_FEED = (0x52464232, 0)   # 'RFB2': advisory lock dos merges com feed
+
+# situação, atividade e endereço
+COLUNAS_MONITORADAS = (
+    "situacao_cadastral", "data_situacao_cadastral", "motivo_situacao_cadastral",
+    "cnae_fiscal_principal", "cnae_fiscal_secundaria",
+    "tipo_logradouro", "logradouro", "numero", "complemento", "bairro", "cep", "uf", "municipio",
+)
+
+SQL_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS estabelecimentos_mudancas (
+  id bigserial PRIMARY KEY,
+  mes_ano text NOT NULL,
+  arquivo int,
+  cnpj text NOT NULL,
+  tipo text NOT NULL,
+  colunas text[] NOT NULL,
+  antes jsonb,
+  depois jsonb NOT NULL,
+  registrado_em timestamptz NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS estabelecimentos_mudancas_mes_idx ON estabelecimentos_mudancas (mes_ano, id);
+"""
+
+
+def criar_esquema(conn):
+    cursor = conn.cursor()
+    cursor.execute(SQL_ESQUEMA)
+    conn.commit()
+    cursor.close()
+
+
+def travar_feed(cursor):
+    """Espera os outros merges com feed; solta no commit/rollback desta transação"""
+    cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", TRAVA_FEED)
+
+
+def sql_upsert_com_mudancas(origem, mes_ano, arquivo, colunas=COLUNAS_MONITORADAS):
+    """
+    UPSERT de origem (staging) em estabelecimentos gravando o feed no mesmo comando.
+    Todas as CTEs enxergam o mesmo snapshot, então "antes" tem os valores pré-UPSERT.
+    Retorna uma linha: (linhas afetadas pelo UPSERT, mudanças registradas)
+    """
+    if not colunas or not set(colunas) <= set(COLUNAS_ESTABELECIMENTOS):
+        raise ValueError(f"Colunas monitoradas inválidas: {colunas!r}")
+    ids = [sql.Identifier(c) for c in colunas]
+
+    def pares(alias):
+        return sql.SQL(', ').join(
+            sql.SQL("{}, {}.{}").format(sql.Literal(c), sql.Identifier(alias), i)
+            for c, i in zip(colunas, ids))
+
+    def tupla(alias):
+        return sql.SQL(', ').join(sql.SQL("{}.{}").format(sql.Identifier(alias), i) for i in ids)
+
+    alteradas = sql.SQL(', ').join(
+        sql.SQL("CASE WHEN a.{0} IS DISTINCT FROM u.{0} THEN {1} END").format(i, sql.Literal(c))
+        for c, i in zip(colunas, ids))
+    select = sql.SQL("SELECT {} FROM {}").format(
+        sql.SQL(', ').join(map(sql.Identifier, COLUNAS_ESTABELECIMENTOS)), origem)
+
+    return sql.SQL("""
+        WITH antes AS (
+          SELECT cnpj_completo, {monitoradas} FROM estabelecimentos
+          WHERE cnpj_completo IN (SELECT cnpj_basico || cnpj_ordem || cnpj_dv FROM {origem})
+        ),
+        upsert AS (
+          {upsert} RETURNING cnpj_completo, {monitoradas}
+        ),
+        mudancas AS (
+          INSERT INTO estabelecimentos_mudancas (mes_ano, arquivo, cnpj, tipo, colunas, antes, depois)
+          SELECT {mes_ano}, {arquivo}, u.cnpj_completo,
+                 CASE WHEN a.cnpj_completo IS NULL THEN 'novo' ELSE 'alterado' END,
+                 CASE WHEN a.cnpj_completo IS NULL THEN '{{}}'::text[]
+                      ELSE array_remove(ARRAY[{alteradas}]::text[], NULL) END,
+                 CASE WHEN a.cnpj_completo IS NOT NULL THEN jsonb_build_object({pares_antes}) END,
+                 jsonb_build_object({pares_depois})
+          FROM upsert u LEFT JOIN antes a USING (cnpj_completo)
+          WHERE a.cnpj_completo IS NULL OR ({tupla_antes}) IS DISTINCT FROM ({tupla_depois})
+          RETURNING 1
+        )
+        SELECT (SELECT count(*) FROM upsert), (SELECT count(*) FROM mudancas)
+    """).format(
+        monitoradas=sql.SQL(', ').join(ids), origem=origem,
+        upsert=sql_upsert_estabelecimentos(select),
+        mes_ano=sql.Literal(mes_ano), arquivo=sql.Literal(arquivo), alteradas=alteradas,
+        pares_antes=pares("a"), pares_depois=pares("u"),
+        tupla_antes=tupla("a"), tupla_depois=tupla("u"),
+    )
+
+
+def exportar(conn, mes_ano=None, desde_id=0, saida=None):
+    """Escreve o feed em JSON lines (cursor no servidor: memória constante). Retorna o último id"""
+    destino = open(saida, 'w', encoding='utf-8') if saida else sys.stdout
+    cursor = conn.cursor(name="rfb_mudancas_export")
+    cursor.itersize = 10000
+    cursor.execute("""
+        SELECT id, mes_ano, arquivo, cnpj, tipo, colunas, antes, depois, registrado_em
+        FROM estabelecimentos_mudancas
+        WHERE id > %(desde)s AND (%(mes)s::text IS NULL OR mes_ano = %(mes)s)
+        ORDER BY id
+    """, {"desde": desde_id, "mes": mes_ano})
+    ultimo, total = desde_id, 0
+    try:
+        for id_, mes, arquivo, cnpj, tipo, colunas, antes, depois, registrado_em in cursor:
+            destino.write(json.dumps({
+                "id": id_, "mes_ano": mes, "arquivo": arquivo, "cnpj": cnpj, "tipo": tipo,
+                "colunas": colunas, "antes": antes, "depois": depois,
+                "registrado_em": registrado_em.isoformat(),
+            }, ensure_ascii=False) + "\n")
+            ultimo, total = id_, total + 1
+    finally:
+        cursor.close()
+        conn.commit()
+        if saida:
+            destino.close()
+    print(f"📤 {total:,} mudanças exportadas | último id: {ultimo}", file=sys.stderr)
+    return ultimo
+
+
+def resumo(conn, mes_ano=None):
+    """Quantas mudanças por carga, tipo e coluna alterada"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT mes_ano, tipo, count(*), min(id), max(id) FROM estabelecimentos_mudancas
+        WHERE %(mes)s::text IS NULL OR mes_ano = %(mes)s
+        GROUP BY mes_ano, tipo ORDER BY mes_ano DESC, tipo
+    """, {"mes": mes_ano})
+    for mes, tipo, total, minimo, maximo in cursor.fetchall():
+        print(f"📅 {mes} | {tipo:<9} | {total:,} (ids {minimo}..{maximo})")
+    cursor.execute("""
+        SELECT coluna, count(*) FROM estabelecimentos_mudancas, unnest(colunas) AS coluna
+        WHERE %(mes)s::text IS NULL OR mes_ano = %(mes)s
+        GROUP BY coluna ORDER BY count(*) DESC
+    """, {"mes": mes_ano})
+    for coluna, total in cursor.fetchall():
+        print(f"  {coluna}: {total:,}")
+    cursor.close()
+    conn.commit()
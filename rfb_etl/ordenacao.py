@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+RFB ORDENACAO - Ordenação externa por distribuição (memória limitada)
+- adicionar(chave, registro) espalha em N partições por faixa de chave
+- buffers descarregados em disco quando passam do limite: cada descarga grava,
+  por partição, uma sequência já ordenada (run) em blocos de BLOCO_RUN itens (marshal)
+- cada processo/arquivo grava com seu prefixo; a leitura junta todos
+- ler_ordenado: partição por partição, heapq.merge dos runs lendo um bloco de cada por vez
+  => ordem global com memória ~ runs × BLOCO_RUN (nunca a partição inteira)
+- runs demais para a cota "particoes": junta grupos em runs maiores no disco antes (várias passadas)
+"""
+import glob, heapq, marshal, os, struct
+from operator import itemgetter
+
+from . import memoria
+
+LIMITE_BUFFER = 200_000   # registros em memória antes de descarregar
+BLOCO_RUN = 256           # itens por bloco de um run (unidade de leitura do merge)
+FAN_IN = 128              # runs abertos ao mesmo tempo no merge (sem teto de memória)
+_TAMANHO = struct.Struct("<I")
+_chave = itemgetter(0)
+
+
+def _gravar_run(f, itens):
+    """Run = blocos [tamanho][marshal] terminados por tamanho 0"""
+    bloco = []
+    for item in itens:
+        bloco.append(item)
+        if len(bloco) >= BLOCO_RUN:
+            dados = marshal.dumps(bloco)
+            f.write(_TAMANHO.pack(len(dados)) + dados)
+            bloco = []
+    if bloco:
+        dados = marshal.dumps(bloco)
+        f.write(_TAMANHO.pack(len(dados)) + dados)
+    f.write(_TAMANHO.pack(0))
+
+
+class ParticionadorExterno:
+    """Grava (chave, registro) em <diretorio>/<particao>-<prefixo>.bin"""
+
+    def __init__(self, diretorio, particao_de, prefixo="0", limite_buffer=LIMITE_BUFFER):
+        os.makedirs(diretorio, exist_ok=True)
+        self.diretorio = diretorio
+        self.particao_de = particao_de
+        self.prefixo = prefixo
+        self.limite_buffer = limite_buffer
+        self.registros = 0
+        self._buffers = {}
+        self._pendentes = 0
+
+    def adicionar(self, chave, registro):
+        self._buffers.setdefault(self.particao_de(chave), []).append((chave, registro))
+        self._pendentes += 1
+        self.registros += 1
+        if self._pendentes >= self.limite_buffer:
+            self.descarregar()
+
+    def descarregar(self):
+        for particao, itens in self._buffers.items():
+            itens.sort(key=_chave)   # estável: empates ficam na ordem de chegada
+            caminho = os.path.join(self.diretorio, f"{particao:05d}-{self.prefixo}.bin")
+            with open(caminho, 'ab') as f:
+                _gravar_run(f, itens)
+        self._buffers = {}
+        self._pendentes = 0
+
+    def fechar(self):
+        self.descarregar()
+
+
+def _inicios_runs(caminho):
+    """Posições de início de cada run do arquivo (pula os blocos sem ler o conteúdo)"""
+    inicios = []
+    with open(caminho, 'rb') as f:
+        tamanho_arquivo = os.fstat(f.fileno()).st_size
+        posicao = 0
+        while posicao < tamanho_arquivo:
+            inicios.append(posicao)
+            while True:
+                f.seek(posicao)
+                tamanho, = _TAMANHO.unpack(f.read(_TAMANHO.size))
+                posicao += _TAMANHO.size + tamanho
+                if not tamanho:
+                    break
+    return inicios
+
+
+def _ler_run(f, posicao):
+    """Itens de um run, um bloco por vez (vários runs dividem o mesmo arquivo aberto)"""
+    while True:
+        f.seek(posicao)
+        tamanho, = _TAMANHO.unpack(f.read(_TAMANHO.size))
+        if not tamanho:
+            return
+        bloco = marshal.loads(f.read(tamanho))
+        posicao = f.tell()
+        yield from bloco
+
+
+def _abrir_runs(runs, abertos):
+    iteradores = []
+    for caminho, posicao in runs:
+        if caminho not in abertos:
+            abertos[caminho] = open(caminho, 'rb')
+        iteradores.append(_ler_run(abertos[caminho], posicao))
+    return iteradores
+
+
+def _fechar(abertos):
+    for f in abertos.values():
+        f.close()
+    abertos.clear()
+
+
+def ler_ordenado(diretorio, total_particoes, custo_item=memoria.CUSTO_LINHA):
+    """Gera (chave, registro) em ordem de chave, juntando os arquivos de todos os prefixos"""
+    orcamento = memoria.atual()
+    fan_in = max(orcamento.linhas("particoes", custo_item * BLOCO_RUN, FAN_IN), 2)
+    for particao in range(total_particoes):
+        runs = [(caminho, inicio)
+                for caminho in sorted(glob.glob(os.path.join(diretorio, f"{particao:05d}-*.bin")))
+                for inicio in _inicios_runs(caminho)]
+        intermediarios = []
+        abertos = {}
+        try:
+            # Passadas intermediárias: os primeiros fan_in runs viram um só (mantém os empates em ordem)
+            while len(runs) > fan_in:
+                caminho = os.path.join(diretorio, f"{particao:05d}-{len(intermediarios)}.run")
+                with open(caminho, 'wb') as f:
+                    _gravar_run(f, heapq.merge(*_abrir_runs(runs[:fan_in], abertos), key=_chave))
+                _fechar(abertos)
+                intermediarios.append(caminho)
+                runs = [(caminho, 0)] + runs[fan_in:]
+            orcamento.registrar("particoes", len(runs) * BLOCO_RUN * custo_item)
+            yield from heapq.merge(*_abrir_runs(runs, abertos), key=_chave)
+        finally:
+            _fechar(abertos)
+            for caminho in intermediarios:
+                os.remove(caminho)
+
+
+def limpar(diretorio):
+    for caminho in glob.glob(os.path.join(diretorio, "*.bin")) + glob.glob(os.path.join(diretorio, "*.run")):
+        os.remove(caminho)
+    if os.path.isdir(diretorio):
+        os.rmdir(diretorio)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+RFB PERFIS CNAE - Carga mensal SEM FILTRO + filtros de CNAE no servidor
+- estratégia "mensal" do motor: COPY de TODOS os arquivos em estabelecimentos_mensal
+  * partição por mes_ano, índices criados DEPOIS da carga
+  * cnaes_secundarios text[] (coluna gerada) com índice GIN
+- perfil: cria/atualiza um perfil de CNAEs e materializa em segundos
+  * view | materializada | estabelecimentos (UPSERT das 30 colunas)
+  * filtro: CNAE principal OU secundário (ou só principal)
+- atualizar: rematerializa todos os perfis após uma nova carga
+
+Uso:
+  rfb-etl importar --estrategia mensal --mes 2024-01
+  rfb-etl perfis perfil NOME 4744099,4744005 [--destino view|materializada|estabelecimentos] [--apenas-principal]
+  rfb-etl perfis atualizar
+  rfb-etl perfis listar
+"""
+import re, time
+
+from .comum import CNAES_PERMITIDOS, COLUNAS_ESTABELECIMENTOS, sql_upsert_estabelecimentos
+
+from psycopg2 import sql
+
+TABELA_MENSAL = "estabelecimentos_mensal"
+DESTINOS = ("view", "materializada", "estabelecimentos")
+
+SQL_ESQUEMA = f"""
+CREATE TABLE IF NOT EXISTS {TABELA_MENSAL} (
+  mes_ano text NOT NULL,
+  {', '.join(f'{c} text' for c in COLUNAS_ESTABELECIMENTOS)},
+  cnaes_secundarios text[] GENERATED ALWAYS AS
+    (string_to_array(NULLIF(cnae_fiscal_secundaria, ''), ',')) STORED
+) PARTITION BY LIST (mes_ano);
+
+CREATE INDEX IF NOT EXISTS {TABELA_MENSAL}_cnae_principal_idx
+  ON {TABELA_MENSAL} (cnae_fiscal_principal);
+CREATE INDEX IF NOT EXISTS {TABELA_MENSAL}_cnaes_secundarios_idx
+  ON {TABELA_MENSAL} USING gin (cnaes_secundarios);
+
+CREATE TABLE IF NOT EXISTS perfis_cnae (
+  nome text PRIMARY KEY,
+  cnaes text[] NOT NULL,
+  apenas_principal boolean NOT NULL DEFAULT false,
+  destino text NOT NULL DEFAULT 'view',
+  atualizado_em timestamptz NOT NULL DEFAULT NOW()
+);
+"""
+
+
+def criar_esquema(conn):
+    """Cria a tabela mensal particionada e o cadastro de perfis (idempotente)"""
+    cursor = conn.cursor()
+    cursor.execute(SQL_ESQUEMA)
+    # Perfil padrão = filtro histórico do import_rfb_filtrado_v2.py
+    cursor.execute(
+        "INSERT INTO perfis_cnae (nome, cnaes) VALUES (%s, %s) ON CONFLICT (nome) DO NOTHING",
+        ("materiais_construcao", sorted(CNAES_PERMITIDOS)),
+    )
+    conn.commit()
+    cursor.close()
+
+
+def nome_particao(mes_ano):
+    return f"{TABELA_MENSAL}_{mes_ano.replace('-', '_')}"
+
+
+def preparar_particao(conn, mes_ano):
+    """Recria a tabela solta do mês (sem índices => COPY rápido); vira partição só no final"""
+    criar_esquema(conn)
+    particao = sql.Identifier(nome_particao(mes_ano))
+    cursor = conn.cursor()
+    print(f"\n🧱 Preparando {nome_particao(mes_ano)}...")
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(particao))
+    cursor.execute(sql.SQL(
+        "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING GENERATED)"
+    ).format(particao, sql.Identifier(TABELA_MENSAL)))
+    cursor.execute(sql.SQL("ALTER TABLE {} ALTER COLUMN mes_ano SET DEFAULT {}").format(
+        particao, sql.Literal(mes_ano)))
+    conn.commit()
+    cursor.close()
+
+
+def anexar_particao(conn, mes_ano):
+    """Índices em bulk depois da carga + CHECK para o ATTACH não varrer a tabela"""
+    particao = sql.Identifier(nome_particao(mes_ano))
+    cursor = conn.cursor()
+    print("\n🔎 Criando índices (btree + GIN) e anexando partição...")
+    cursor.execute(sql.SQL("CREATE INDEX ON {} (cnae_fiscal_principal)").format(particao))
+    cursor.execute(sql.SQL("CREATE INDEX ON {} USING gin (cnaes_secundarios)").format(particao))
+    cursor.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} CHECK (mes_ano = {})").format(
+        particao, sql.Identifier(f"{nome_particao(mes_ano)}_mes_chk"), sql.Literal(mes_ano)))
+    cursor.execute(sql.SQL("ANALYZE {}").format(particao))
+    cursor.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES IN ({})").format(
+        sql.Identifier(TABELA_MENSAL), particao, sql.Literal(mes_ano)))
+    conn.commit()
+    cursor.close()
+
+
+def _nome_perfil(nome):
+    if not re.fullmatch(r"[a-z0-9_]+", nome):
+        raise ValueError(f"Nome de perfil inválido: {nome!r} (use a-z, 0-9 e _)")
+    return nome
+
+
+def _filtro_cnae(cnaes, apenas_principal):
+    """WHERE do perfil: principal = ANY(...) [OR secundários && ...] (usa o índice GIN)"""
+    lista = sql.Literal(list(cnaes))
+    filtro = sql.SQL("cnae_fiscal_principal = ANY({}::text[])").format(lista)
+    if not apenas_principal:
+        filtro = sql.SQL("({} OR cnaes_secundarios && {}::text[])").format(filtro, lista)
+    return filtro
+
+
+def _select_perfil(cnaes, apenas_principal):
+    """Linhas do mês mais recente carregado que batem com o perfil"""
+    return sql.SQL(
+        "SELECT {colunas} FROM {mensal} "
+        "WHERE mes_ano = (SELECT max(mes_ano) FROM {mensal}) AND {filtro}"
+    ).format(
+        colunas=sql.SQL(', ').join(map(sql.Identifier, COLUNAS_ESTABELECIMENTOS)),
+        mensal=sql.Identifier(TABELA_MENSAL),
+        filtro=_filtro_cnae(cnaes, apenas_principal),
+    )
+
+
+def materializar_perfil(conn, nome, cnaes, destino="view", apenas_principal=False):
+    """Grava o perfil e materializa no destino escolhido. Retorna linhas afetadas (ou None p/ view)"""
+    nome = _nome_perfil(nome)
+    if destino not in DESTINOS:
+        raise ValueError(f"Destino inválido: {destino!r} (use {', '.join(DESTINOS)})")
+
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO perfis_cnae (nome, cnaes, apenas_principal, destino)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (nome) DO UPDATE SET
+          cnaes = EXCLUDED.cnaes,
+          apenas_principal = EXCLUDED.apenas_principal,
+          destino = EXCLUDED.destino,
+          atualizado_em = NOW()
+    """, (nome, sorted(cnaes), apenas_principal, destino))
+
+    select = _select_perfil(cnaes, apenas_principal)
+    objeto = sql.Identifier(f"estabelecimentos_perfil_{nome}")
+    afetados = None
+
+    # DROP [MATERIALIZED] VIEW IF EXISTS falha se o objeto for do outro tipo
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+                   (f"estabelecimentos_perfil_{nome}",))
+    existente = cursor.fetchone()
+    if existente and existente[0] == "m":
+        cursor.execute(sql.SQL("DROP MATERIALIZED VIEW {}").format(objeto))
+    elif existente and existente[0] == "v" and destino != "view":
+        cursor.execute(sql.SQL("DROP VIEW {}").format(objeto))
+
+    if destino == "view":
+        cursor.execute(sql.SQL("CREATE OR REPLACE VIEW {} AS {}").format(objeto, select))
+    elif destino == "materializada":
+        cursor.execute(sql.SQL("CREATE MATERIALIZED VIEW {} AS {}").format(objeto, select))
+        afetados = cursor.rowcount
+        cursor.execute(sql.SQL("CREATE INDEX ON {} (cnpj_basico, cnpj_ordem, cnpj_dv)").format(objeto))
+    else:
+        cursor.execute(sql_upsert_estabelecimentos(select))
+        afetados = cursor.rowcount
+
+    conn.commit()
+    cursor.close()
+    return afetados
+
+
+def atualizar_perfis(conn):
+    """Rematerializa todos os perfis cadastrados (ex.: depois de carregar um mês novo)"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT nome, cnaes, destino, apenas_principal FROM perfis_cnae ORDER BY nome")
+    perfis = cursor.fetchall()
+    cursor.close()
+
+    resultados = {}
+    for nome, cnaes, destino, apenas_principal in perfis:
+        inicio = time.time()
+        afetados = materializar_perfil(conn, nome, cnaes, destino, apenas_principal)
+        resultados[nome] = afetados
+        linhas = "-" if afetados is None else f"{afetados:,}"
+        print(f"  ✅ {nome} ({destino}): {linhas} linhas | {time.time() - inicio:.1f}s")
+    return resultados
+
+
+def listar_perfis(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT nome, destino, apenas_principal, array_length(cnaes, 1), atualizado_em "
+                   "FROM perfis_cnae ORDER BY nome")
+    for nome, destino, apenas_principal, qtd, atualizado_em in cursor.fetchall():
+        filtro = "principal" if apenas_principal else "principal OU secundário"
+        print(f"  🎯 {nome}: {qtd} CNAEs | {filtro} | {destino} | {atualizado_em:%Y-%m-%d %H:%M}")
+    cursor.close()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+RFB RECONCILIACAO - Confere a carga contra o banco sem diff da tabela inteira
+- durante a leitura: hash de 64 bits de cada linha enviada (md5 dos 30 campos)
+  e agregados que não dependem da ordem: contagem, XOR e soma mod 2^64
+  * por faixa de cnpj_basico (5 primeiros dígitos) e por uf
+- no final: UMA consulta agregada no servidor, GROUP BY (faixa, uf) com agregação parcial
+  nos workers paralelos; totais por faixa e por uf somados aqui (GROUPING SETS não paraleliza
+  a agregação, só a leitura). bit_xor => PostgreSQL 14+
+  sobre o que a carga tocou:
+  * upsert: linhas de estabelecimentos com updated_at >= início da carga. Exige updated_at
+    com DEFAULT now() (o INSERT não preenche), dedup entre arquivos (em sequência, sem
+    --sem-dedup) e nenhuma outra carga no intervalo: linhas de outra carga contam "a mais no banco"
+  * mensal: a partição do mês
+  * snapshot: a tabela do mês (antes da limpeza de duplicatas entre arquivos)
+- faixa de 3 dígitos divergente => desce para 5 dígitos só nessas faixas
+- hash idêntico nos dois lados: md5(campos unidos por \\x1f), 8 primeiros bytes como bigint
+
+Uso:
+  rfb-etl importar --mes 2024-01 --reconciliar
+"""
+import hashlib
+
+from psycopg2 import sql
+
+from .comum import COLUNAS_ESTABELECIMENTOS
+
+SEPARADOR = "\x1f"
+MODULO = 1 << 64
+PARALELISMO = 4
+VERSAO_MINIMA = 140000   # bit_xor
+DIGITOS_FAIXA = 3
+DIGITOS_DETALHE = 5
+POSICAO_UF = COLUNAS_ESTABELECIMENTOS.index("uf")
+
+
+def hash_linha(row):
+    return int.from_bytes(hashlib.md5(SEPARADOR.join(row).encode('utf-8')).digest()[:8], 'big', signed=True)
+
+
+def _somar(destino, chave, agregado):
+    atual = destino.setdefault(chave, [0, 0, 0])
+    atual[0] += agregado[0]
+    atual[1] ^= agregado[1]
+    atual[2] += agregado[2]
+
+
+class Agregador:
+    """Contagem/XOR/soma por faixa de 5 dígitos e por uf (um por arquivo, depois juntados)"""
+
+    def __init__(self):
+        self.faixas = {}
+        self.ufs = {}
+
+    def adicionar(self, row):
+        h = hash_linha(row)
+        for tabela, chave in ((self.faixas, row[0][:DIGITOS_DETALHE]), (self.ufs, row[POSICAO_UF])):
+            agregado = tabela.get(chave)
+            if agregado is None:
+                tabela[chave] = [1, h, h]
+            else:
+                agregado[0] += 1
+                agregado[1] ^= h
+                agregado[2] += h
+
+    def exportar(self):
+        return {"faixas": self.faixas, "ufs": self.ufs}
+
+    def juntar(self, exportado):
+        for nome in ("faixas", "ufs"):
+            tabela = getattr(self, nome)
+            for chave, agregado in exportado[nome].items():
+                _somar(tabela, chave, agregado)
+
+    def por_faixa(self, digitos):
+        resultado = {}
+        for chave, agregado in self.faixas.items():
+            _somar(resultado, chave[:digitos], agregado)
+        return resultado
+
+
+def conferir_requisitos(conn, estrategia):
+    """Antes da carga: falha cedo se o banco não consegue conferir (em vez de divergir no final)"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT current_setting('server_version_num')::int")
+    versao = cursor.fetchone()[0]
+    if versao < VERSAO_MINIMA:
+        raise RuntimeError(f"Reconciliação usa bit_xor (PostgreSQL 14+); servidor na versão {versao}")
+    if estrategia == "upsert":
+        cursor.execute("""
+            SELECT column_default FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'estabelecimentos'
+              AND column_name = 'updated_at'
+        """)
+        linha = cursor.fetchone()
+        if linha is None or linha[0] is None:
+            raise RuntimeError("Reconciliação do upsert exige estabelecimentos.updated_at com DEFAULT now()")
+    conn.commit()
+    cursor.close()
+
+
+def _origem(estrategia, mes_ano, inicio, tabela=None):
+    """FROM/WHERE com exatamente as linhas que a carga escreveu"""
+    if estrategia == "snapshot":
+        return sql.SQL("FROM {}").format(sql.Identifier(tabela))
+    if estrategia == "mensal":
+        from .perfis import nome_particao
+        return sql.SQL("FROM {}").format(sql.Identifier(nome_particao(mes_ano)))
+    if estrategia == "upsert":
+        return sql.SQL("FROM estabelecimentos WHERE updated_at >= {}").format(sql.Literal(inicio))
+    raise ValueError(f"Reconciliação não disponível para a estratégia {estrategia!r} (use upsert, mensal ou snapshot)")
+
+
+def _hash_sql():
+    campos = sql.SQL(', ').join(map(sql.Identifier, COLUNAS_ESTABELECIMENTOS))
+    return sql.SQL("('x' || substr(md5(concat_ws(E'\\x1f', {})), 1, 16))::bit(64)::bigint").format(campos)
+
+
+def agregados_servidor(cursor, origem, digitos, uf=True, faixas=None):
+    """{faixa: [n, xor, soma]} (e {uf: ...}) calculados no banco em uma consulta"""
+    filtro = sql.SQL("")
+    if faixas is not None:
+        filtro = sql.SQL("WHERE left(faixa, {}) = ANY({})").format(
+            sql.Literal(DIGITOS_FAIXA), sql.Literal(sorted(faixas)))
+    uf_coluna = sql.SQL("uf") if uf else sql.SQL("NULL::text")
+    cursor.execute(sql.SQL("SET LOCAL max_parallel_workers_per_gather = {}").format(sql.Literal(PARALELISMO)))
+    # GROUP BY simples => Partial HashAggregate em cada worker; faixa × uf cabe fácil aqui
+    cursor.execute(sql.SQL("""
+        WITH linhas AS (
+          SELECT left(cnpj_basico, {digitos}) AS faixa, {uf_coluna} AS uf, {hash} AS h {origem}
+        )
+        SELECT faixa, uf, count(*), bit_xor(h), sum(h) FROM linhas {filtro}
+        GROUP BY faixa, uf
+    """).format(digitos=sql.Literal(digitos), hash=_hash_sql(), origem=origem, filtro=filtro,
+                uf_coluna=uf_coluna))
+    por_faixa, por_uf = {}, {}
+    for faixa, uf_valor, total, xor, soma in cursor.fetchall():
+        agregado = [total, xor, int(soma)]
+        _somar(por_faixa, faixa, agregado)
+        if uf:
+            _somar(por_uf, uf_valor, agregado)
+    return por_faixa, por_uf
+
+
+def _divergentes(cliente, servidor):
+    """[(chave, n_cliente, n_banco, motivo)] onde contagem, XOR ou soma mod 2^64 diferem"""
+    resultado = []
+    for chave in sorted(set(cliente) | set(servidor), key=str):
+        c = cliente.get(chave, [0, 0, 0])
+        s = servidor.get(chave, [0, 0, 0])
+        if c[0] == s[0] and c[1] == s[1] and c[2] % MODULO == s[2] % MODULO:
+            continue
+        if c[0] > s[0]:
+            motivo = "faltando no banco"
+        elif c[0] < s[0]:
+            motivo = "a mais no banco"
+        else:
+            motivo = "conteúdo diferente"
+        resultado.append((chave, c[0], s[0], motivo))
+    return resultado
+
+
+def verificar(conn, agregador, estrategia, mes_ano, inicio, tabela=None):
+    """Compara cliente × servidor e imprime as faixas divergentes. Retorna o relatório"""
+    origem = _origem(estrategia, mes_ano, inicio, tabela)
+    cursor = conn.cursor()
+    print("\n🧮 Reconciliando carga × banco (contagem + XOR + soma de hashes)...")
+    faixas_srv, ufs_srv = agregados_servidor(cursor, origem, DIGITOS_FAIXA)
+    faixas = _divergentes(agregador.por_faixa(DIGITOS_FAIXA), faixas_srv)
+    ufs = _divergentes(agregador.ufs, ufs_srv)
+
+    detalhe = []
+    if faixas:
+        detalhe_srv, _ = agregados_servidor(cursor, origem, DIGITOS_DETALHE, uf=False,
+                                            faixas={f for f, *_ in faixas})
+        prefixos = {f for f, *_ in faixas}
+        cliente = {k: v for k, v in agregador.por_faixa(DIGITOS_DETALHE).items()
+                   if k[:DIGITOS_FAIXA] in prefixos}
+        detalhe = _divergentes(cliente, detalhe_srv)
+    conn.commit()
+    cursor.close()
+
+    total_cliente = sum(a[0] for a in agregador.ufs.values())
+    total_banco = sum(a[0] for a in ufs_srv.values())
+    if not faixas and not ufs:
+        print(f"   ✅ Conferido: {total_cliente:,} linhas, {len(faixas_srv)} faixas e {len(ufs_srv)} UFs batem")
+    else:
+        print(f"   ❌ Divergência: {total_cliente:,} linhas enviadas × {total_banco:,} no banco")
+        for uf, n_cliente, n_banco, motivo in ufs[:27]:
+            print(f"      UF {uf or '(vazia)'}: {n_cliente:,} × {n_banco:,} ({motivo})")
+        for faixa, n_cliente, n_banco, motivo in detalhe[:50]:
+            print(f"      cnpj_basico {faixa}{'x' * (8 - DIGITOS_DETALHE)}: {n_cliente:,} × {n_banco:,} ({motivo})")
+        if len(detalhe) > 50:
+            print(f"      ... e mais {len(detalhe) - 50} faixas")
+
+    return {
+        "ok": not faixas and not ufs,
+        "linhas_cliente": total_cliente,
+        "linhas_banco": total_banco,
+        "ufs_divergentes": [u for u, *_ in ufs],
+        "faixas_divergentes": [{"faixa": f, "cliente": c, "banco": b, "motivo": m} for f, c, b, m in detalhe],
+    }
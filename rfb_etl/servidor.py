@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+RFB SERVIDOR - Carga pelo próprio PostgreSQL quando o importador roda ao lado do banco
+- importar --servidor DIR: DIR é um diretório que o processo do banco também enxerga
+  (mesma máquina, volume do pod); o ZIP é baixado direto para lá
+- o banco lê o arquivo sozinho (COPY do lado do servidor, nada passa pelo Python/socket):
+  * --servidor-unzip: COPY ... FROM PROGRAM 'unzip -p arquivo.zip' (exige unzip no host do banco)
+  * padrão: o Python só descompacta o ZIP no DIR (bytes, sem parse) e roda COPY ... FROM 'arquivo.csv'
+- tabela temporária (sem WAL) → filtro CNAE e dedup em SQL → staging/partição → merge de sempre
+  (DestinoPostgres: upsert, direto, mensal, --mudancas e --governador continuam valendo)
+- dedup por arquivo (DISTINCT ON, primeira ocorrência); entre arquivos quem decide é o merge
+- mesmas linhas que o leitor do cliente (comum.ler_linhas):
+  * aspas sobrando nas pontas do campo saem com btrim(campo, '"') (= campo.strip('"'))
+  * linha curta/longa ou aspas soltas num campo sem aspas: o COPY recusa o arquivo inteiro
+    (22P04) e esse arquivo é lido pelo cliente, que completa/corta para 30 campos
+- permissões: pg_read_server_files (arquivo) ou pg_execute_server_program (unzip)
+- --servidor-dir-banco: caminho do DIR visto pelo banco, se for montado em outro lugar
+
+Uso:
+  rfb-etl importar --mes 2024-01 --servidor /dados/rfb [--servidor-unzip] [--servidor-dir-banco /mnt/rfb]
+  rfb-etl servidor benchmark --mes 2024-01 --dir /dados/rfb [--arquivos 0] [--cnaes padrao]
+"""
+import os, shlex, time, zipfile, shutil
+from datetime import datetime
+
+from psycopg2 import errors, sql
+
+from .comum import COLUNAS_ESTABELECIMENTOS, baixar_zip
+
+BRUTO = sql.Identifier("rfb_bruto")
+
+
+def sql_filtro_cnae(cnaes, apenas_principal=False):
+    """Mesmo critério do filtro_cnae do motor: principal OU algum secundário"""
+    if not cnaes:
+        return sql.SQL("TRUE")
+    lista = sql.Literal(sorted(cnaes))
+    principal = sql.SQL("cnae_fiscal_principal = ANY({}::text[])").format(lista)
+    if apenas_principal:
+        return principal
+    return sql.SQL("({} OR string_to_array(replace(cnae_fiscal_secundaria, ' ', ''), ',') && {}::text[])").format(
+        principal, lista)
+
+
+def _descompactar(caminho_zip, caminho_csv):
+    """Extrai o CSV do ZIP (bytes, sem parse) legível pelo usuário do banco. Retorna o nome do membro"""
+    with zipfile.ZipFile(caminho_zip) as zip_file:
+        membro = zip_file.namelist()[0]
+        with zip_file.open(membro) as origem, open(caminho_csv, 'wb') as destino:
+            shutil.copyfileobj(origem, destino, 1024 * 1024)
+    os.chmod(caminho_csv, 0o644)
+    return membro
+
+
+def _caminho_banco(opcoes, caminho):
+    """Traduz um caminho do DIR local para o mesmo arquivo visto pelo banco"""
+    if not opcoes["servidor_banco"]:
+        return caminho
+    relativo = os.path.relpath(caminho, opcoes["servidor"])
+    return os.path.join(opcoes["servidor_banco"], relativo)
+
+
+def preparar_fonte(opcoes, mes_ano, arquivo_nome):
+    """Coloca o arquivo no DIR compartilhado. Retorna (fonte do COPY, tamanho_mb, arquivos a apagar)"""
+    if opcoes["csv_local"]:
+        print(f"      📂 Banco lê o arquivo local: {opcoes['csv_local']}")
+        return sql.SQL("{}").format(sql.Literal(opcoes["csv_local"])), 0, []
+
+    pasta = os.path.join(opcoes["servidor"], mes_ano)
+    os.makedirs(pasta, exist_ok=True)
+    caminho_zip = os.path.join(pasta, arquivo_nome)
+    tamanho_mb = baixar_zip(mes_ano, arquivo_nome, caminho_zip)
+    os.chmod(caminho_zip, 0o644)   # o usuário do banco normalmente não é o nosso
+
+    if opcoes["servidor_unzip"]:
+        programa = f"unzip -p {shlex.quote(_caminho_banco(opcoes, caminho_zip))}"
+        return sql.SQL("PROGRAM {}").format(sql.Literal(programa)), tamanho_mb, [caminho_zip]
+
+    caminho_csv = os.path.join(pasta, f"{arquivo_nome[:-4]}.csv")
+    membro = _descompactar(caminho_zip, caminho_csv)
+    print(f"      ✅ CSV: {membro} → {caminho_csv}")
+    return sql.SQL("{}").format(sql.Literal(_caminho_banco(opcoes, caminho_csv))), tamanho_mb, [caminho_zip, caminho_csv]
+
+
+def processar_arquivo(mes_ano, arquivo_num, opcoes):
+    """Mesmo contrato do motor.processar_arquivo, com leitura/filtro/dedup dentro do banco"""
+    from .motor import abrir_destino
+
+    arquivo_nome = f"Estabelecimentos{arquivo_num}.zip"
+    inicio = time.time()
+    print("\n" + "="*70)
+    print(f"📦 Arquivo: {arquivo_nome} (#{arquivo_num}) → COPY no servidor")
+    print(f"⏰ Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("="*70)
+
+    fonte, tamanho_mb, temporarios = preparar_fonte(opcoes, mes_ano, arquivo_nome)
+    try:
+        destino = abrir_destino(opcoes, mes_ano, arquivo_num)
+        try:
+            lidos, aceitos, stats = _carregar(destino, fonte, opcoes, inicio)
+        except errors.BadCopyFileFormat as e:
+            destino.abortar()
+            print(f"      ⚠️  COPY recusou o arquivo ({str(e).splitlines()[0]}); lendo pelo cliente")
+            return _processar_no_cliente(mes_ano, arquivo_num, opcoes, temporarios, tamanho_mb)
+        except BaseException:
+            destino.abortar()
+            raise
+    finally:
+        for caminho in temporarios:
+            os.remove(caminho)
+
+    descartados, duplicados = lidos - aceitos, aceitos - destino.registros
+    tempo = max(int(time.time() - inicio), 1)
+    print(f"      ✅ {destino.registros:,} registros | 🗑️ {descartados:,} descartados | ♻️ {duplicados:,} duplicados")
+    print(f"      ⏱️  {tempo//60}min {tempo%60}s | ⚡ {lidos/tempo:.0f} linhas/segundo")
+    return {
+        "arquivo": arquivo_num,
+        "lidos": lidos,
+        "registros": destino.registros,
+        "descartados": descartados,
+        "duplicados": duplicados,
+        **stats,
+        "tempo": tempo,
+        "tamanho_mb": round(tamanho_mb, 2),
+        "servidor": True,
+    }
+
+
+def _carregar(destino, fonte, opcoes, inicio):
+    """COPY na temporária + INSERT filtrado/deduplicado no destino. Retorna (lidos, aceitos, stats)"""
+    colunas = sql.SQL(', ').join(map(sql.Identifier, COLUNAS_ESTABELECIMENTOS))
+    filtro = sql_filtro_cnae(opcoes["cnaes"], opcoes["apenas_principal"])
+    cursor = destino.cursor
+    cursor.execute(sql.SQL("""
+        CREATE TEMP TABLE {} (linha bigint GENERATED ALWAYS AS IDENTITY, {}) ON COMMIT DROP
+    """).format(BRUTO, sql.SQL(', ').join(
+        sql.SQL("{} text").format(sql.Identifier(c)) for c in COLUNAS_ESTABELECIMENTOS)))
+    cursor.execute(sql.SQL("""
+        COPY {} ({}) FROM {}
+        WITH (FORMAT csv, DELIMITER ';', QUOTE '"', ENCODING 'LATIN1', FORCE_NOT_NULL ({}))
+    """).format(BRUTO, colunas, fonte, colunas))
+    lidos = cursor.rowcount
+    print(f"      📥 Banco leu {lidos:,} linhas ({time.time() - inicio:.1f}s)")
+
+    # Linhas como o ler_linhas do cliente as entrega: sem aspas sobrando nas pontas
+    limpas = sql.SQL("(SELECT linha, {} FROM {}) limpas").format(sql.SQL(', ').join(
+        sql.SQL("btrim({0}, '\"') AS {0}").format(sql.Identifier(c)) for c in COLUNAS_ESTABELECIMENTOS), BRUTO)
+    cursor.execute(sql.SQL("SELECT count(*) FROM {} WHERE {}").format(limpas, filtro))
+    aceitos = cursor.fetchone()[0]
+    if opcoes["deduplicar"]:
+        # Duplicatas derrubariam o UPSERT ("cannot affect row a second time")
+        selecao = sql.SQL("""
+            SELECT DISTINCT ON (cnpj_basico, cnpj_ordem, cnpj_dv) {colunas} FROM {limpas} WHERE {filtro}
+            ORDER BY cnpj_basico, cnpj_ordem, cnpj_dv, linha
+        """).format(colunas=colunas, limpas=limpas, filtro=filtro)
+    else:
+        selecao = sql.SQL("SELECT {} FROM {} WHERE {}").format(colunas, limpas, filtro)
+    cursor.execute(sql.SQL("INSERT INTO {} ({}) {}").format(destino.tabela, colunas, selecao))
+    destino.registros = cursor.rowcount
+    return lidos, aceitos, destino.concluir()
+
+
+def _processar_no_cliente(mes_ano, arquivo_num, opcoes, temporarios, tamanho_mb):
+    """Arquivo que o COPY recusou: o mesmo arquivo pelo leitor do cliente (linhas com 30 campos)"""
+    from .motor import processar_arquivo as processar_cliente
+
+    caminho_csv = opcoes["csv_local"] or next((c for c in temporarios if c.endswith(".csv")), None)
+    if caminho_csv is None:
+        # --servidor-unzip: só o ZIP está no DIR
+        caminho_zip = temporarios[0]
+        caminho_csv = f"{caminho_zip[:-4]}.csv"
+        _descompactar(caminho_zip, caminho_csv)
+        temporarios.append(caminho_csv)
+    resultado = processar_cliente(mes_ano, arquivo_num, {**opcoes, "servidor": None, "csv_local": caminho_csv})
+    return {**resultado, "tamanho_mb": round(tamanho_mb, 2), "servidor": False}
+
+
+def benchmark(mes_ano, arquivos, diretorio, diretorio_banco=None, estrategia="upsert", cnaes=None,
+              apenas_principal=False):
+    """
+    Mesmo CSV (já no DIR, sem rede) carregado pelos dois caminhos: cliente (Python + COPY FROM STDIN)
+    e servidor (COPY FROM arquivo). Uma carga de aquecimento antes, sem medir: nas duas medições
+    o merge encontra as mesmas linhas já gravadas. Retorna {caminho: {linhas, segundos, linhas_s}}
+    """
+    from .motor import montar_opcoes, processar_arquivo as processar_cliente
+
+    if estrategia in ("mensal", "snapshot"):
+        raise ValueError("Benchmark grava o mesmo arquivo duas vezes: use upsert ou direto")
+    pasta = os.path.join(diretorio, mes_ano)
+    os.makedirs(pasta, exist_ok=True)
+    tempos = {"cliente": [0, 0.0], "servidor": [0, 0.0]}
+    for arquivo_num in arquivos:
+        arquivo_nome = f"Estabelecimentos{arquivo_num}.zip"
+        caminho_zip = os.path.join(pasta, arquivo_nome)
+        caminho_csv = os.path.join(pasta, f"{arquivo_nome[:-4]}.csv")
+        print(f"\n⏬ {arquivo_nome} → {pasta}")
+        baixar_zip(mes_ano, arquivo_nome, caminho_zip)
+        _descompactar(caminho_zip, caminho_csv)
+        os.remove(caminho_zip)
+
+        caminho_banco = caminho_csv
+        if diretorio_banco:
+            caminho_banco = os.path.join(diretorio_banco, os.path.relpath(caminho_csv, diretorio))
+        opcoes_servidor = montar_opcoes(estrategia, cnaes=cnaes, apenas_principal=apenas_principal,
+                                        csv_local=caminho_banco, servidor_dir=diretorio)
+        opcoes_cliente = montar_opcoes(estrategia, cnaes=cnaes, apenas_principal=apenas_principal,
+                                       csv_local=caminho_csv)
+        try:
+            print("\n🔥 Aquecimento (não medido)")
+            processar_arquivo(mes_ano, arquivo_num, opcoes_servidor)
+            for caminho, processar, opcoes in (("cliente", processar_cliente, opcoes_cliente),
+                                               ("servidor", processar_arquivo, opcoes_servidor)):
+                inicio = time.perf_counter()
+                resultado = processar(mes_ano, arquivo_num, opcoes)
+                tempos[caminho][0] += resultado["lidos"]
+                tempos[caminho][1] += time.perf_counter() - inicio
+        finally:
+            os.remove(caminho_csv)
+
+    print("\n" + "="*70)
+    print(f"🏁 BENCHMARK {estrategia.upper()} - arquivos {list(arquivos)}")
+    print("="*70)
+    resumo = {}
+    for caminho, (linhas, segundos) in tempos.items():
+        resumo[caminho] = {"linhas": linhas, "segundos": round(segundos, 2),
+                           "linhas_s": round(linhas / max(segundos, 1e-9))}
+        print(f"  {caminho:<9} {linhas:>12,} linhas | {segundos:8.2f}s | {resumo[caminho]['linhas_s']:>10,} linhas/s")
+    if tempos["servidor"][1]:
+        print(f"  ganho do servidor: {tempos['cliente'][1] / tempos['servidor'][1]:.1f}x")
+    print("="*70)
+    return resumo
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+RFB SNAPSHOT - Publicação blue/green do mês inteiro (leitores nunca veem meio mês)
+- importar --estrategia snapshot: o mês vai para uma tabela nova estabelecimentos_YYYY_MM
+  (_v2, _v3... se o nome estiver publicado ou guardado p/ rollback)
+  * tabela do mês pronta (--nao-publicar) ou revertida não é apagada: a carga recusa
+    (publique/descarte antes) ou a substitui com --substituir-snapshot
+  * sem índices durante a carga; COPY direto, um arquivo = uma transação
+  * arquivos em paralelo (--workers ou fila de trabalho) na mesma tabela
+- no final: duplicatas entre arquivos removidas, PK + índices em bulk
+  (maintenance_work_mem / workers paralelos), ANALYZE
+- publicação atômica: CREATE OR REPLACE VIEW estabelecimentos_atual numa transação curta
+  (lock_timeout + novas tentativas p/ não enfileirar leitores atrás da troca)
+  * nunca DROP VIEW (views/funções que dependem dela continuam valendo); se as colunas
+    mudaram de um jeito que o REPLACE não aceita, a publicação falha e a view fica como estava
+- registro em rfb_snapshots: construindo → pronto → publicado → anterior → descartado
+- mantém MANTER snapshots anteriores para rollback instantâneo (reverter = trocar a view de volta);
+  revertidos e anteriores excedentes são apagados na publicação seguinte
+- leitores consultam estabelecimentos_atual; a tabela estabelecimentos (upsert) não é tocada
+
+Uso:
+  rfb-etl importar --mes 2024-01 --estrategia snapshot --workers 4
+  rfb-etl snapshot listar
+  rfb-etl snapshot publicar --mes 2024-01     (republica um snapshot pronto/anterior)
+  rfb-etl snapshot reverter                   (volta para o snapshot anterior)
+"""
+import time
+
+import psycopg2
+from psycopg2 import sql
+
+PREFIXO = "estabelecimentos"
+VISAO = "estabelecimentos_atual"
+MANTER = 1                      # snapshots anteriores guardados p/ rollback
+TENTATIVAS_TROCA = 10
+LOCK_TIMEOUT = "5s"
+MEMORIA_INDICE = "1GB"
+WORKERS_INDICE = 4
+INDICES = (("cnae_idx", "cnae_fiscal_principal"), ("uf_municipio_idx", "uf, municipio"))
+
+SQL_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS rfb_snapshots (
+  tabela text PRIMARY KEY,
+  mes_ano text NOT NULL,
+  estado text NOT NULL,
+  linhas bigint,
+  criado_em timestamptz NOT NULL DEFAULT NOW(),
+  pronto_em timestamptz,
+  publicado_em timestamptz
+);
+"""
+
+
+def criar_esquema(conn):
+    cursor = conn.cursor()
+    cursor.execute(SQL_ESQUEMA)
+    conn.commit()
+    cursor.close()
+
+
+def preparar(conn, mes_ano, substituir=False):
+    """Cria a tabela vazia (sem índices) do snapshot do mês. Retorna o nome"""
+    criar_esquema(conn)
+    cursor = conn.cursor()
+    base = f"{PREFIXO}_{mes_ano.replace('-', '_')}"
+    cursor.execute("""
+        SELECT tabela, estado FROM rfb_snapshots WHERE estado IN ('publicado', 'anterior', 'pronto', 'revertido')
+    """)
+    estados = dict(cursor.fetchall())
+    nome, versao = base, 1
+    while estados.get(nome) in ('publicado', 'anterior'):
+        versao += 1
+        nome = f"{base}_v{versao}"
+    if nome in estados and not substituir:
+        conn.rollback()
+        cursor.close()
+        raise RuntimeError(f"{nome} já está {estados[nome]} (republicável); publique com 'rfb-etl snapshot publicar "
+                           f"--mes {mes_ano}' ou recarregue com --substituir-snapshot para apagá-lo")
+
+    tabela = sql.Identifier(nome)
+    print(f"\n🧱 Preparando snapshot {nome}...")
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(tabela))
+    cursor.execute(sql.SQL(
+        "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING GENERATED)").format(tabela, sql.Identifier(PREFIXO)))
+    cursor.execute("""
+        INSERT INTO rfb_snapshots (tabela, mes_ano, estado) VALUES (%s, %s, 'construindo')
+        ON CONFLICT (tabela) DO UPDATE SET
+          mes_ano = EXCLUDED.mes_ano, estado = 'construindo', linhas = NULL,
+          criado_em = NOW(), pronto_em = NULL, publicado_em = NULL
+    """, (nome, mes_ano))
+    conn.commit()
+    cursor.close()
+    return nome
+
+
+def finalizar(conn, nome):
+    """Remove duplicatas entre arquivos, cria PK + índices em bulk e analisa. Retorna linhas"""
+    tabela = sql.Identifier(nome)
+    cursor = conn.cursor()
+    print(f"\n🔎 Índices em bulk de {nome}...")
+    inicio = time.time()
+    cursor.execute("SET maintenance_work_mem = %s", (MEMORIA_INDICE,))
+    cursor.execute("SET max_parallel_maintenance_workers = %s", (WORKERS_INDICE,))
+    # Arquivos em paralelo deduplicam cada um o seu: pode sobrar repetição entre arquivos.
+    # Conferido antes (e não por UniqueViolation): o rollback desfaria os SETs acima
+    cursor.execute(sql.SQL("""
+        SELECT EXISTS (SELECT 1 FROM {} GROUP BY cnpj_completo HAVING count(*) > 1)
+    """).format(tabela))
+    if cursor.fetchone()[0]:
+        cursor.execute(sql.SQL("""
+            DELETE FROM {0} WHERE ctid IN (
+              SELECT ctid FROM (
+                SELECT ctid, row_number() OVER (PARTITION BY cnpj_completo ORDER BY ctid) AS n FROM {0}
+              ) repetidos WHERE n > 1)
+        """).format(tabela))
+        print(f"      ♻️  {cursor.rowcount:,} duplicatas entre arquivos removidas")
+    cursor.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY (cnpj_completo)").format(tabela))
+    for sufixo, colunas in INDICES:
+        cursor.execute(sql.SQL("CREATE INDEX {} ON {} ({})").format(
+            sql.Identifier(f"{nome}_{sufixo}"), tabela,
+            sql.SQL(', ').join(map(sql.Identifier, colunas.split(', ')))))
+    cursor.execute(sql.SQL("ANALYZE {}").format(tabela))
+    cursor.execute(sql.SQL("SELECT count(*) FROM {}").format(tabela))
+    linhas = cursor.fetchone()[0]
+    cursor.execute("""
+        UPDATE rfb_snapshots SET estado = 'pronto', linhas = %s, pronto_em = NOW() WHERE tabela = %s
+    """, (linhas, nome))
+    conn.commit()
+    cursor.execute("RESET maintenance_work_mem")
+    cursor.execute("RESET max_parallel_maintenance_workers")
+    cursor.close()
+    print(f"      ✅ {linhas:,} linhas indexadas | {time.time() - inicio:.0f}s")
+    return linhas
+
+
+def _trocar_visao(conn, nome):
+    """Aponta a view para a tabela (uma transação curta; não fica na fila de locks)"""
+    tabela = sql.Identifier(nome)
+    for tentativa in range(1, TENTATIVAS_TROCA + 1):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET LOCAL lock_timeout = %s", (LOCK_TIMEOUT,))
+            cursor.execute(sql.SQL("CREATE OR REPLACE VIEW {} AS SELECT * FROM {}").format(
+                sql.Identifier(VISAO), tabela))
+            return cursor
+        except psycopg2.errors.InvalidTableDefinition as e:
+            # REPLACE só acrescenta colunas no fim; DROP VIEW quebraria quem depende da view
+            conn.rollback()
+            cursor.close()
+            raise RuntimeError(f"Colunas de {nome} incompatíveis com {VISAO} ({str(e).splitlines()[0]}); "
+                               f"view mantida. Ajuste a view (e o que depende dela) antes de publicar") from e
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            cursor.close()
+            print(f"      ⏳ {VISAO} em uso, nova tentativa ({tentativa}/{TENTATIVAS_TROCA})...")
+            time.sleep(tentativa)
+    raise RuntimeError(f"Não foi possível trocar {VISAO} (lock ocupado após {TENTATIVAS_TROCA} tentativas)")
+
+
+def _descartar_antigos(conn, manter):
+    """DROP dos revertidos e dos anteriores além de 'manter' (sem esperar leitores: fica p/ a próxima)"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        (SELECT tabela FROM rfb_snapshots WHERE estado = 'anterior' ORDER BY publicado_em DESC OFFSET %s)
+        UNION ALL
+        SELECT tabela FROM rfb_snapshots WHERE estado = 'revertido'
+    """, (manter,))
+    antigos = [t for t, in cursor.fetchall()]
+    conn.commit()
+    for nome in antigos:
+        try:
+            cursor.execute("SET LOCAL lock_timeout = %s", (LOCK_TIMEOUT,))
+            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(nome)))
+            cursor.execute("UPDATE rfb_snapshots SET estado = 'descartado' WHERE tabela = %s", (nome,))
+            conn.commit()
+            print(f"      🗑️  {nome} descartado")
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            print(f"      ⚠️  {nome} ainda em uso; descartado na próxima publicação")
+    cursor.close()
+
+
+def publicar(conn, nome, manter=MANTER):
+    """Troca estabelecimentos_atual para a tabela e rebaixa a atual para 'anterior'"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT estado FROM rfb_snapshots WHERE tabela = %s", (nome,))
+    linha = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    if linha is None or linha[0] not in ("pronto", "anterior", "revertido"):
+        raise ValueError(f"{nome} não pode ser publicado (estado: {linha[0] if linha else 'inexistente'})")
+
+    print(f"\n🔀 Publicando {nome} em {VISAO}...")
+    cursor = _trocar_visao(conn, nome)
+    cursor.execute("""
+        UPDATE rfb_snapshots SET estado = 'anterior' WHERE estado = 'publicado' AND tabela <> %s
+    """, (nome,))
+    cursor.execute("""
+        UPDATE rfb_snapshots SET estado = 'publicado', publicado_em = NOW() WHERE tabela = %s
+    """, (nome,))
+    conn.commit()
+    cursor.close()
+    print(f"      ✅ {VISAO} → {nome}")
+    _descartar_antigos(conn, manter)
+
+
+def reverter(conn):
+    """Volta a view para o último snapshot anterior; o atual fica 'revertido' (republicável)"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT tabela FROM rfb_snapshots WHERE estado = 'publicado'")
+    atual = cursor.fetchone()
+    cursor.execute("""
+        SELECT tabela FROM rfb_snapshots WHERE estado = 'anterior' ORDER BY publicado_em DESC LIMIT 1
+    """)
+    anterior = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    if anterior is None:
+        raise RuntimeError("Nenhum snapshot anterior guardado para reverter")
+
+    print(f"\n⏪ Revertendo {VISAO}: {atual[0] if atual else '-'} → {anterior[0]}")
+    cursor = _trocar_visao(conn, anterior[0])
+    cursor.execute("UPDATE rfb_snapshots SET estado = 'revertido' WHERE estado = 'publicado'")
+    cursor.execute("""
+        UPDATE rfb_snapshots SET estado = 'publicado', publicado_em = NOW() WHERE tabela = %s
+    """, (anterior[0],))
+    conn.commit()
+    cursor.close()
+    print(f"      ✅ {VISAO} → {anterior[0]}")
+    return anterior[0]
+
+
+def tabela_do_mes(conn, mes_ano):
+    """Snapshot mais recente do mês que pode ser publicado"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT tabela FROM rfb_snapshots
+        WHERE mes_ano = %s AND estado IN ('pronto', 'anterior', 'revertido')
+        ORDER BY criado_em DESC LIMIT 1
+    """, (mes_ano,))
+    linha = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    if linha is None:
+        raise ValueError(f"Nenhum snapshot pronto de {mes_ano}")
+    return linha[0]
+
+
+def listar(conn):
+    criar_esquema(conn)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT tabela, mes_ano, estado, linhas, criado_em, publicado_em FROM rfb_snapshots
+        WHERE estado <> 'descartado' ORDER BY criado_em DESC
+    """)
+    icones = {"publicado": "🟢", "anterior": "🔵", "pronto": "⚪", "revertido": "🟠", "construindo": "🟡"}
+    for tabela, mes_ano, estado, linhas, criado_em, publicado_em in cursor.fetchall():
+        linhas = "-" if linhas is None else f"{linhas:,}"
+        quando = publicado_em or criado_em
+        print(f"{icones.get(estado, '⚫')} {tabela:<32} {mes_ano} | {estado:<11} | {linhas:>12} linhas | "
+              f"{quando:%Y-%m-%d %H:%M}")
+    conn.commit()
+    cursor.close()
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+RFB SPOOL - Fila em disco entre a leitura do arquivo e o banco
+- importar --spool DIR: os lotes já codificados (CSV do COPY) viram segmentos
+  <DIR>/<mes_ano>/<arquivo>/<seq>-<linhas>.csv + manifesto.json
+- uma thread de drenagem aplica os segmentos na staging no ritmo do banco;
+  a leitura segue em velocidade de CPU mesmo com o banco lento ou fora do ar
+- limite em MB: com o spool cheio a leitura espera (backpressure)
+- queda de conexão: nova tentativa com backoff (até ESPERA_MAX_SEG), sem perder nada
+- segmento + progresso (rfb_spool_progresso) gravados na mesma transação;
+  segmento só sai do disco depois do commit
+- leitura completa no manifesto => a próxima execução do mesmo mês/arquivo só
+  drena o que falta e faz o merge (sem baixar de novo)
+"""
+import glob, json, os, shutil, threading, time
+
+import psycopg2
+from psycopg2 import sql
+
+from . import memoria
+from .comum import codificar_lote
+
+LIMITE_MB = 2048
+ESPERA_INICIAL_SEG = 2
+ESPERA_MAX_SEG = 1800      # banco fora por mais tempo que isso => arquivo falha (spool fica)
+
+SQL_PROGRESSO = """
+CREATE TABLE IF NOT EXISTS rfb_spool_progresso (
+  tabela text PRIMARY KEY,
+  mes_ano text NOT NULL,
+  arquivo int NOT NULL,
+  seq int NOT NULL,
+  atualizado_em timestamptz NOT NULL DEFAULT NOW()
+)
+"""
+
+
+class Spool:
+    """Segmentos de um arquivo em disco; gravar() bloqueia acima do limite"""
+
+    def __init__(self, diretorio, mes_ano, arquivo_num, limite_mb=LIMITE_MB):
+        self.diretorio = os.path.join(diretorio, mes_ano, str(arquivo_num))
+        self.limite_bytes = int(limite_mb * 1024 * 1024)
+        self._cond = threading.Condition()
+        self._cancelado = False
+        self.manifesto = self._carregar()
+        self._bytes = sum(os.path.getsize(c) for _, _, c in self.segmentos())
+
+    def _carregar(self):
+        try:
+            with open(os.path.join(self.diretorio, "manifesto.json"), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"proximo": 0, "completo": False, "leitura": None}
+
+    def _salvar_manifesto(self):
+        caminho = os.path.join(self.diretorio, "manifesto.json")
+        with open(f"{caminho}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.manifesto, f)
+        os.replace(f"{caminho}.tmp", caminho)
+
+    @property
+    def completo(self):
+        return self.manifesto["completo"]
+
+    def reiniciar(self):
+        """Descarta qualquer resto e começa um spool vazio"""
+        shutil.rmtree(self.diretorio, ignore_errors=True)
+        os.makedirs(self.diretorio)
+        self.manifesto = {"proximo": 0, "completo": False, "leitura": None}
+        self._salvar_manifesto()
+        self._bytes = 0
+
+    def gravar(self, dados, linhas):
+        bruto = dados.encode('utf-8')
+        with self._cond:
+            if self._bytes and self._bytes + len(bruto) > self.limite_bytes:
+                print(f"      ⏸️  Spool cheio ({self._bytes / 1024 / 1024:.0f}MB), leitura aguardando o banco...")
+                self._cond.wait_for(
+                    lambda: self._cancelado or not self._bytes or self._bytes + len(bruto) <= self.limite_bytes)
+            if self._cancelado:
+                raise RuntimeError("Spool cancelado")
+            seq = self.manifesto["proximo"]
+
+        caminho = os.path.join(self.diretorio, f"{seq:08d}-{linhas}.csv")
+        with open(f"{caminho}.tmp", 'wb') as f:
+            f.write(bruto)
+        os.replace(f"{caminho}.tmp", caminho)
+
+        with self._cond:
+            self.manifesto["proximo"] = seq + 1
+            self._salvar_manifesto()
+            self._bytes += len(bruto)
+            self._cond.notify_all()
+
+    def finalizar_gravacao(self, leitura):
+        """Leitura terminou: guarda os contadores (a retomada não relê o arquivo)"""
+        with self._cond:
+            self.manifesto.update(completo=True, leitura=leitura)
+            self._salvar_manifesto()
+            self._cond.notify_all()
+
+    def segmentos(self):
+        """[(seq, linhas, caminho)] ainda em disco, em ordem"""
+        itens = []
+        for caminho in glob.glob(os.path.join(self.diretorio, "*.csv")):
+            seq, linhas = os.path.basename(caminho)[:-4].split('-')
+            itens.append((int(seq), int(linhas), caminho))
+        return sorted(itens)
+
+    def descartar(self, caminho):
+        tamanho = os.path.getsize(caminho)
+        os.remove(caminho)
+        with self._cond:
+            self._bytes -= tamanho
+            self._cond.notify_all()
+
+    def aguardar(self, timeout=1.0):
+        """Espera novo segmento / fim da leitura / cancelamento"""
+        with self._cond:
+            self._cond.wait(timeout)
+
+    def cancelar(self):
+        with self._cond:
+            self._cancelado = True
+            self._cond.notify_all()
+
+    def remover(self):
+        shutil.rmtree(self.diretorio, ignore_errors=True)
+
+
+class DestinoSpool:
+    """Destino do motor: grava no spool e drena para o DestinoPostgres em outra thread"""
+
+    def __init__(self, spool, mes_ano, arquivo_num, abrir_postgres, retomar=False):
+        self.spool = spool
+        self.mes_ano = mes_ano
+        self.arquivo_num = arquivo_num
+        self.registros = 0
+        self._abrir_postgres = abrir_postgres   # abrir_postgres(truncar) -> DestinoPostgres
+        self._reiniciar_staging = not retomar
+        self._stats = None
+        self._erro = None
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._drenar, name=f"spool-{arquivo_num}", daemon=True)
+        self._thread.start()
+
+    def escrever(self, lote):
+        if self._erro is not None:
+            raise RuntimeError(f"Drenagem do spool falhou: {self._erro}") from self._erro
+        self.spool.gravar(codificar_lote(lote), len(lote))
+        self.registros += len(lote)
+
+    def concluir(self):
+        self._thread.join()
+        if self._erro is not None:
+            raise self._erro
+        self.spool.remover()
+        return self._stats
+
+    def abortar(self):
+        self._parar.set()
+        self.spool.cancelar()
+        self._thread.join()
+
+    def _preparar(self, destino):
+        """Zera staging + progresso (execução nova) ou lê o último segmento aplicado"""
+        tabela = destino.tabela.as_string(destino.cursor)
+        cursor = destino.cursor
+        cursor.execute(SQL_PROGRESSO)
+        if self._reiniciar_staging:
+            cursor.execute(sql.SQL("TRUNCATE {}").format(destino.tabela))
+            cursor.execute("DELETE FROM rfb_spool_progresso WHERE tabela = %s", (tabela,))
+            destino.conn.commit()
+            self._reiniciar_staging = False
+            return tabela, -1
+
+        cursor.execute("SELECT mes_ano, arquivo, seq FROM rfb_spool_progresso WHERE tabela = %s", (tabela,))
+        linha = cursor.fetchone()
+        destino.conn.commit()
+        if linha is None:
+            # Nenhum segmento aplicado (ou o merge já foi): todos os segmentos ainda estão em disco
+            self._reiniciar_staging = True
+            return self._preparar(destino)
+        if (linha[0], linha[1]) != (self.mes_ano, self.arquivo_num):
+            raise RuntimeError(f"{tabela} contém o arquivo {linha[1]} de {linha[0]}; spool não pode ser retomado")
+        return tabela, linha[2]
+
+    def _aplicar(self, destino, tabela, seq, linhas, caminho):
+        # Segmento inteiro em memória durante o COPY (texto + bytes lidos)
+        with memoria.atual().reserva("spool", 2 * os.path.getsize(caminho)), \
+                open(caminho, encoding='utf-8') as f:
+            destino.escrever_csv(f.read(), linhas)
+        destino.cursor.execute("""
+            INSERT INTO rfb_spool_progresso (tabela, mes_ano, arquivo, seq) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (tabela) DO UPDATE SET
+              mes_ano = EXCLUDED.mes_ano, arquivo = EXCLUDED.arquivo, seq = EXCLUDED.seq, atualizado_em = NOW()
+        """, (tabela, self.mes_ano, self.arquivo_num, seq))
+        destino.commit()
+        self.spool.descartar(caminho)
+
+    def _drenar(self):
+        espera, fora_desde = ESPERA_INICIAL_SEG, None
+        while not self._parar.is_set():
+            destino = None
+            try:
+                destino = self._abrir_postgres(False)
+                tabela, aplicado = self._preparar(destino)
+                if fora_desde is not None:
+                    print(f"      🔌 Banco de volta após {time.time() - fora_desde:.0f}s; drenando o spool")
+                espera, fora_desde = ESPERA_INICIAL_SEG, None
+
+                while not self._parar.is_set():
+                    # completo lido ANTES da listagem: se a leitura terminar entre as duas,
+                    # o último segmento aparece na próxima volta em vez de ficar para trás
+                    completo = self.spool.completo
+                    segmentos = self.spool.segmentos()
+                    for seq, linhas, caminho in segmentos:
+                        if seq <= aplicado:
+                            self.spool.descartar(caminho)   # commit feito, só faltou apagar
+                        else:
+                            self._aplicar(destino, tabela, seq, linhas, caminho)
+                            aplicado = seq
+                    if not segmentos and completo:
+                        # Sai na mesma transação do merge (concluir faz o commit)
+                        destino.cursor.execute("DELETE FROM rfb_spool_progresso WHERE tabela = %s", (tabela,))
+                        self._stats = destino.concluir()
+                        return
+                    if not segmentos:
+                        self.spool.aguardar()
+                destino.abortar()
+                return
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if destino is not None:
+                    try:
+                        destino.abortar()
+                    except Exception:
+                        pass
+                fora_desde = fora_desde or time.time()
+                if time.time() - fora_desde > ESPERA_MAX_SEG:
+                    self._erro = e
+                    self.spool.cancelar()
+                    return
+                print(f"      ⚠️  Banco indisponível ({str(e).strip()[:60]}); "
+                      f"spool continua gravando, nova tentativa em {espera}s")
+                self._parar.wait(espera)
+                espera = min(espera * 2, 60)
+            except Exception as e:
+                if destino is not None:
+                    try:
+                        destino.abortar()
+                    except Exception:
+                        pass
+                self._erro = e
+                self.spool.cancelar()
+                return
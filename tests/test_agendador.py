@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Agendador contra um espelho HTTP local (o motor é trocado por um importar falso)"""
+import functools, http.server, json, threading
+
+import pytest
+
+from rfb_etl import agendador
+
+
+class _Silencioso(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def espelho(tmp_path, monkeypatch):
+    """Servidor HTTP local servindo <tmp>/www; devolve função que publica arquivos num mês"""
+    raiz = tmp_path / "www"
+    raiz.mkdir()
+    handler = functools.partial(_Silencioso, directory=str(raiz))
+    servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(agendador, "URL_DADOS", f"http://127.0.0.1:{servidor.server_address[1]}")
+    monkeypatch.setattr(agendador, "ARQUIVO_ESTADO", str(tmp_path / "estado.json"))
+    monkeypatch.setattr(agendador, "ARQUIVO_LOCK", str(tmp_path / "agendador.lock"))
+
+    def publicar(mes_ano, numeros=range(10), tamanho=100):
+        (raiz / mes_ano).mkdir(exist_ok=True)
+        for n in numeros:
+            (raiz / mes_ano / f"Estabelecimentos{n}.zip").write_bytes(b"x" * tamanho)
+
+    yield publicar
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture
+def chamadas(monkeypatch):
+    """Importar falso: devolve (chamadas feitas, arquivos que devem falhar)"""
+    registro = []
+
+    def importar(mes_ano, arquivos, estrategia, workers, ao_concluir):
+        registro.append({"mes_ano": mes_ano, "arquivos": list(arquivos), "estrategia": estrategia})
+        for n in arquivos:
+            if n in registro_falhas:
+                ao_concluir(n, None, RuntimeError(f"falha simulada {n}"))
+            else:
+                ao_concluir(n, {"registros": 10}, None)
+
+    registro_falhas = set()
+    monkeypatch.setattr(agendador, "importar", importar)
+    return registro, registro_falhas
+
+
+def _estado():
+    with open(agendador.ARQUIVO_ESTADO, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _rodada(estrategia="upsert"):
+    return agendador.executar(uma_vez=True, workers=2, estrategia=estrategia)
+
+
+def test_mes_novo_espera_tamanhos_estaveis_e_importa(espelho, chamadas):
+    registro, _ = chamadas
+    espelho("2024-01")
+    espelho("2024-02", numeros=range(7))
+
+    assert _rodada() == 0   # mês mais novo incompleto: só aguarda
+    assert _estado()["releases"]["2024-02"]["status"] == "aguardando"
+    assert "2024-01" not in _estado()["releases"]
+
+    espelho("2024-02", numeros=range(7, 10))
+    assert _rodada() == 0   # completo, mas tamanhos ainda não confirmados
+    assert registro == []
+
+    assert _rodada() == 0
+    assert registro == [{"mes_ano": "2024-02", "arquivos": list(range(10)),
+                         "estrategia": "upsert"}]
+    release = _estado()["releases"]["2024-02"]
+    assert release["status"] == "concluido" and release["tentativas"] == 1
+
+
+def test_rodada_repetida_nao_reimporta(espelho, chamadas):
+    registro, _ = chamadas
+    espelho("2024-02")
+    _rodada()
+    _rodada()
+    assert len(registro) == 1
+    _rodada()
+    assert len(registro) == 1
+
+
+def test_tamanho_mudando_adia_importacao(espelho, chamadas):
+    registro, _ = chamadas
+    espelho("2024-02")
+    _rodada()
+    espelho("2024-02", numeros=[3], tamanho=500)   # upload ainda em andamento
+    _rodada()
+    assert registro == []
+    _rodada()
+    assert registro[0]["arquivos"][0] == 3   # maior primeiro
+
+
+def test_lock_impede_execucao_sobreposta(espelho, chamadas):
+    registro, _ = chamadas
+    espelho("2024-02")
+    lock = agendador.adquirir_lock()
+    try:
+        assert _rodada() == 1
+    finally:
+        lock.close()
+    assert registro == []
+    assert _rodada() == 0
+
+
+def test_falha_registrada_e_retomada_so_dos_pendentes(espelho, chamadas):
+    registro, falhas = chamadas
+    espelho("2024-02")
+    falhas.add(4)
+    _rodada()
+    _rodada()
+    release = _estado()["releases"]["2024-02"]
+    assert release["status"] == "falhou" and release["tentativas"] == 1
+    assert release["arquivos"]["Estabelecimentos4.zip"]["status"] == "falhou"
+    assert "falha simulada 4" in release["arquivos"]["Estabelecimentos4.zip"]["erro"]
+
+    falhas.clear()
+    _rodada()   # falhou: não espera nova confirmação de tamanhos
+    assert registro[-1]["arquivos"] == [4]
+    release = _estado()["releases"]["2024-02"]
+    assert release["status"] == "concluido" and release["tentativas"] == 2
+
+
+def test_falhas_demais_aguardam_intervencao(espelho, chamadas):
+    registro, falhas = chamadas
+    espelho("2024-02")
+    falhas.add(0)
+    for _ in range(agendador.MAX_TENTATIVAS + 3):
+        _rodada()
+    assert len(registro) == agendador.MAX_TENTATIVAS
+    assert _estado()["releases"]["2024-02"]["tentativas"] == agendador.MAX_TENTATIVAS
+
+
+def test_estrategia_mensal_recarrega_o_mes_inteiro(espelho, chamadas):
+    registro, falhas = chamadas
+    espelho("2024-02")
+    falhas.add(4)
+    _rodada("mensal")
+    _rodada("mensal")
+    falhas.clear()
+    _rodada("mensal")
+    assert [c["estrategia"] for c in registro] == ["mensal", "mensal"]
+    assert sorted(registro[-1]["arquivos"]) == list(range(10))
+    assert _estado()["releases"]["2024-02"]["status"] == "concluido"
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""DeduplicadorCNPJ: bitmap das matrizes + arrays ordenados das filiais"""
+from rfb_etl.dedup import DeduplicadorCNPJ
+
+
+def _dedup(*arquivos, tamanho_buffer=3):
+    """Passa cada arquivo (lista de (basico, ordem, dv)) e devolve [[duplicado?...], ...]"""
+    dedup = DeduplicadorCNPJ(tamanho_buffer=tamanho_buffer)
+    resultado = []
+    for numero, cnpjs in enumerate(arquivos):
+        dedup.iniciar_arquivo(numero)
+        resultado.append([dedup.duplicado(*cnpj) for cnpj in cnpjs])
+        dedup.finalizar_arquivo()
+    return dedup, resultado
+
+
+def test_duplicata_no_mesmo_arquivo():
+    dedup, (marcas,) = _dedup([
+        ("12345678", "0001", "95"), ("12345678", "0001", "95"),
+        ("12345678", "0002", "76"), ("12345678", "0002", "76"),
+    ])
+    assert marcas == [False, True, False, True]
+    assert dedup.por_arquivo[0]["mesmo_arquivo"] == 2
+    assert dedup.por_arquivo[0]["outros_arquivos"] == 0
+    assert dedup.unicos == 2
+
+
+def test_duplicata_entre_arquivos():
+    dedup, (primeiro, segundo) = _dedup(
+        [("00000001", "0001", "36"), ("00000001", "0002", "17")],
+        [("00000001", "0001", "36"), ("00000001", "0002", "17"), ("00000002", "0001", "17")],
+    )
+    assert primeiro == [False, False]
+    assert segundo == [True, True, False]
+    assert dedup.por_arquivo[1] == {
+        "mesmo_arquivo": 0, "outros_arquivos": 2,
+        "amostras": ["00000001000136 (outros_arquivos)", "00000001000217 (outros_arquivos)"],
+    }
+    assert dedup.total_duplicados == 2
+
+
+def test_matriz_e_filial_do_mesmo_basico_nao_se_confundem():
+    # Matriz vai para o bitmap, filiais para o array ordenado: só a chave completa repete
+    dedup, (marcas,) = _dedup([
+        ("99999999", "0001", "91"), ("99999999", "0002", "72"), ("99999999", "0003", "53"),
+        ("99999999", "0002", "72"), ("99999999", "0001", "91"),
+    ])
+    assert marcas == [False, False, False, True, True]
+    assert dedup.unicos == 3
+
+
+def test_filiais_depois_de_ordenar_o_buffer():
+    # tamanho_buffer=2: as pendentes vão para o array ordenado no meio do arquivo
+    filiais = [("1111111%d" % i, "0002", "00") for i in range(5)]
+    dedup, (marcas,) = _dedup(filiais + list(reversed(filiais)), tamanho_buffer=2)
+    assert marcas == [False] * 5 + [True] * 5
+    assert len(dedup._filiais) == 5 and list(dedup._filiais) == sorted(dedup._filiais)
+
+
+def test_chaves_invalidas_nao_sao_deduplicadas():
+    dedup, (marcas,) = _dedup([
+        ("1234567", "0001", "95"), ("1234567X", "0001", "95"),
+        ("1234567X", "0001", "95"), ("12345678", "0001", "9 "),
+    ])
+    assert marcas == [False] * 4
+    assert dedup.invalidos == 4 and dedup.unicos == 0
+
+
+def test_arquivo_nao_finalizado_e_descartado():
+    dedup = DeduplicadorCNPJ()
+    dedup.iniciar_arquivo(0)
+    assert not dedup.duplicado("12345678", "0001", "95")
+    dedup.iniciar_arquivo(1)   # arquivo 0 falhou: suas chaves não contam
+    assert not dedup.duplicado("12345678", "0001", "95")
+
+
+def test_filiais_alem_do_limite_vao_para_o_disco(tmp_path):
+    arquivos = [[(f"{n:08d}", f"{o:04d}", "00") for n in range(a, 40, 3) for o in (1, 2, 3)] for a in range(3)]
+    arquivos.append([(f"{n:08d}", "0002", "00") for n in range(0, 60)])
+    _, esperado = _dedup(*arquivos)
+
+    dedup = DeduplicadorCNPJ(tamanho_buffer=3, limite_bytes=1, diretorio=str(tmp_path))
+    resultado = []
+    for numero, cnpjs in enumerate(arquivos):
+        dedup.iniciar_arquivo(numero)
+        resultado.append([dedup.duplicado(*cnpj) for cnpj in cnpjs])
+        dedup.finalizar_arquivo()
+        assert dedup.disco_bytes() == 8 * len(dedup._filiais) > 0
+    assert resultado == esperado
+    assert list(dedup._filiais) == sorted(dedup._filiais)
+    dedup.fechar()
+    assert dedup.disco_bytes() == 0 and list(tmp_path.iterdir()) == []
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Fila contra um PostgreSQL descartável (RFB_TESTE_CONN, com o esquema de estabelecimentos):
+vários processos no mesmo banco e worker antigo depois de perder o lease.
+Linhas sintéticas com DV 'XX' (nunca um CNPJ real); tudo é apagado no final.
+"""
+import os, subprocess, sys, zipfile
+
+import pytest
+
+CONN = os.environ.get("RFB_TESTE_CONN")
+pytestmark = pytest.mark.skipif(not CONN, reason="defina RFB_TESTE_CONN (banco descartável) para rodar")
+
+MES = "2099-01"
+ARQUIVOS = 6
+LINHAS = 300
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _linha(n, nome="TESTE"):
+    return [f"99{n:06d}", "0001", "XX", "1", nome] + [""] * 25
+
+
+def _sql(consulta, parametros=None):
+    import psycopg2
+    conn = psycopg2.connect(CONN)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute(consulta, parametros)
+    linhas = cursor.fetchall() if cursor.description else None
+    conn.close()
+    return linhas
+
+
+@pytest.fixture
+def banco(monkeypatch):
+    from rfb_etl import comum, fila
+    monkeypatch.setattr(comum, "CONN_STRING", CONN)
+    conn = comum.conectar_db()
+    fila.criar_esquema(conn)
+    conn.close()
+
+    def limpar():
+        _sql("DELETE FROM estabelecimentos WHERE cnpj_dv = 'XX' AND cnpj_basico LIKE '99%%'")
+        _sql("DELETE FROM rfb_fila_cargas WHERE mes_ano = %s", (MES,))
+
+    limpar()
+    yield
+    limpar()
+
+
+@pytest.fixture
+def espelho(tmp_path):
+    """ZIPs sintéticos em <tmp>/www/2099-01 (servidos por file://)"""
+    diretorio = tmp_path / "www" / MES
+    diretorio.mkdir(parents=True)
+    for arquivo in range(ARQUIVOS):
+        linhas = [_linha(arquivo * LINHAS + i, f"ARQUIVO {arquivo}") for i in range(LINHAS)]
+        texto = "".join(";".join(f'"{c}"' for c in row) + "\n" for row in linhas)
+        with zipfile.ZipFile(diretorio / f"Estabelecimentos{arquivo}.zip", "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr(f"ESTABELE{arquivo}", texto.encode("latin-1"))
+    return f"file://{tmp_path / 'www'}"
+
+
+def _rfb(url_dados, *args):
+    env = dict(os.environ, PYTHONPATH=RAIZ, RFB_CONN_STRING=CONN, RFB_URL_DADOS=url_dados)
+    return subprocess.run([sys.executable, "-m", "rfb_etl", *args], env=env, capture_output=True,
+                          text=True, timeout=600)
+
+
+def test_varios_processos_no_mesmo_banco(banco, espelho):
+    saida = _rfb(espelho, "fila", "enfileirar", "--mes", MES, "--arquivos", f"0-{ARQUIVOS - 1}", "--reiniciar")
+    assert saida.returncode == 0, saida.stdout + saida.stderr
+    saida = _rfb(espelho, "fila", "trabalhar", "--processos", "3", "--lease", "60")
+    assert saida.returncode == 0, saida.stdout + saida.stderr
+
+    estados = _sql("SELECT estado, count(*), sum((resultado->>'registros')::int) FROM rfb_fila_trabalho "
+                   "WHERE mes_ano = %s GROUP BY estado", (MES,))
+    assert estados == [("concluido", ARQUIVOS, ARQUIVOS * LINHAS)]
+    total, distintos = _sql("SELECT count(*), count(DISTINCT cnpj_completo) FROM estabelecimentos "
+                            "WHERE cnpj_dv = 'XX' AND cnpj_basico LIKE '99%%'")[0]
+    assert total == distintos == ARQUIVOS * LINHAS
+    assert _sql("SELECT count(*) FROM pg_tables WHERE tablename LIKE 'estabelecimentos_staging_fila%%'") == [(0,)]
+
+
+def test_worker_que_perdeu_o_lease_nao_suja_a_carga(banco):
+    from rfb_etl.motor import DestinoPostgres
+    _sql("INSERT INTO rfb_fila_cargas (mes_ano, opcoes) VALUES (%s, '{}')", (MES,))
+    _sql("INSERT INTO rfb_fila_trabalho (mes_ano, arquivo, estado, worker, tentativas) "
+         "VALUES (%s, 7, 'executando', 'antigo', 1)", (MES,))
+
+    antigo = DestinoPostgres("upsert", MES, 7, staging_propria=True, lease=(MES, 7, "antigo"))
+    antigo.escrever([_linha(n, "ANTIGO") for n in range(0, 100)])
+
+    # Lease vence e outro worker assume o mesmo arquivo enquanto o antigo ainda grava
+    _sql("UPDATE rfb_fila_trabalho SET worker = 'novo', tentativas = 2 WHERE mes_ano = %s", (MES,))
+    novo = DestinoPostgres("upsert", MES, 7, staging_propria=True, lease=(MES, 7, "novo"))
+    novo.escrever([_linha(n, "NOVO") for n in range(50, 150)])
+    antigo.escrever([_linha(n, "ANTIGO") for n in range(150, 200)])
+    novo.concluir()
+
+    with pytest.raises(RuntimeError, match="Lease"):
+        antigo.concluir()
+    antigo.abortar()
+
+    linhas = _sql("SELECT nome_fantasia, count(*), min(cnpj_basico), max(cnpj_basico) FROM estabelecimentos "
+                  "WHERE cnpj_dv = 'XX' AND cnpj_basico LIKE '99%%' GROUP BY 1")
+    assert linhas == [("NOVO", 100, "99000050", "99000149")]
+
+
+def test_pendente_sem_tentativas_nao_prende_o_worker(banco):
+    from rfb_etl import fila
+    _sql("INSERT INTO rfb_fila_cargas (mes_ano, opcoes) VALUES (%s, '{}')", (MES,))
+    _sql("INSERT INTO rfb_fila_trabalho (mes_ano, arquivo, estado, tentativas) "
+         "VALUES (%s, 0, 'pendente', 3)", (MES,))
+    # Antes o item contava como restante e o worker dormia/consultava para sempre
+    assert fila.trabalhar(lease=60, max_tentativas=3, worker="teste") == 0
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Governador: thread de amostragem não vaza conexões e para de verdade"""
+import threading, time
+
+from rfb_etl import governador
+
+
+class _ConexaoQuebrada:
+    """Conexão que falha ao abrir cursor (ex.: servidor reiniciou)"""
+
+    def __init__(self, abertas):
+        self.closed = False
+        self.autocommit = False
+        self._abertas = abertas
+        abertas.append(self)
+
+    def cursor(self):
+        raise RuntimeError("server closed the connection unexpectedly")
+
+    def close(self):
+        self.closed = True
+
+
+def test_falha_fecha_a_conexao_e_parar_encerra_a_thread(monkeypatch):
+    abertas = []
+    monkeypatch.setattr(governador, "conectar_db", lambda aplicacao: _ConexaoQuebrada(abertas))
+    monkeypatch.setattr(governador, "_governador", None)
+
+    gov = governador.obter({"intervalo": 0.01}, 2)
+    assert governador.obter(None, 8) is gov
+    time.sleep(0.2)
+    governador.encerrar()
+
+    assert len(abertas) > 1
+    assert all(conn.closed for conn in abertas)
+    assert not gov._thread.is_alive()
+    assert "governador" not in [t.name for t in threading.enumerate()]
+    assert governador._governador is None
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Índice local: construção, consulta e troca de versão sem 'atual' pendurado"""
+import os
+
+from rfb_etl import indice
+from rfb_etl.comum import COLUNAS_ESTABELECIMENTOS
+
+
+def _linha(basico, ordem="0001", dv="00", nome=""):
+    row = [basico, ordem, dv] + [""] * (len(COLUNAS_ESTABELECIMENTOS) - 3)
+    row[4] = nome
+    return row
+
+
+def _construir(diretorio, mes_ano, linhas_por_arquivo):
+    indice.preparar(diretorio, mes_ano)
+    for arquivo_num, linhas in enumerate(linhas_por_arquivo):
+        coletor = indice.ColetorIndice(diretorio, mes_ano, arquivo_num)
+        for row in linhas:
+            coletor.adicionar(row)
+        coletor.fechar()
+    return indice.construir(diretorio, mes_ano)
+
+
+def test_busca_por_cnpj(tmp_path):
+    diretorio = str(tmp_path)
+    resumo = _construir(diretorio, "2024-01", [
+        [_linha("%08d" % n, nome=f"EMPRESA {n}") for n in range(0, 3000, 3)],
+        [_linha("%08d" % n, nome=f"EMPRESA {n}") for n in range(1, 3000, 3)]
+        + [_linha("00000001", nome="REPETIDA"), _linha("ABC", nome="INVALIDA")],
+    ])
+    assert resumo["total"] == 2000 and resumo["duplicados"] == 1
+
+    with indice.IndiceCNPJ(diretorio) as idx:
+        assert len(idx) == 2000
+        assert idx.buscar("00.000.300/0001-00")["nome_fantasia"] == "EMPRESA 300"
+        assert idx.buscar(1000100)["nome_fantasia"] == "EMPRESA 1"   # a primeira ocorrência vence
+        assert idx.buscar("00000002000100") is None   # 2 ≡ 2 (mod 3): nunca gravado
+        assert idx.buscar("123") is None
+        resultado = indice.benchmark(idx, consultas=1000)
+    assert resultado["achados"] == 500
+
+
+def test_republicacao_troca_so_o_symlink(tmp_path, monkeypatch):
+    diretorio = str(tmp_path)
+    _construir(diretorio, "2024-01", [[_linha("00000001", nome="V1")]])
+    leitor_antigo = indice.IndiceCNPJ(diretorio)
+
+    # A cada rename da publicação, 'atual' e o link do mês continuam resolvendo para um índice completo
+    verificacoes = []
+    replace = os.replace
+
+    def replace_conferido(origem, destino):
+        replace(origem, destino)
+        for nome in ("atual", "2024-01"):
+            verificacoes.append(os.path.isfile(os.path.join(diretorio, nome, "meta.json")))
+
+    monkeypatch.setattr(indice.os, "replace", replace_conferido)
+    for versao in ("V2", "V3"):
+        _construir(diretorio, "2024-01", [[_linha("00000001", nome=versao)]])
+    assert verificacoes and all(verificacoes)
+
+    with indice.IndiceCNPJ(diretorio) as idx:
+        assert idx.buscar("00000001000100")["nome_fantasia"] == "V3"
+    with indice.IndiceCNPJ(os.path.join(diretorio, "2024-01")) as idx:
+        assert idx.buscar("00000001000100")["nome_fantasia"] == "V3"
+    # Leitor aberto antes segue no mmap da versão dele, mesmo com o diretório já apagado
+    assert leitor_antigo.buscar("00000001000100")["nome_fantasia"] == "V1"
+    leitor_antigo.fechar()
+
+    assert len(indice._versoes(diretorio, "2024-01")) == indice.MANTER_VERSOES
+    assert os.path.islink(os.path.join(diretorio, "atual"))
+
+
+def test_layout_antigo_vira_versao(tmp_path):
+    diretorio = str(tmp_path)
+    resumo = _construir(diretorio, "2024-01", [[_linha("00000001", nome="ANTIGO")]])
+    # Simula o layout anterior: diretório real <MES_ANO> e 'atual' → <MES_ANO>
+    os.remove(os.path.join(diretorio, "2024-01"))
+    os.rename(resumo["diretorio"], os.path.join(diretorio, "2024-01"))
+    os.remove(os.path.join(diretorio, "atual"))
+    os.symlink("2024-01", os.path.join(diretorio, "atual"))
+
+    _construir(diretorio, "2024-01", [[_linha("00000001", nome="NOVO")]])
+    assert os.path.islink(os.path.join(diretorio, "2024-01"))
+    assert len(indice._versoes(diretorio, "2024-01")) == 2
+    with indice.IndiceCNPJ(diretorio) as idx:
+        assert idx.buscar("00000001000100")["nome_fantasia"] == "NOVO"
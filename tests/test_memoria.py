@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Regressão do teto de memória: importação de 1GB sintético dentro de 256MB de RSS"""
+import os, sys
+
+import pytest
+
+from rfb_etl import memoria
+from rfb_etl.memoria import verificar
+
+CONN = os.environ.get("RFB_TESTE_CONN")
+
+
+def test_pico_medido_e_so_do_processo_verificado(tmp_path):
+    saida = str(tmp_path / "saida.log")
+    grande = [sys.executable, "-c", "import time; x = bytearray(300 * 1024 * 1024); time.sleep(0.5)"]
+    codigo, pico_grande = memoria._executar_medindo(grande, dict(os.environ), saida)
+    assert codigo == 0 and pico_grande > 300
+    # Nem o filho já esperado (ex.: outro teste) nem o RSS deste processo entram na medição
+    lastro = b"1" * (200 * 1024 * 1024)
+    codigo, pico_pequeno = memoria._executar_medindo([sys.executable, "-c", "pass"], dict(os.environ), saida)
+    assert codigo == 0 and pico_pequeno < 100
+    del lastro
+
+
+@pytest.mark.slow
+def test_importacao_respeita_teto(tmp_path):
+    ok, resumo = verificar(tamanho_mb=1024, limite_mb=256, diretorio=str(tmp_path))
+    assert resumo["codigo_saida"] == 0
+    assert ok, f"pico de RSS {resumo['pico_rss_mb']}MB acima do teto de {resumo['limite_mb']}MB"
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(not CONN, reason="defina RFB_TESTE_CONN (banco descartável) para rodar")
+def test_importacao_com_copy_no_banco_respeita_teto(tmp_path, monkeypatch):
+    from rfb_etl import comum
+    # Snapshot de 2099-01 nunca publicado, apagado no final (nada em estabelecimentos)
+    monkeypatch.setattr(comum, "CONN_STRING", CONN)
+    monkeypatch.setenv("RFB_CONN_STRING", CONN)
+    ok, resumo = verificar(tamanho_mb=1024, limite_mb=256, diretorio=str(tmp_path), banco=True)
+    assert resumo["codigo_saida"] == 0
+    assert ok, f"pico de RSS {resumo['pico_rss_mb']}MB acima do teto de {resumo['limite_mb']}MB"
+
+    conn = comum.conectar_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT count(*) FROM rfb_snapshots WHERE mes_ano = %s", (memoria.MES_SINTETICO,))
+    assert cursor.fetchone() == (0,)
+    conn.close()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Feed de mudanças com merges concorrentes (banco descartável em RFB_TESTE_CONN)"""
+import os, threading
+
+import pytest
+
+CONN = os.environ.get("RFB_TESTE_CONN")
+pytestmark = pytest.mark.skipif(not CONN, reason="defina RFB_TESTE_CONN (banco descartável) para rodar")
+
+MES = "2099-01"
+
+
+def _linha(n):
+    return [f"98{n:06d}", "0001", "XX", "1", "TESTE"] + [""] * 25
+
+
+@pytest.fixture
+def conectar(monkeypatch):
+    from rfb_etl import comum, mudancas
+    monkeypatch.setattr(comum, "CONN_STRING", CONN)
+    conn = comum.conectar_db()
+    mudancas.criar_esquema(conn)
+
+    def limpar():
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM estabelecimentos WHERE cnpj_dv = 'XX' AND cnpj_basico LIKE '98%'")
+        cursor.execute("DELETE FROM estabelecimentos_mudancas WHERE mes_ano = %s", (MES,))
+        conn.commit()
+
+    limpar()
+    yield comum.conectar_db
+    limpar()
+    conn.close()
+
+
+def test_ids_do_feed_seguem_a_ordem_de_commit(conectar):
+    from rfb_etl import mudancas
+    from rfb_etl.motor import DestinoPostgres
+
+    # Merge "lento" de outra carga: pegou ids e ainda não fez commit
+    lento = conectar()
+    cursor = lento.cursor()
+    mudancas.travar_feed(cursor)
+    cursor.execute("""
+        INSERT INTO estabelecimentos_mudancas (mes_ano, arquivo, cnpj, tipo, colunas, depois)
+        VALUES (%s, 0, '98999999', 'novo', '{}', '{}') RETURNING id
+    """, (MES,))
+    id_lento = cursor.fetchone()[0]
+
+    destino = DestinoPostgres("upsert", MES, 1, staging_propria=True, registrar_mudancas=True)
+    destino.escrever([_linha(n) for n in range(10)])
+    rapido = threading.Thread(target=destino.concluir)
+    rapido.start()
+    rapido.join(2)
+    assert rapido.is_alive()   # espera o commit do merge lento
+
+    lento.commit()
+    lento.close()
+    rapido.join(30)
+    assert not rapido.is_alive()
+
+    # Consumidor que leu até id_lento não perde nada: o merge rápido só gerou ids depois
+    conn = conectar()
+    cursor = conn.cursor()
+    cursor.execute("SELECT count(*), min(id) FROM estabelecimentos_mudancas WHERE mes_ano = %s AND arquivo = 1",
+                   (MES,))
+    total, menor = cursor.fetchone()
+    conn.close()
+    assert total == 10 and menor > id_lento
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Reconciliação: agregados do cliente × do servidor (GROUP BY faixa, uf somado no Python)"""
+import os
+
+import pytest
+from psycopg2 import sql
+
+from rfb_etl import reconciliacao
+from rfb_etl.comum import COLUNAS_ESTABELECIMENTOS
+from rfb_etl.motor import montar_opcoes
+
+CONN = os.environ.get("RFB_TESTE_CONN")
+UFS = ("SP", "RJ", "MG", "")
+
+
+def _linhas(total):
+    for n in range(total):
+        row = [""] * len(COLUNAS_ESTABELECIMENTOS)
+        row[:5] = [f"{n * 7919 % 10 ** 8:08d}", "0001", "XX", "1", f"FANTASIA {n}"]
+        row[reconciliacao.POSICAO_UF] = UFS[n % len(UFS)]
+        yield row
+
+
+def test_upsert_em_paralelo_nao_reconcilia():
+    with pytest.raises(ValueError, match="dedup entre arquivos"):
+        montar_opcoes("upsert", workers=4, reconciliar=True)
+    with pytest.raises(ValueError, match="dedup entre arquivos"):
+        montar_opcoes("upsert", deduplicar=False, reconciliar=True)
+    assert montar_opcoes("mensal", workers=4, reconciliar=True)["reconciliar"]
+
+
+@pytest.mark.skipif(not CONN, reason="defina RFB_TESTE_CONN (banco descartável) para rodar")
+def test_agregados_do_servidor_batem_com_o_cliente():
+    import psycopg2
+    linhas = list(_linhas(5000))
+    agregador = reconciliacao.Agregador()
+    for row in linhas:
+        agregador.adicionar(row)
+
+    conn = psycopg2.connect(CONN)
+    reconciliacao.conferir_requisitos(conn, "mensal")
+    cursor = conn.cursor()
+    colunas = sql.SQL(", ").join(sql.SQL("{} text").format(sql.Identifier(c)) for c in COLUNAS_ESTABELECIMENTOS)
+    cursor.execute(sql.SQL("CREATE TEMP TABLE linhas_teste ({})").format(colunas))
+    cursor.executemany(sql.SQL("INSERT INTO linhas_teste VALUES ({})").format(
+        sql.SQL(", ").join(sql.Placeholder() * len(COLUNAS_ESTABELECIMENTOS))), linhas)
+    origem = sql.SQL("FROM linhas_teste")
+
+    faixas, ufs = reconciliacao.agregados_servidor(cursor, origem, reconciliacao.DIGITOS_FAIXA)
+    assert reconciliacao._divergentes(agregador.por_faixa(reconciliacao.DIGITOS_FAIXA), faixas) == []
+    assert reconciliacao._divergentes(agregador.ufs, ufs) == []
+
+    detalhe, _ = reconciliacao.agregados_servidor(cursor, origem, reconciliacao.DIGITOS_DETALHE, uf=False,
+                                                  faixas={"000", "999"})
+    cliente = {k: v for k, v in agregador.por_faixa(reconciliacao.DIGITOS_DETALHE).items()
+               if k[:reconciliacao.DIGITOS_FAIXA] in ("000", "999")}
+    assert detalhe and reconciliacao._divergentes(cliente, detalhe) == []
+
+    # Uma linha alterada no banco aparece na faixa e na uf dela
+    cursor.execute("UPDATE linhas_teste SET nome_fantasia = 'MUDOU' WHERE cnpj_basico = %s", (linhas[10][0],))
+    faixas, ufs = reconciliacao.agregados_servidor(cursor, origem, reconciliacao.DIGITOS_FAIXA)
+    divergentes = reconciliacao._divergentes(agregador.por_faixa(reconciliacao.DIGITOS_FAIXA), faixas)
+    assert [(f, m) for f, _, _, m in divergentes] == [(linhas[10][0][:3], "conteúdo diferente")]
+    assert [u for u, *_ in reconciliacao._divergentes(agregador.ufs, ufs)] == [linhas[10][reconciliacao.POSICAO_UF]]
+    conn.rollback()
+    conn.close()
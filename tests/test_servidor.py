@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+COPY no servidor × leitor do cliente (RFB_TESTE_CONN, banco na mesma máquina que o teste):
+as mesmas linhas chegam à partição mensal pelos dois caminhos.
+Linhas sintéticas com DV 'XX'; a partição de 2099-01 é apagada no final.
+"""
+import os, shutil, tempfile
+
+import pytest
+
+CONN = os.environ.get("RFB_TESTE_CONN")
+pytestmark = pytest.mark.skipif(not CONN, reason="defina RFB_TESTE_CONN (banco descartável) para rodar")
+
+MES = "2099-01"
+
+
+def _campos(n, nome):
+    return [f'"{c}"' for c in (f"97{n:06d}", "0001", "XX", "1")] + [nome] + ['""'] * 25
+
+
+# Aspas duplicadas, aspas no meio e ';' dentro do campo: CSV válido para o COPY
+# (sem CNPJ repetido: com DV 'XX' o dedup do cliente deixa passar, o DISTINCT ON não)
+VALIDAS = [
+    _campos(1, '"NORMAL; COM PONTO"'),
+    _campos(2, '"FANTASIA ""X"" 1"'),
+    _campos(3, '"AB"C'),
+    _campos(4, '"""ASPAS"""'),
+    _campos(5, '"SEM FANTASIA"'),
+]
+
+
+@pytest.fixture
+def pasta(monkeypatch):
+    from rfb_etl import comum
+    monkeypatch.setattr(comum, "CONN_STRING", CONN)
+    # O processo do banco roda com outro usuário: a pasta precisa ser legível por ele
+    caminho = tempfile.mkdtemp(prefix="rfb_servidor_")
+    os.chmod(caminho, 0o755)
+    yield caminho
+    shutil.rmtree(caminho)
+    conn = comum.conectar_db()
+    conn.cursor().execute("DROP TABLE IF EXISTS estabelecimentos_mensal_2099_01")
+    conn.commit()
+    conn.close()
+
+
+def _csv(pasta, linhas):
+    caminho = os.path.join(pasta, "ESTABELE.csv")
+    with open(caminho, "wb") as f:
+        f.write("".join(";".join(campos) + "\n" for campos in linhas).encode("latin-1"))
+    os.chmod(caminho, 0o644)
+    return caminho
+
+
+def _carregar(pasta, csv, servidor):
+    from rfb_etl import comum, perfis
+    from rfb_etl.motor import montar_opcoes, processar_arquivo
+    conn = comum.conectar_db()
+    perfis.preparar_particao(conn, MES)
+    opcoes = montar_opcoes("mensal", csv_local=csv, servidor_dir=pasta if servidor else None)
+    resultado = processar_arquivo(MES, 0, opcoes)
+    cursor = conn.cursor()
+    cursor.execute("SELECT cnpj_basico, nome_fantasia, situacao_cadastral FROM estabelecimentos_mensal_2099_01 "
+                   "ORDER BY cnpj_basico")
+    linhas = cursor.fetchall()
+    conn.close()
+    return resultado, linhas
+
+
+def test_copy_no_servidor_entrega_as_mesmas_linhas_que_o_cliente(pasta):
+    csv = _csv(pasta, VALIDAS)
+    resultado, servidor = _carregar(pasta, csv, servidor=True)
+    _, cliente = _carregar(pasta, csv, servidor=False)
+
+    assert resultado["servidor"] is True
+    assert servidor == cliente
+    assert [nome for _, nome, _ in servidor] == ["NORMAL; COM PONTO", 'FANTASIA "X" 1', "ABC", "ASPAS", "SEM FANTASIA"]
+
+
+@pytest.mark.parametrize("ruim", [
+    ['"97000006"', '"0001"', '"XX"', '"1"', '"CURTA"'],
+    _campos(6, '"LONGA"') + ['"EXTRA"'],
+    _campos(6, 'AB"C'),
+], ids=["curta", "longa", "aspas-soltas"])
+def test_linha_que_o_copy_recusa_vai_para_o_cliente(pasta, ruim):
+    csv = _csv(pasta, VALIDAS + [ruim])
+    resultado, servidor = _carregar(pasta, csv, servidor=True)
+    _, cliente = _carregar(pasta, csv, servidor=False)
+
+    assert resultado["servidor"] is False
+    assert servidor == cliente
+    assert len(servidor) == 6
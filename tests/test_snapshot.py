@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshots contra um PostgreSQL descartável (RFB_TESTE_CONN): snapshot pronto/revertido não é
+apagado por outra carga do mês e a troca da view não derruba quem depende dela.
+Usa o mês 2099-03 e uma view própria no lugar de estabelecimentos_atual; tudo é apagado no final.
+"""
+import os
+
+import pytest
+
+CONN = os.environ.get("RFB_TESTE_CONN")
+pytestmark = pytest.mark.skipif(not CONN, reason="defina RFB_TESTE_CONN (banco descartável) para rodar")
+
+MES = "2099-03"
+VISAO = "rfb_teste_atual"
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    from rfb_etl import comum, snapshot
+    monkeypatch.setattr(comum, "CONN_STRING", CONN)
+    monkeypatch.setattr(snapshot, "VISAO", VISAO)
+    conexao = comum.conectar_db()
+
+    def limpar():
+        cursor = conexao.cursor()
+        cursor.execute(f"DROP VIEW IF EXISTS {VISAO}_dependente, {VISAO}")
+        snapshot.criar_esquema(conexao)
+        cursor.execute("SELECT tabela FROM rfb_snapshots WHERE mes_ano = %s", (MES,))
+        for tabela, in cursor.fetchall():
+            cursor.execute(f'DROP TABLE IF EXISTS "{tabela}"')
+        cursor.execute("DELETE FROM rfb_snapshots WHERE mes_ano = %s", (MES,))
+        conexao.commit()
+
+    limpar()
+    yield conexao
+    limpar()
+    conexao.close()
+
+
+def _marcar(conn, tabela, estado):
+    cursor = conn.cursor()
+    cursor.execute("UPDATE rfb_snapshots SET estado = %s, publicado_em = NOW() WHERE tabela = %s", (estado, tabela))
+    conn.commit()
+
+
+def _existe(conn, tabela):
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (tabela,))
+    existe = cursor.fetchone()[0]
+    conn.commit()
+    return existe
+
+
+@pytest.mark.parametrize("estado", ["pronto", "revertido"])
+def test_snapshot_republicavel_nao_e_apagado(conn, estado):
+    from rfb_etl import snapshot
+    nome = snapshot.preparar(conn, MES)
+    _marcar(conn, nome, estado)
+
+    with pytest.raises(RuntimeError, match="--substituir-snapshot"):
+        snapshot.preparar(conn, MES)
+    assert _existe(conn, nome)
+
+    assert snapshot.preparar(conn, MES, substituir=True) == nome
+    cursor = conn.cursor()
+    cursor.execute("SELECT estado FROM rfb_snapshots WHERE tabela = %s", (nome,))
+    assert cursor.fetchone() == ("construindo",)
+    conn.commit()
+
+
+def test_publicado_ganha_nova_versao(conn):
+    from rfb_etl import snapshot
+    nome = snapshot.preparar(conn, MES)
+    _marcar(conn, nome, "publicado")
+    assert snapshot.preparar(conn, MES) == f"{nome}_v2"
+    assert _existe(conn, nome)
+
+
+def test_troca_da_view_mantem_dependentes(conn):
+    from rfb_etl import snapshot
+    primeiro = snapshot.preparar(conn, MES)
+    _marcar(conn, primeiro, "publicado")
+    segundo = snapshot.preparar(conn, MES)
+    _marcar(conn, segundo, "pronto")
+
+    snapshot._trocar_visao(conn, primeiro).close()
+    conn.commit()
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE VIEW {VISAO}_dependente AS SELECT cnpj_completo FROM {VISAO}")
+    conn.commit()
+
+    snapshot._trocar_visao(conn, segundo).close()
+    conn.commit()
+    assert _existe(conn, f"{VISAO}_dependente")
+
+    # Colunas que o REPLACE não aceita: erro claro e a view continua na tabela anterior
+    cursor.execute(f'ALTER TABLE "{primeiro}" DROP COLUMN nome_fantasia')
+    conn.commit()
+    with pytest.raises(RuntimeError, match="view mantida"):
+        snapshot._trocar_visao(conn, primeiro)
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_get_viewdef(%s::regclass)", (VISAO,))
+    assert f"FROM {segundo}" in cursor.fetchone()[0]
+    assert _existe(conn, f"{VISAO}_dependente")
+    conn.commit()